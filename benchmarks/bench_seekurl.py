@@ -0,0 +1,163 @@
+"""Benchmark libtts.seekURL against the original recursive implementation.
+
+Usage: python benchmarks/bench_seekurl.py [SAVE.json ...]
+
+Without arguments, a synthetic save with deeply nested bags is generated.
+Both walkers must produce the same (trail, url) stream; the script aborts
+otherwise.
+"""
+
+from tts_tools.libtts import ALL_VALID_EXTS
+from tts_tools.libtts import seekURL
+
+import argparse
+import json
+import re
+import timeit
+
+
+def legacy_seekURL(dic, trail=[], done=None):
+    """The recursive seekURL as it shipped before the explicit-stack
+    walker."""
+
+    if done is None:
+        done = set()
+
+    for k, v in dic.items():
+
+        newtrail = trail + [k]
+
+        if k == "AudioLibrary":
+            for elem in v:
+                try:
+                    url = elem["Item1"]
+                    if url in done:
+                        continue
+                    done.add(url)
+                    yield (newtrail, url)
+                except KeyError:
+                    raise NotImplementedError(
+                        "AudioLibrary has unexpected structure: {}".format(v)
+                    )
+
+        elif isinstance(v, dict):
+            yield from legacy_seekURL(v, newtrail, done)
+
+        elif isinstance(v, list):
+            for elem in v:
+                if not isinstance(elem, dict):
+                    continue
+                yield from legacy_seekURL(elem, newtrail, done)
+
+        elif k.lower().endswith("url"):
+            if k == "PageURL":
+                continue
+            if not v:
+                continue
+            v = re.sub(r"{.*}", "", v)
+            if v in done:
+                continue
+            done.add(v)
+            yield (newtrail, v)
+
+        elif k == "LuaScript":
+            NO_EXT_SITES = ['steamusercontent.com', 'pastebin.com', 'paste.ee', 'drive.google.com', 'steamuserimages-a.akamaihd.net',]
+            url_matches = re.findall(r'((?:http|https):\/\/(?:[\w\-_]+(?:(?:\.[\w\-_]+)+))(?:[\w\-\.,@?^=%&:/~\+#]*[\w\-\@?^=%&/~\+#])?)', v)
+            for url in url_matches:
+                valid_url = False
+                for site in NO_EXT_SITES:
+                    if url.lower().find(site) >= 0:
+                        valid_url = True
+                        break
+                else:
+                    for ext in ALL_VALID_EXTS:
+                        if url.lower().find(ext.lower()) >= 0:
+                            valid_url = True
+                            break
+
+                if valid_url:
+                    if url in done:
+                        continue
+                    done.add(url)
+                    yield (newtrail, url)
+
+
+def make_object(n, depth, fanout):
+    """Return a TTS object with `fanout` contained objects per level, down
+    to `depth` levels of bags."""
+
+    obj = {
+        "GUID": f"{n:06x}",
+        "Name": "Custom_Model",
+        "Transform": {"posX": 0.0, "posY": 1.0, "posZ": 0.0},
+        "Nickname": f"Object {n}",
+        "Tags": ["a", "b"],
+        "CustomMesh": {
+            "MeshURL": f"http://example.com/mesh/{n % 97}.obj",
+            "DiffuseURL": f"http://example.com/tex/{n % 89}.png{{meta}}",
+            "NormalURL": "",
+            "ColliderURL": "",
+        },
+        "LuaScript": (
+            "function onLoad()\n"
+            f"  self.setCustomObject({{image='http://example.com/s/{n % 13}.jpg'}})\n"
+            "end\n"
+        ) * 5,
+        "LuaScriptState": "",
+    }
+    if depth > 0:
+        obj["ContainedObjects"] = [
+            make_object(n * fanout + i + 1, depth - 1, fanout)
+            for i in range(fanout)
+        ]
+    return obj
+
+
+def make_save(objects=200, depth=4, fanout=3):
+    return {
+        "SaveName": "Benchmark",
+        "TableURL": "http://example.com/table.png",
+        "SkyURL": "http://example.com/sky.png",
+        "TabletState": {"PageURL": "http://example.com/page"},
+        "AudioLibrary": [
+            {"Item1": f"http://example.com/audio/{i}.mp3", "Item2": str(i)}
+            for i in range(20)
+        ],
+        "ObjectStates": [make_object(i, depth, fanout) for i in range(objects)],
+    }
+
+
+def bench(name, save, number):
+    legacy = list(legacy_seekURL(save))
+    current = list(seekURL(save))
+    if legacy != current:
+        raise SystemExit(f"{name}: walkers disagree!")
+
+    t_legacy = min(timeit.repeat(lambda: list(legacy_seekURL(save)), number=number, repeat=3)) / number
+    t_current = min(timeit.repeat(lambda: list(seekURL(save)), number=number, repeat=3)) / number
+
+    print(
+        f"{name}: {len(current)} URLs, "
+        f"legacy {t_legacy * 1000:.1f} ms, "
+        f"current {t_current * 1000:.1f} ms "
+        f"({t_legacy / t_current:.2f}x)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("saves", metavar="SAVE", nargs="*")
+    parser.add_argument("--number", "-n", type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.saves:
+        bench("synthetic", make_save(), args.number)
+
+    for filename in args.saves:
+        with open(filename, "r", encoding="utf-8") as infile:
+            save = json.load(infile, strict=False)
+        bench(filename, save, args.number)
+
+
+if __name__ == "__main__":
+    main()
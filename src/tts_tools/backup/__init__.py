@@ -1,23 +1,35 @@
+from tts_tools.libassets import AssetGraph
+from tts_tools.libcache import open_cache_index
+from tts_tools.libjournal import open_journal
+from tts_tools.libstore import AssetStore
+from tts_tools.libstore import StoreZipFile
 from tts_tools.libtts import get_fs_path
-from tts_tools.libtts import GAMEDATA_DEFAULT
+from tts_tools.libtts import get_gamedata_default
 from tts_tools.libtts import IllegalSavegameException
-from tts_tools.libtts import urls_from_save
-from tts_tools.libtts import get_save_name
+from tts_tools.libtts import plan_saves
+from tts_tools.libtts import SaveDocument
 from tts_tools.libtts import recodeURL
+from tts_tools.util import CompressionPolicy
+from tts_tools.util import CompressionStats
+from tts_tools.util import format_size
 from tts_tools.util import print_err
-from tts_tools.util import ZipFile
 from tts_tools.util import make_safe_filename
-from tts_tools.util import save_modification_time
 from tts_tools.util import get_mods_in_directory
+from tts_tools.util import IncrementalZipFile
+from tts_tools.util import ResumableZipFile
 from tts_tools.util import PrintStatus
+from tts_tools.util import SnapshotDir
+from tts_tools.util import TarFile
 
 import os
 import re
 import sys
 import glob
-
-from alive_progress import alive_bar; import time, logging
+import shutil
+import time
+import itertools
 from contextlib import nullcontext
+from contextlib import redirect_stdout
 
 def backup_json(
     infile_name,
@@ -25,13 +37,35 @@ def backup_json(
     outfile_name,
     comment='',
     dry_run=False,
-    gamedata_dir=GAMEDATA_DEFAULT,
+    gamedata_dir=None,
     ignore_missing=False,
     deflate=False,
     verbose=False,
+    stream=False,
+    cache=None,
+    save=None,
+    graph=None,
+    compress_jobs=None,
+    store=None,
+    incremental=False,
+    auto_compress=False,
+    stats=None,
+    archive_format="zip",
+    outfile_stream=None,
+    progress=True,
+    assets=None,
 ):
+    if gamedata_dir is None:
+        gamedata_dir = get_gamedata_default()
+
+    if compress_jobs is None:
+        compress_jobs = os.cpu_count() or 1
+
+    if save is None:
+        save = SaveDocument(infile_name, stream=stream)
+
     try:
-        save_name = get_save_name(infile_name)
+        save_name = save.save_name
     except Exception:
         save_name = "???"
 
@@ -41,7 +75,7 @@ def backup_json(
         print(readable_filename)
 
     try:
-        urls = urls_from_save(infile_name)
+        urls = save.urls()
     except (FileNotFoundError, IllegalSavegameException) as error:
         errmsg = "Could not read URLs from '{file}': {error}".format(
             file=infile_name, error=error
@@ -64,26 +98,71 @@ def backup_json(
         outfile_name = os.path.join(out_dir, outfile_name)
     else:
         try:
-            outfile_basename = get_save_name(infile_name)
+            outfile_basename = save.save_name
             # Make the filename safe (i.e. remove crazy characters)
             outfile_basename = make_safe_filename(outfile_basename)
         except Exception:
             outfile_basename = re.sub(
                 r"\.json$", "", os.path.basename(infile_name)
             )
-        outfile_name = f"{os.path.join(out_dir, outfile_basename)} [{os.path.splitext(os.path.basename(infile_name))[0]}].zip"
+        outfile_name = f"{os.path.join(out_dir, outfile_basename)} [{os.path.splitext(os.path.basename(infile_name))[0]}]{archive_ext(archive_format, deflate)}"
+
+    # Without progress (e.g. in a worker process), nothing is printed per
+    # file.
+    show_bar = progress and not verbose
+    if show_bar:
+        from alive_progress import alive_bar
+
+    # When streaming the archive to stdout, progress goes to stderr.
+    bar_kwargs = dict(file=sys.stderr) if outfile_stream is not None else {}
 
     urls = list(urls)
-    with alive_bar(len(urls), dual_line=True, title=readable_filename, unit=' files') if not verbose else nullcontext() as bar:
-        ps = PrintStatus(bar)
+    with alive_bar(len(urls), dual_line=True, title=readable_filename, unit=' files', **bar_kwargs) if show_bar else nullcontext() as bar:
+        ps = PrintStatus(bar, verbose=verbose or show_bar)
+        mode = "w"
+        zipfile_kwargs = {}
+        # Archives are written under a temporary name, and only renamed
+        # once complete.
+        partial_name = outfile_name + ".partial"
+        if archive_format == "tar":
+            zipfile_class = TarFile
+        elif archive_format == "snapshot":
+            # Snapshots are put together under a temporary name already.
+            zipfile_class = SnapshotDir
+            partial_name = outfile_name
+        elif store is not None:
+            # Assets go into the store, and the Zip only refers to them.
+            zipfile_class = StoreZipFile
+            zipfile_kwargs = dict(store=store)
+        elif incremental and not dry_run:
+            zipfile_class = IncrementalZipFile
+            mode = "a"
+            # Pick up the previous backup, even if it was renamed for
+            # missing files.
+            if not os.path.exists(outfile_name):
+                base, ext = split_archive_ext(outfile_name)
+                previous = renamed_backups(base, ext, archive_format)
+                if previous:
+                    os.rename(previous[0], outfile_name)
+            # The existing backup is updated in place.
+            partial_name = outfile_name
+        else:
+            # An interrupted backup is continued where it stopped.
+            zipfile_class = ResumableZipFile
+
         try:
-            zipfile = ZipFile(
-                outfile_name,
-                "w",
+            zipfile = zipfile_class(
+                partial_name if outfile_stream is None else outfile_stream,
+                mode,
                 dry_run=dry_run,
                 ignore_missing=ignore_missing,
                 deflate=deflate,
                 ps=ps,
+                cache=cache,
+                jobs=compress_jobs,
+                policy=CompressionPolicy() if auto_compress else None,
+                stats=stats,
+                **zipfile_kwargs,
             )
         except FileNotFoundError as error:
             errmsg = "Could not write to Zip archive '{outfile}': {error}".format(
@@ -92,21 +171,33 @@ def backup_json(
             print_err(errmsg)
             sys.exit(1)
 
-        num_missing = 0
+        if getattr(zipfile, "num_recovered", 0):
+            ps.print(f"Resuming with {zipfile.num_recovered} files written before.")
+
         with zipfile as outfile:
             for path, url in urls:
 
-                if not verbose:
+                if show_bar:
                     bar()
 
-                filename = get_fs_path(path, url)
+                if graph is None:
+                    filename = get_fs_path(path, url, cache)
+                else:
+                    # Shared assets are only resolved once per run.
+                    asset = graph.add(infile_name, path, url)
+                    if not asset.resolved:
+                        asset.path = get_fs_path(path, url, cache)
+                        asset.resolved = True
+                    filename = asset.path
 
                 if filename is None:
                     filename = recodeURL(url)
 
+                if assets is not None:
+                    assets.append(filename)
+
                 try:
-                    if outfile.write(filename) is not None:
-                        num_missing += 1
+                    outfile.write(filename)
 
                 except FileNotFoundError as error:
                     errmsg = "Could not write {filename} to Zip ({error}).".format(
@@ -123,31 +214,47 @@ def backup_json(
             outfile.write(infile_name, os.path.join("Mods/Workshop", os.path.basename(infile_name)))
 
             # Check if there is a thumbnail for the mod
-            thumb_filename = os.path.splitext(infile_name)[0] + ".png"
-            if os.path.exists(thumb_filename):
+            thumb_filename = save.thumbnail
+            if thumb_filename is not None:
                 outfile.write(thumb_filename, os.path.join("Mods/Workshop", os.path.basename(thumb_filename)))
 
             # Store some metadata.
             outfile.put_metadata(comment=comment)
-    
+
+    # Files which are compressed in the background may only turn out to be
+    # missing once they are written, so count them afterwards.
+    num_missing = zipfile.num_missing
+
     if dry_run:
         if verbose:
             print("Dry run for {file} completed.".format(file=infile_name))
+    elif outfile_stream is not None:
+        zipfile.close()
+        outfile_stream.flush()
+
+        if verbose:
+            print("Backed-up contents for {file} to stdout.".format(file=infile_name))
     else:
         zipfile.close()
 
+        if partial_name != outfile_name:
+            os.replace(partial_name, outfile_name)
+
         # Check if we have any old zipfiles for this mod with filename used with missing files
-        glob_path = glob.escape(f"{os.path.splitext(outfile_name)[0]}")
-        old_files = glob.glob(f"{glob_path} (-*{os.path.splitext(outfile_name)[1]}")
+        base, ext = split_archive_ext(outfile_name, archive_format)
+        old_files = renamed_backups(base, ext, archive_format)
 
         if len(old_files) > 0:
             for f_name in old_files:
-                os.remove(f_name)
+                if os.path.isdir(f_name):
+                    shutil.rmtree(f_name)
+                else:
+                    os.remove(f_name)
 
         # Modify backup filename to include number of missing files detected
         if num_missing > 0:
-            new_name = f"{os.path.splitext(outfile_name)[0]} (-{num_missing}){os.path.splitext(outfile_name)[1]}"
-            os.rename(outfile_name, new_name)
+            new_name = f"{base} (-{num_missing}){ext}"
+            os.replace(outfile_name, new_name)
             outfile_name = new_name
 
         if verbose:
@@ -156,13 +263,208 @@ def backup_json(
                     file=infile_name, outfile=outfile_name
                 )
             )
+            if archive_format == "snapshot":
+                print(
+                    "Reflinked {reflink}, hard-linked {hardlink} and copied {copy} files.".format(
+                        **{how: zipfile.counts[how] for how in ["reflink", "hardlink", "copy"]}
+                    )
+                )
+
+    return outfile_name
+
+def archive_ext(archive_format, deflate):
+    """Return the file name extension for backups in `archive_format`."""
+
+    if archive_format == "tar":
+        return ".tar.gz" if deflate else ".tar"
+    if archive_format == "snapshot":
+        return ""
+    return ".zip"
+
+
+def split_archive_ext(filename, archive_format="zip"):
+    """Split a backup's file name into its base name and extension, keeping
+    double extensions like .tar.gz together."""
+
+    if archive_format == "snapshot":
+        return filename, ""
+
+    base, ext = os.path.splitext(filename)
+    if ext == ".gz" and base.endswith(".tar"):
+        return base[:-4], ".tar" + ext
+    return base, ext
+
+
+def renamed_backups(base, ext, archive_format="zip"):
+    """Return the backups in `archive_format` named after `base` and
+    `ext`, which were renamed for their number of missing files.
+
+    Snapshots have no extension, so the pattern matches backups in any
+    format; only directories are theirs.
+
+    """
+
+    names = glob.glob(f"{glob.escape(base)} (-*{ext}")
+    if archive_format == "snapshot":
+        return [name for name in names if os.path.isdir(name)]
+    return [name for name in names if not os.path.isdir(name)]
+
+
+# The cache index and asset store of a worker process.
+_worker_cache = None
+_worker_store = None
+
+
+def _init_backup_worker(gamedata_dir, cache_index, persistent, store_dir):
+
+    global _worker_cache, _worker_store
+
+    _worker_cache = open_cache_index(gamedata_dir, cache_index, persistent)
+    if store_dir:
+        _worker_store = AssetStore(store_dir)
+
+
+def _backup_in_worker(infile_name, out_dir, options, collect_urls):
+
+    stats = CompressionStats()
+    assets = []
+    save = SaveDocument(infile_name, stream=options["stream"])
+    outfile_name = backup_json(
+        infile_name,
+        out_dir,
+        '',
+        cache=_worker_cache,
+        save=save,
+        store=_worker_store,
+        stats=stats,
+        progress=False,
+        assets=assets,
+        **options,
+    )
+
+    if outfile_name is not None and os.path.isfile(outfile_name):
+        size = os.path.getsize(outfile_name)
+    else:
+        size = 0
+
+    return dict(
+        outfile_name=outfile_name,
+        size=size,
+        stats=stats.kinds,
+        assets=assets,
+        urls=list(save.urls()) if collect_urls else None,
+    )
+
+
+def backup_files_in_pool(
+    args, infile_names, out_dir, options, stats, graph, cache, journal
+):
+    """Back up several mods at once, in a pool of `args.jobs` processes,
+    showing the progress over all of them."""
+
+    from concurrent.futures import as_completed
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not args.verbose:
+        from alive_progress import alive_bar
+
+    # Each process gets a share of the CPUs for compressing.
+    if options["compress_jobs"] is None:
+        options = dict(
+            options,
+            compress_jobs=max(1, (os.cpu_count() or 1) // args.jobs),
+        )
+    # Messages of several mods at once would only be confusing.
+    options = dict(options, verbose=False)
+
+    executor = ProcessPoolExecutor(
+        args.jobs,
+        initializer=_init_backup_worker,
+        initargs=(
+            os.path.abspath(args.gamedata_dir),
+            args.cache_index,
+            not args.no_cache_index,
+            args.store,
+        ),
+    )
+
+    with executor:
+        futures = {
+            executor.submit(
+                _backup_in_worker,
+                infile_name,
+                out_dir,
+                options,
+                bool(args.asset_graph),
+            ): infile_name
+            for infile_name in infile_names
+        }
+
+        start = time.monotonic()
+        total_size = 0
+        with alive_bar(len(futures), title="Backing up", unit=' mods') if not args.verbose else nullcontext() as bar:
+            for done, future in enumerate(as_completed(futures), 1):
+                infile_name = futures[future]
+                try:
+                    result = future.result()
+                except (FileNotFoundError, IllegalSavegameException, SystemExit):
+                    for other in futures:
+                        other.cancel()
+                    print_err(f"Backing up {infile_name} failed.", "Aborting.", sep="\n")
+                    sys.exit(1)
+
+                # Only this process keeps track of backed-up mods.
+                if not args.dry_run:
+                    journal.record(infile_name, result["assets"], cache)
+
+                stats.update(result["stats"])
+
+                if result["urls"] is not None:
+                    for path, url in result["urls"]:
+                        graph.add(infile_name, path, url)
+
+                total_size += result["size"]
+                rate = format_size(total_size / max(time.monotonic() - start, 1e-3))
+                if args.verbose:
+                    print(f"[{done}/{len(futures)}] {infile_name} -> {result['outfile_name']} ({rate}/s)")
+                else:
+                    bar.text(f"{os.path.basename(infile_name)}: {format_size(result['size'])}, {rate}/s")
+                    bar()
+
+
+def backup_files(args, outfile_stream=None):
+
+    if args.gamedata_dir is None:
+        args.gamedata_dir = get_gamedata_default()
+
+    if args.outfile_name == "-" and outfile_stream is None:
+        if args.backup_all:
+            print_err("Cannot write several backups to stdout.")
+            sys.exit(1)
+        if args.incremental or args.store:
+            print_err("--incremental and --store need an output file.")
+            sys.exit(1)
+        if args.archive_format == "snapshot":
+            print_err("Snapshots cannot be written to stdout.")
+            sys.exit(1)
+
+        # Write the archive to stdout, and any output to stderr instead.
+        outfile_stream = sys.stdout.buffer
+        with redirect_stdout(sys.stderr):
+            backup_files(args, outfile_stream)
+        return
 
-def backup_files(args):
+    if args.archive_format != "zip" and (args.incremental or args.store):
+        print_err("--incremental and --store only work with Zip files.")
+        sys.exit(1)
 
     outfile_name = args.outfile_name
     orig_path = os.getcwd()
     out_dir = orig_path
 
+    if outfile_stream is not None:
+        outfile_name = ''
+
     if outfile_name:
         # We need to determine if outfile_name is a directory or filename
         # also determine if the path is absolute or relative to current directory
@@ -176,6 +478,18 @@ def backup_files(args):
         if not os.path.isabs(out_dir):
             out_dir = os.path.join(orig_path, out_dir)
 
+    # Resolve cached files against a single listing of the cache.
+    cache = open_cache_index(
+        os.path.abspath(args.gamedata_dir),
+        args.cache_index,
+        persistent=not args.no_cache_index,
+    )
+
+    if outfile_stream is None:
+        journal = open_journal(out_dir, 'backup')
+    else:
+        journal = None
+
     if args.backup_all:
         infile_names = []
         outfile_name = ''
@@ -186,31 +500,93 @@ def backup_files(args):
             print_err(f"Cannot find directory {infile_dir}")
             sys.exit(1)
         else:
-            infile_names += get_mods_in_directory(infile_dir, os.path.join(out_dir, 'backup_mtimes.pkl'))
+            infile_names += get_mods_in_directory(infile_dir, journal, cache)
     else:
         infile_names = [args.infile_name]
 
-    for infile_name in infile_names:
+    if args.store:
+        store = AssetStore(args.store)
+    else:
+        store = None
 
-        if not os.path.exists(infile_name):
-            infile_name = os.path.join(os.path.join(args.gamedata_dir, 'Mods/Workshop'), infile_name)
+    stats = CompressionStats()
 
-        try:
-            backup_json(
-                infile_name,
-                out_dir,
-                outfile_name,
-                comment=args.comment,
-                dry_run=args.dry_run,
-                gamedata_dir=args.gamedata_dir,
-                ignore_missing=args.ignore_missing,
-                deflate=args.deflate,
-                verbose=args.verbose
-            )
+    graph = AssetGraph()
+    if args.asset_graph:
+        # We change directories along the way.
+        graph_filename = os.path.abspath(args.asset_graph)
 
-        except (FileNotFoundError, IllegalSavegameException, SystemExit):
-            print_err("Aborting.")
-            sys.exit(1)
-        
-        if not args.dry_run:
-            save_modification_time(infile_name, os.path.join(out_dir, 'backup_mtimes.pkl'))
\ No newline at end of file
+    options = dict(
+        comment=args.comment,
+        dry_run=args.dry_run,
+        gamedata_dir=args.gamedata_dir,
+        ignore_missing=args.ignore_missing,
+        deflate=args.deflate,
+        verbose=args.verbose,
+        stream=args.stream,
+        compress_jobs=args.compress_jobs,
+        incremental=args.incremental,
+        auto_compress=args.auto_compress,
+        archive_format=args.archive_format,
+    )
+
+    # Absolute paths, since we change directories along the way.
+    infile_names = [
+        os.path.abspath(
+            infile_name
+            if os.path.exists(infile_name)
+            else os.path.join(os.path.join(args.gamedata_dir, 'Mods/Workshop'), infile_name)
+        )
+        for infile_name in infile_names
+    ]
+
+    if args.backup_all and args.jobs > 1 and len(infile_names) > 1:
+        backup_files_in_pool(
+            args, infile_names, out_dir, options, stats, graph, cache, journal
+        )
+    else:
+        if args.backup_all:
+            # Parse the mods and extract their URLs in parallel, ahead of
+            # backing them up one after another.
+            saves = plan_saves(infile_names, args.parse_jobs, stream=args.stream)
+        else:
+            saves = itertools.repeat(None)
+
+        for infile_name, save in zip(infile_names, saves):
+
+            assets = []
+            try:
+                backup_json(
+                    infile_name,
+                    out_dir,
+                    outfile_name,
+                    cache=cache,
+                    save=save,
+                    graph=graph,
+                    store=store,
+                    stats=stats,
+                    outfile_stream=outfile_stream,
+                    assets=assets,
+                    **options,
+                )
+
+            except (FileNotFoundError, IllegalSavegameException, SystemExit):
+                print_err("Aborting.")
+                sys.exit(1)
+
+            if not (args.dry_run or outfile_stream is not None):
+                journal.record(infile_name, assets, cache)
+
+    if store is not None:
+        store.close()
+
+    if journal is not None:
+        journal.close()
+
+    if (args.deflate or args.auto_compress) and args.archive_format == "zip" and not args.dry_run:
+        print("Compression summary:")
+        for line in stats.summary():
+            print(f"  {line}")
+
+    if args.asset_graph:
+        graph.export(graph_filename)
@@ -1,10 +1,9 @@
 from tts_tools.backup import backup_files
-from tts_tools.libtts import GAMEDATA_DEFAULT
+from tts_tools.util import VersionAction
 
 import argparse
 import signal
 import sys
-from importlib.metadata import version
 
 description = '''
 TTS-Backup
@@ -30,8 +29,9 @@ of the directory
 (e.g. D:\SteamLibrary\steamapps\common\Tabletop Simulator\Tabletop Simulator_Data)
 
 When a backup is completed, the mod file's modification time is stored in the
-'backup_mtimes.pkl' file contained in the backup directory (or current directory
-if no backup directory was specified).
+'backup_journal.sqlite' file contained in the backup directory (or current directory
+if no backup directory was specified), along with the cached files the mod
+refers to and their sizes.
 
 If any files are found to be missing during the backup operation a text
 file containing a list of the missing files will be created in the root
@@ -46,7 +46,7 @@ This will backup Mods/Workshop/2495129405.json
 > tts-backup -a Workshop
 This will backup all json files found in the Mods/Workshop directory
 if their modification time is newer than what is found in the
-Mods/Workshop/backup_mtimes.pkl file.
+backup_journal.sqlite file, or if their cached files changed.
 
 Usage flags and arguments are as follows:
 '''
@@ -58,8 +58,7 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument(
     "--version",
-    action='version',
-    version=version("tts-backup")
+    action=VersionAction,
 )
 
 parser.add_argument(
@@ -81,7 +80,7 @@ parser.add_argument(
     "--gamedata",
     dest="gamedata_dir",
     metavar="PATH",
-    default=GAMEDATA_DEFAULT,
+    default=None,
     help="The path to the TTS game data dircetory.",
 )
 
@@ -91,7 +90,7 @@ parser.add_argument(
     dest="outfile_name",
     metavar="FILENAME",
     default=None,
-    help="The name (or directory for multiple backups) for the output archive.",
+    help="The name (or directory for multiple backups) for the output archive; - writes it to stdout.",
 )
 
 parser.add_argument(
@@ -129,6 +128,99 @@ parser.add_argument(
     help="Enable zlib compression in the zip file",
 )
 
+parser.add_argument(
+    "--format",
+    dest="archive_format",
+    choices=["zip", "tar", "snapshot"],
+    default="zip",
+    help="The archive format; tar archives are gzipped with --deflate, and snapshots are directories of links to the cached files (default: zip).",
+)
+
+parser.add_argument(
+    "--auto-compress",
+    dest="auto_compress",
+    default=False,
+    action="store_true",
+    help="Only compress files which compress well, judging by their type (or a quick probe), instead of all or none.",
+)
+
+parser.add_argument(
+    "--compress-jobs",
+    dest="compress_jobs",
+    metavar="N",
+    default=None,
+    type=int,
+    help="Number of threads which read and compress files with --deflate or --auto-compress (default: one per CPU).",
+)
+
+parser.add_argument(
+    "--stream",
+    dest="stream",
+    default=False,
+    action="store_true",
+    help="Read saves incrementally instead of loading them whole (uses less memory, but is slower).",
+)
+
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    metavar="N",
+    default=1,
+    type=int,
+    help="Number of mods which are backed up at once with --backup_all, in as many processes (default: 1).",
+)
+
+parser.add_argument(
+    "--parse-jobs",
+    dest="parse_jobs",
+    metavar="N",
+    default=None,
+    type=int,
+    help="Number of processes which parse mods ahead of time with --backup_all (default: one per CPU).",
+)
+
+parser.add_argument(
+    "--cache-index",
+    dest="cache_index",
+    metavar="FILENAME",
+    default=None,
+    help="Where to keep the index of the TTS cache between runs (default: in the user cache directory).",
+)
+
+parser.add_argument(
+    "--no-cache-index",
+    dest="no_cache_index",
+    default=False,
+    action="store_true",
+    help="Do not keep an index of the TTS cache between runs.",
+)
+
+parser.add_argument(
+    "--asset-graph",
+    dest="asset_graph",
+    metavar="FILENAME",
+    default=None,
+    help="Write which mods use which assets to FILENAME (as JSON).",
+)
+
+parser.add_argument(
+    "--incremental",
+    "-u",
+    dest="incremental",
+    default=False,
+    action="store_true",
+    help="Update an existing backup in place, only writing files which changed.",
+)
+
+parser.add_argument(
+    "--store",
+    dest="store",
+    metavar="DIR",
+    default=None,
+    help="Put assets into the content-addressed store in DIR, and only refer to them from the backups (see tts-export).",
+)
+
 parser.add_argument(
     "--verbose",
     "-v",
@@ -0,0 +1,39 @@
+from tts_tools.libstore import export_backup
+from tts_tools.util import print_err
+
+import os
+import sys
+
+
+def export_files(args):
+
+    outfile_name = args.outfile_name
+    if outfile_name and os.path.isdir(outfile_name):
+        out_dir = outfile_name
+        outfile_name = ''
+    else:
+        out_dir = os.getcwd()
+
+    if outfile_name and len(args.infile_names) > 1:
+        print_err("Use a directory as output name when exporting several backups.")
+        sys.exit(1)
+
+    for infile_name in args.infile_names:
+
+        target = outfile_name or os.path.join(out_dir, os.path.basename(infile_name))
+        if os.path.abspath(target) == os.path.abspath(infile_name):
+            print_err(f"Not overwriting {infile_name} with its export. Use --outname.")
+            sys.exit(1)
+
+        try:
+            export_backup(
+                infile_name,
+                target,
+                store_dir=args.store,
+                deflate=args.deflate,
+            )
+        except (OSError, ValueError) as error:
+            print_err(f"Could not export {infile_name}: {error}")
+            sys.exit(1)
+
+        print(f"Exported {infile_name} to {target}.")
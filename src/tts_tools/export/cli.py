@@ -0,0 +1,77 @@
+from tts_tools.export import export_files
+from tts_tools.util import VersionAction
+
+import argparse
+import signal
+import sys
+
+description = '''
+TTS-Export
+==========
+TTS-Export turns backups made by ``tts-backup --store`` into
+self-contained Zip files, as made by ``tts-backup`` without it.
+
+Such backups only refer to their assets, which are kept once in the
+store. The export copies them from the store into the Zip file.
+
+Examples
+--------
+
+> tts-export -o export "Clank- Legacy- Acquisitions Incorporated [2100953124].zip"
+This will write a self-contained copy of the backup to the export directory.
+
+Usage flags and arguments are as follows:
+'''
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=description
+)
+
+parser.add_argument(
+    "--version",
+    action=VersionAction,
+)
+
+parser.add_argument(
+    "infile_names",
+    metavar="FILENAME",
+    nargs="+",
+    help="The backups made with --store to export.",
+)
+
+parser.add_argument(
+    "--outname",
+    "-o",
+    dest="outfile_name",
+    metavar="FILENAME",
+    default=None,
+    help="The name (or directory for multiple exports) for the output archive.",
+)
+
+parser.add_argument(
+    "--store",
+    dest="store",
+    metavar="DIR",
+    default=None,
+    help="The store to take assets from (default: the one the backup was made with).",
+)
+
+parser.add_argument(
+    "--deflate",
+    "-z",
+    dest="deflate",
+    default=False,
+    action="store_true",
+    help="Enable zlib compression in the zip file",
+)
+
+def sigint_handler(signum, frame):
+    sys.exit(1)
+
+def console_entry():
+
+    signal.signal(signal.SIGINT, sigint_handler)
+    signal.signal(signal.SIGTERM, sigint_handler)
+    args = parser.parse_args()
+    export_files(args)
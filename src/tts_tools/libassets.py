@@ -0,0 +1,181 @@
+"""The assets referenced by a set of mods.
+
+Many mods share the same table, deck back and sky assets. An AssetGraph
+records which mods refer to which asset, so work on a shared asset is
+only done once per run, and so the sharing can be inspected afterwards.
+"""
+
+from tts_tools.libtts import classify
+from tts_tools.libtts import recodeURL
+
+import json
+import os
+
+
+class Asset:
+    """A cached asset, and the mods which refer to it.
+
+    Besides the references, an asset carries what a run has learned about
+    it so far: its resolved cache path, and whether it was fetched (and if
+    so, why it is missing, if it is).
+
+    """
+
+    __slots__ = (
+        "name",
+        "directory",
+        "kind",
+        "urls",
+        "mods",
+        "resolved",
+        "path",
+        "fetched",
+        "missing",
+    )
+
+    def __init__(self, name, directory, kind):
+        self.name = name
+        self.directory = directory
+        self.kind = kind
+        self.urls = []
+        # Mod → trails at which the mod refers to the asset
+        self.mods = {}
+        self.resolved = False
+        self.path = None
+        self.fetched = False
+        self.missing = None
+
+    @property
+    def key(self):
+        return asset_key(self.directory, self.name)
+
+    def to_json(self):
+        return dict(
+            name=self.name,
+            directory=self.directory,
+            kind=self.kind,
+            urls=self.urls,
+            mods=self.mods,
+        )
+
+
+def asset_key(directory, name):
+    """Return how assets are identified: by cache directory and recoded
+    name, which is what the cached file name derives from."""
+
+    return os.path.join(directory or "*", name)
+
+
+class AssetGraph:
+    """A bipartite graph of mods and the assets they refer to."""
+
+    def __init__(self):
+        # Asset key → Asset
+        self.assets = {}
+        # Mod → asset keys, in order of reference
+        self.mods = {}
+        # Recoded name → asset keys
+        self.names = {}
+
+    def add(self, mod, path, url, kind=None):
+        """Record that `mod` refers to `url` at `path`, and return the
+        Asset."""
+
+        if kind is None:
+            kind = classify(path, url)
+
+        name = recodeURL(url)
+        key = asset_key(kind.directory, name)
+
+        try:
+            asset = self.assets[key]
+        except KeyError:
+            asset = Asset(name, kind.directory, kind.label)
+            self._insert(asset)
+
+        if url not in asset.urls:
+            asset.urls.append(url)
+
+        trails = asset.mods.get(mod)
+        if trails is None:
+            trails = asset.mods[mod] = []
+            self.mods.setdefault(mod, []).append(key)
+        trails.append(list(path))
+
+        return asset
+
+    def _insert(self, asset):
+        key = asset.key
+        self.assets[key] = asset
+        self.names.setdefault(asset.name, []).append(key)
+
+    def add_save(self, save):
+        """Record all URLs of a libtts.SaveDocument."""
+
+        for path, url in save.urls():
+            self.add(save.filename, path, url)
+
+    def lookup(self, url, kind=None):
+        """Return the assets `url` refers to (of the given AssetKind, if
+        any)."""
+
+        assets = [
+            self.assets[key] for key in self.names.get(recodeURL(url), [])
+        ]
+        if kind is not None:
+            assets = [
+                asset for asset in assets if asset.directory == kind.directory
+            ]
+        return assets
+
+    def mods_using(self, url):
+        """Return the mods which refer to `url`."""
+
+        mods = []
+        for asset in self.lookup(url):
+            for mod in asset.mods:
+                if mod not in mods:
+                    mods.append(mod)
+        return mods
+
+    def assets_of(self, mod):
+        """Return the assets `mod` refers to."""
+
+        return [self.assets[key] for key in self.mods.get(mod, [])]
+
+    def shared_assets(self, min_mods=2):
+        """Return the assets which at least `min_mods` mods refer to."""
+
+        return [
+            asset
+            for asset in self.assets.values()
+            if len(asset.mods) >= min_mods
+        ]
+
+    def to_json(self):
+        return dict(
+            assets=[asset.to_json() for asset in self.assets.values()],
+            mods=self.mods,
+        )
+
+    def export(self, filename):
+        """Write the graph to `filename` as JSON."""
+
+        with open(filename, "w", encoding="utf-8") as outfile:
+            json.dump(self.to_json(), outfile, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a graph written by export()."""
+
+        with open(filename, "r", encoding="utf-8") as infile:
+            data = json.load(infile)
+
+        graph = cls()
+        for entry in data["assets"]:
+            asset = Asset(entry["name"], entry["directory"], entry["kind"])
+            asset.urls = entry["urls"]
+            asset.mods = entry["mods"]
+            graph._insert(asset)
+        graph.mods = data["mods"]
+        return graph
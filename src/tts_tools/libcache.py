@@ -0,0 +1,364 @@
+"""Indexes of the files in the TTS cache.
+
+Resolving a URL to a cached file otherwise costs a stat call per
+candidate extension, which adds up quickly on network-mounted or
+Windows-hosted Mods directories.
+"""
+
+from collections import namedtuple
+from tts_tools.libtts import MOD_PATHS
+from tts_tools.util import print_err
+
+import hashlib
+import os
+import platform
+import threading
+
+
+CacheEntry = namedtuple("CacheEntry", ["path", "size", "mtime"])
+
+# The cache directories, relative to the gamedata directory.
+CACHE_PATHS = [path for _, path in MOD_PATHS]
+
+
+class CacheIndex:
+    """An in-memory index of the TTS cache directories.
+
+    Each cache directory is listed once, with os.scandir, the first time
+    a file within it is looked up. Paths are relative to the gamedata
+    directory, like the ones get_fs_path returns. Paths outside of the
+    cache directories are looked up on the file system.
+
+    """
+
+    def __init__(self, gamedata_dir="."):
+        self.gamedata_dir = gamedata_dir
+        # Cache directory → {file name → CacheEntry}
+        self.dirs = {}
+        # Recoded name (file name sans extension) → file names
+        self.names = {}
+
+    def scan_dir(self, mod_path):
+        """List a cache directory, and return its entries by file name."""
+
+        entries = {}
+        try:
+            with os.scandir(os.path.join(self.gamedata_dir, mod_path)) as it:
+                for dir_entry in it:
+                    try:
+                        if not dir_entry.is_file():
+                            continue
+                        stat = dir_entry.stat()
+                    except OSError:
+                        continue
+                    name = os.path.normcase(dir_entry.name)
+                    entries[name] = CacheEntry(
+                        os.path.join(mod_path, dir_entry.name),
+                        stat.st_size,
+                        stat.st_mtime,
+                    )
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def load_dir(self, mod_path, entries):
+        self.dirs[mod_path] = entries
+        for name in entries:
+            recoded_name = os.path.splitext(name)[0]
+            self.names.setdefault(recoded_name, set()).add(name)
+
+    def read_dir(self, mod_path):
+        """Return the entries of a cache directory by file name."""
+
+        return self.scan_dir(mod_path)
+
+    def _dir(self, mod_path):
+        try:
+            return self.dirs[mod_path]
+        except KeyError:
+            if mod_path not in CACHE_PATHS:
+                return None
+            self.load_dir(mod_path, self.read_dir(mod_path))
+            return self.dirs[mod_path]
+
+    def lookup(self, path):
+        """Return the CacheEntry for a cached file, or None if there is no
+        such file."""
+
+        mod_path, name = os.path.split(path)
+        entries = self._dir(mod_path)
+
+        if entries is None:
+            try:
+                stat = os.stat(os.path.join(self.gamedata_dir, path))
+            except OSError:
+                return None
+            return CacheEntry(path, stat.st_size, stat.st_mtime)
+
+        return entries.get(os.path.normcase(name))
+
+    def exists(self, path):
+        return self.lookup(path) is not None
+
+    def find(self, recoded_name):
+        """Return the path to a cached file with the given recoded name and
+        any known extension, or None.
+
+        This searches in the same order as libtts.search_cached_files.
+
+        """
+
+        for mod_path in CACHE_PATHS:
+            self._dir(mod_path)
+
+        names = self.names.get(os.path.normcase(recoded_name))
+        if not names:
+            return None
+
+        for ttsexts, mod_path in MOD_PATHS:
+            entries = self.dirs[mod_path]
+            for ttsext in ttsexts:
+                entry = entries.get(os.path.normcase(recoded_name + ttsext))
+                if entry is not None:
+                    return entry.path
+        return None
+
+    def add(self, path):
+        """Record a file which was added to the cache."""
+
+        mod_path, name = os.path.split(path)
+        entries = self._dir(mod_path)
+        if entries is None:
+            return
+
+        stat = os.stat(os.path.join(self.gamedata_dir, path))
+        name = os.path.normcase(name)
+        entries[name] = CacheEntry(path, stat.st_size, stat.st_mtime)
+        recoded_name = os.path.splitext(name)[0]
+        self.names.setdefault(recoded_name, set()).add(name)
+
+
+def default_index_filename(gamedata_dir, prefix="cache-index"):
+    """Return where the persistent index for a gamedata directory is kept
+    by default, within the user’s cache directory.
+
+    Other files kept per gamedata directory use another `prefix`.
+
+    """
+
+    if platform.system() == "Windows":
+        cache_dir = os.environ.get("LOCALAPPDATA", "~/AppData/Local")
+    elif platform.system() == "Darwin":
+        cache_dir = "~/Library/Caches"
+    else:
+        cache_dir = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+
+    digest = hashlib.sha1(os.path.abspath(gamedata_dir).encode("utf-8"))
+    return os.path.join(
+        os.path.expanduser(cache_dir),
+        "tts-backup",
+        "{}-{}.sqlite".format(prefix, digest.hexdigest()[:16]),
+    )
+
+
+class PersistentCacheIndex(CacheIndex):
+    """A CacheIndex which is kept in an sqlite file between runs.
+
+    A cache directory is only listed again when its modification time
+    changed since it was last listed, i.e. when files were added, removed
+    or renamed within it. Files which are rewritten in place do not change
+    it, so an entry taken from the index file is checked with a stat call
+    the first time it is looked up.
+
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, gamedata_dir=".", index_filename=None):
+        super().__init__(gamedata_dir)
+
+        if index_filename is None:
+            index_filename = default_index_filename(gamedata_dir)
+        self.index_filename = index_filename
+        # Files may be added from several threads at once.
+        self.lock = threading.Lock()
+        # Directories whose entries were taken from the index file, and
+        # the paths of those which were checked since.
+        self.recorded_dirs = set()
+        self.checked = set()
+
+        index_dir = os.path.dirname(index_filename)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+        import sqlite3
+
+        self.db = sqlite3.connect(index_filename, check_same_thread=False)
+        try:
+            self._init_db()
+        except Exception:
+            self.db.close()
+            raise
+
+    def _init_db(self):
+
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        with self.db:
+            if version != self.SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS dirs")
+                self.db.execute("DROP TABLE IF EXISTS files")
+                self.db.execute("DROP TABLE IF EXISTS meta")
+                self.db.execute(
+                    "CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime INTEGER)"
+                )
+                self.db.execute(
+                    "CREATE TABLE files ("
+                    "dir TEXT, name TEXT, size INTEGER, mtime REAL, "
+                    "PRIMARY KEY (dir, name))"
+                )
+                self.db.execute(
+                    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)"
+                )
+                self.db.execute(
+                    "PRAGMA user_version = {}".format(self.SCHEMA_VERSION)
+                )
+
+            # An index file which was used for another gamedata directory
+            # is of no use.
+            gamedata = os.path.abspath(self.gamedata_dir)
+            row = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'gamedata'"
+            ).fetchone()
+            if row is None or row[0] != gamedata:
+                self.db.execute("DELETE FROM dirs")
+                self.db.execute("DELETE FROM files")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('gamedata', ?)",
+                    (gamedata,),
+                )
+
+    def read_dir(self, mod_path):
+
+        with self.lock:
+            return self._read_dir(mod_path)
+
+    def _read_dir(self, mod_path):
+
+        try:
+            dir_mtime = os.stat(
+                os.path.join(self.gamedata_dir, mod_path)
+            ).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+
+        row = self.db.execute(
+            "SELECT mtime FROM dirs WHERE path = ?", (mod_path,)
+        ).fetchone()
+
+        if row is not None and row[0] == dir_mtime:
+            self.recorded_dirs.add(mod_path)
+            return {
+                os.path.normcase(name): CacheEntry(
+                    os.path.join(mod_path, name), size, mtime
+                )
+                for name, size, mtime in self.db.execute(
+                    "SELECT name, size, mtime FROM files WHERE dir = ?",
+                    (mod_path,),
+                )
+            }
+
+        # The directory changed (or was never listed), so list it again.
+        # Its mtime was taken before listing, so changes made meanwhile
+        # cause another listing next time.
+        entries = self.scan_dir(mod_path)
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE dir = ?", (mod_path,))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (
+                    (mod_path, os.path.basename(entry.path), entry.size, entry.mtime)
+                    for entry in entries.values()
+                ),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?)",
+                (mod_path, dir_mtime),
+            )
+        return entries
+
+    def lookup(self, path):
+
+        entry = super().lookup(path)
+        if entry is None or os.path.dirname(path) not in self.recorded_dirs:
+            return entry
+        key = os.path.normcase(path)
+        if key in self.checked:
+            return entry
+        return self._check(entry, key)
+
+    def _check(self, entry, key):
+        """Return `entry` with the current size and mtime of its file."""
+
+        try:
+            stat = os.stat(os.path.join(self.gamedata_dir, entry.path))
+        except OSError:
+            return entry
+
+        mod_path, name = os.path.split(entry.path)
+        if (stat.st_size, stat.st_mtime) != (entry.size, entry.mtime):
+            entry = CacheEntry(entry.path, stat.st_size, stat.st_mtime)
+            self.dirs[mod_path][os.path.normcase(name)] = entry
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (mod_path, name, entry.size, entry.mtime),
+                )
+        self.checked.add(key)
+        return entry
+
+    def add(self, path):
+
+        super().add(path)
+        self.checked.add(os.path.normcase(path))
+
+        mod_path, name = os.path.split(path)
+        entries = self.dirs.get(mod_path)
+        if entries is None:
+            return
+
+        # The directory’s mtime changed with this file, so it will be
+        # listed again on the next run anyway; still, keep the record
+        # current for this one.
+        entry = entries[os.path.normcase(name)]
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (mod_path, name, entry.size, entry.mtime),
+            )
+
+    def close(self):
+        self.db.close()
+
+
+def open_cache_index(gamedata_dir, index_filename=None, persistent=True):
+    """Return a cache index for `gamedata_dir`.
+
+    This is a PersistentCacheIndex unless `persistent` is false, or the
+    index file cannot be used, in which case the cache is indexed in
+    memory only.
+
+    """
+
+    if persistent:
+        import sqlite3
+
+        try:
+            return PersistentCacheIndex(gamedata_dir, index_filename)
+        except (OSError, sqlite3.Error) as error:
+            print_err(
+                "Could not open cache index {}: {}".format(
+                    index_filename or default_index_filename(gamedata_dir),
+                    error,
+                )
+            )
+    return CacheIndex(gamedata_dir)
@@ -0,0 +1,322 @@
+"""A pool of keep-alive HTTP connections.
+
+urllib.request opens a new connection for every request, so each small
+asset costs a TCP (and TLS) handshake, even though most assets of a mod
+come from the same few hosts. A ConnectionPool keeps connections open
+after a response was read, and reuses them for the next request to the
+same host.
+"""
+
+import os
+import threading
+
+
+# How many redirects are followed, like urllib.request does.
+MAX_REDIRECTS = 10
+
+# How many idle connections are kept per host.
+MAX_IDLE = 8
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class PooledResponse:
+    """The response to a request through a ConnectionPool.
+
+    It offers the parts of the urllib response interface download_file
+    uses. Once read to the end, its connection goes back to the pool;
+    closing it before closes the connection.
+
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        self.release()
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """Keep-alive connections, by scheme, host and port.
+
+    `hits` counts the requests which reused a connection, and `misses`
+    the ones which needed a new one.
+
+    """
+
+    def __init__(self, max_idle=MAX_IDLE):
+        self.max_idle = max_idle
+        # (scheme, host, port) → idle connections
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.ssl_context = None
+
+    def get(self, key, timeout):
+        """Return a connection for `key`, and whether it was reused."""
+
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                self.hits += 1
+                conn = conns.pop()
+                reused = True
+            else:
+                self.misses += 1
+                conn = None
+                reused = False
+
+        if conn is not None:
+            conn.timeout = timeout
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+            except OSError:
+                conn.close()
+                conn = None
+        if conn is None:
+            conn = self.connect(key, timeout)
+        return conn, reused
+
+    def connect(self, key, timeout):
+        import http.client
+
+        scheme, host, port = key
+        if scheme == "https":
+            if self.ssl_context is None:
+                import ssl
+
+                self.ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def put(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers, timeout):
+        """Send a GET request for `url` and return the response, following
+        redirects.
+
+        Errors are raised like urllib.request.urlopen raises them: an
+        HTTPError for error responses, and a URLError if the host cannot
+        be reached.
+
+        """
+
+        import urllib.error
+        import urllib.parse
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.request_once(url, headers, timeout)
+
+            if response.status in REDIRECT_CODES:
+                location = response.getheader("Location")
+                # Reading the (short) body lets the connection be reused.
+                response.read()
+                response.close()
+                if location is None:
+                    raise urllib.error.HTTPError(
+                        url, response.status, response.reason, response.headers, None
+                    )
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                response.close()
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+
+            return response
+
+        raise urllib.error.HTTPError(
+            url, response.status, "Too many redirects", response.headers, None
+        )
+
+    def request_once(self, url, headers, timeout):
+
+        import http.client
+        import socket
+        import urllib.error
+        import urllib.parse
+
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("unknown url type: {}".format(scheme))
+        if not parts.hostname:
+            raise urllib.error.URLError("no host given")
+        default_port = 443 if scheme == "https" else 80
+        key = (scheme, parts.hostname.lower(), parts.port or default_port)
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            conn, reused = self.get(key, timeout)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ) as error:
+                conn.close()
+                if reused:
+                    # The server closed the idle connection meanwhile.
+                    continue
+                raise urllib.error.URLError(error)
+            except OSError as error:
+                conn.close()
+                raise urllib.error.URLError(error)
+            except BaseException:
+                conn.close()
+                raise
+            return PooledResponse(self, key, conn, response, url)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+
+class ValidatorStore:
+    """The validators of downloaded files, by URL, kept in an sqlite file.
+
+    For each URL, this records the file it was downloaded to, and the
+    ETag, Last-Modified and Content-Length of the response. When the file
+    is fetched again, and `conditional` is true, conditional_headers()
+    make the request conditional on it having changed, so an unchanged
+    file costs headers only.
+
+    """
+
+    def __init__(self, filename, conditional=True):
+        import sqlite3
+
+        self.conditional = conditional
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        # Files are downloaded in several threads at once.
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS validators ("
+                "url TEXT PRIMARY KEY, path TEXT, etag TEXT, "
+                "last_modified TEXT, size INTEGER)"
+            )
+
+    def conditional_headers(self, url, path):
+        """Return the headers making a request for `url` conditional, if
+        `path` is still the file it was downloaded to."""
+
+        if not self.conditional:
+            return {}
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path, etag, last_modified, size FROM validators "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None or path is None:
+            return {}
+
+        recorded_path, etag, last_modified, size = row
+        try:
+            if recorded_path != path or os.path.getsize(path) != size:
+                return {}
+        except OSError:
+            return {}
+
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def record(self, url, path, response):
+        """Record the validators of `response`, downloaded to `path`."""
+
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        with self.lock, self.db:
+            if etag or last_modified:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+                    (url, path, etag, last_modified, os.path.getsize(path)),
+                )
+            else:
+                self.db.execute("DELETE FROM validators WHERE url = ?", (url,))
+
+    def close(self):
+        self.db.close()
+
+
+def open_validator_store(gamedata_dir, conditional=True):
+    """Open the ValidatorStore for `gamedata_dir`, kept next to its cache
+    index, or return None if it cannot be opened."""
+
+    import sqlite3
+
+    from tts_tools.libcache import default_index_filename
+    from tts_tools.util import print_err
+
+    filename = default_index_filename(gamedata_dir, "validators")
+    try:
+        return ValidatorStore(filename, conditional)
+    except (OSError, sqlite3.Error) as error:
+        print_err("Could not open {}: {}".format(filename, error))
+        return None
@@ -0,0 +1,181 @@
+"""A journal of the mods which were backed up or prefetched.
+
+With --backup_all and --prefetch_all, only mods which changed since they
+were last processed are processed again. A mod changed when its JSON
+file was modified, or when the assets it refers to changed in the cache,
+e.g. because an asset which was missing before has been cached since.
+"""
+
+from tts_tools.util import print_err
+
+import hashlib
+import os
+import pickle
+
+
+def asset_fingerprint(paths, cache=None):
+    """Return a hash over the given cached files and their sizes.
+
+    `paths` are relative to the gamedata directory, as get_fs_path returns
+    them. Files which are missing count as such, and files which were
+    missing without an extension are looked up by their recoded name, so
+    the fingerprint changes once any of them is cached.
+
+    """
+
+    hasher = hashlib.sha1()
+    for path in sorted(set(paths)):
+        if cache is not None:
+            entry = cache.lookup(path)
+            if entry is None and not os.path.splitext(path)[1]:
+                found = cache.find(os.path.basename(path))
+                if found is not None:
+                    entry = cache.lookup(found)
+            size = None if entry is None else entry.size
+        else:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+        hasher.update("{}\0{}\n".format(path, size).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class ModJournal:
+    """Which mods were processed, kept in an sqlite file.
+
+    For each mod, this records the mtime of its JSON file, and optionally
+    the cached files it refers to, with a fingerprint over them. Each
+    record is committed on its own, so an interrupted run keeps the mods
+    it completed.
+
+    Journals used to be pickled dicts of mtimes by file name. If such a
+    file is given as `legacy_filename`, it is imported into a new journal.
+
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, filename, legacy_filename=None):
+        self.filename = filename
+
+        import sqlite3
+
+        self.db = sqlite3.connect(filename)
+        try:
+            self._init_db(legacy_filename)
+        except Exception:
+            self.db.close()
+            raise
+
+    def _init_db(self, legacy_filename):
+
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+
+        with self.db:
+            self.db.execute("DROP TABLE IF EXISTS mods")
+            self.db.execute("DROP TABLE IF EXISTS assets")
+            self.db.execute(
+                "CREATE TABLE mods ("
+                "name TEXT PRIMARY KEY, mtime REAL, fingerprint TEXT)"
+            )
+            self.db.execute(
+                "CREATE TABLE assets (name TEXT, path TEXT, "
+                "PRIMARY KEY (name, path))"
+            )
+            self.db.execute(
+                "PRAGMA user_version = {}".format(self.SCHEMA_VERSION)
+            )
+
+            if legacy_filename is not None:
+                self.db.executemany(
+                    "INSERT INTO mods VALUES (?, ?, NULL)",
+                    read_legacy_mtimes(legacy_filename).items(),
+                )
+
+    def record(self, infile_name, paths=None, cache=None):
+        """Record that a mod was processed.
+
+        If the cached files the mod refers to are given as `paths`, the
+        mod is also selected again once they change.
+
+        """
+
+        name = os.path.basename(infile_name)
+        mtime = os.path.getmtime(infile_name)
+        if paths is not None:
+            paths = set(paths)
+            fingerprint = asset_fingerprint(paths, cache)
+        else:
+            fingerprint = None
+
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO mods VALUES (?, ?, ?)",
+                (name, mtime, fingerprint),
+            )
+            self.db.execute("DELETE FROM assets WHERE name = ?", (name,))
+            if paths is not None:
+                self.db.executemany(
+                    "INSERT INTO assets VALUES (?, ?)",
+                    ((name, path) for path in paths),
+                )
+
+    def select(self, infile_names, cache=None):
+        """Return those of `infile_names` which need to be processed,
+        because they were not processed yet, or changed since."""
+
+        records = {}
+        for name, mtime, fingerprint, path in self.db.execute(
+            "SELECT name, mtime, fingerprint, path "
+            "FROM mods LEFT JOIN assets USING (name)"
+        ):
+            _, _, paths = records.setdefault(name, (mtime, fingerprint, []))
+            if path is not None:
+                paths.append(path)
+
+        selected = []
+        for infile_name in infile_names:
+            record = records.get(os.path.basename(infile_name))
+            if record is None:
+                selected.append(infile_name)
+                continue
+
+            mtime, fingerprint, paths = record
+            if os.path.getmtime(infile_name) > mtime:
+                selected.append(infile_name)
+            elif fingerprint is not None and fingerprint != asset_fingerprint(
+                paths, cache
+            ):
+                selected.append(infile_name)
+
+        return selected
+
+    def close(self):
+        self.db.close()
+
+
+def read_legacy_mtimes(filename):
+    """Return the mtimes by file name from a pickled mtimes file, or an
+    empty dict if it cannot be read."""
+
+    try:
+        with open(filename, "rb") as infile:
+            return dict(pickle.load(infile))
+    except FileNotFoundError:
+        return {}
+    except Exception as error:
+        print_err("Could not read {}: {}".format(filename, error))
+        return {}
+
+
+def open_journal(directory, prefix):
+    """Open the journal `prefix`_journal.sqlite in `directory`, importing
+    `prefix`_mtimes.pkl from there if the journal is new."""
+
+    return ModJournal(
+        os.path.join(directory, "{}_journal.sqlite".format(prefix)),
+        legacy_filename=os.path.join(directory, "{}_mtimes.pkl".format(prefix)),
+    )
@@ -0,0 +1,215 @@
+"""Incremental JSON tokenizer.
+
+Reads a JSON document from a text file in chunks and produces a stream of
+parse events without building the object tree. Memory use is bounded by
+the chunk size and the longest single string in the document.
+"""
+
+from json import JSONDecodeError
+from json.decoder import scanstring
+
+import re
+
+
+START_MAP = 0
+END_MAP = 1
+START_ARRAY = 2
+END_ARRAY = 3
+MAP_KEY = 4
+VALUE = 5
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+NUMBER_RE = re.compile(r"(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?")
+
+# Non-string literals json.load accepts, longest first.
+LITERALS = (
+    ("-Infinity", float("-inf")),
+    ("Infinity", float("inf")),
+    ("NaN", float("nan")),
+    ("false", False),
+    ("true", True),
+    ("null", None),
+)
+
+
+# Tokenizer states.
+FIRST = 0  # Just after '{' or '[': an item or the closing bracket.
+NEED_KEY = 1
+NEED_COLON = 2
+NEED_VALUE = 3
+AFTER_VALUE = 4  # A ',' or the closing bracket.
+DONE = 5
+
+
+def iter_events(infile, strict=True, chunk_size=CHUNK_SIZE):
+    """Yield (event, value) tuples for the JSON document in `infile`.
+
+    `event` is one of START_MAP, END_MAP, START_ARRAY, END_ARRAY, MAP_KEY
+    and VALUE; `value` is the key or the scalar value, and None
+    otherwise. Malformed documents raise json.JSONDecodeError.
+
+    """
+
+    buf = ""
+    pos = 0
+    eof = False
+
+    # One entry per open container: True for maps, False for arrays.
+    containers = []
+    state = NEED_VALUE
+
+    def error(msg):
+        return JSONDecodeError(msg, buf, pos)
+
+    while True:
+
+        pos = WHITESPACE_RE.match(buf, pos).end()
+
+        # Keep some lookahead, so literals are not cut in half.
+        if pos + 9 > len(buf) and not eof:
+            data = infile.read(chunk_size)
+            if not data:
+                eof = True
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+
+        if pos >= len(buf):
+            if state != DONE:
+                raise error("Expecting value")
+            return
+
+        if state == DONE:
+            raise error("Extra data")
+
+        c = buf[pos]
+        in_map = containers[-1] if containers else False
+
+        if state == NEED_COLON:
+            if c != ":":
+                raise error("Expecting ':' delimiter")
+            pos += 1
+            state = NEED_VALUE
+            continue
+
+        if c == ",":
+            if state != AFTER_VALUE:
+                raise error("Expecting value")
+            pos += 1
+            state = NEED_KEY if in_map else NEED_VALUE
+            continue
+
+        if c == "}" or c == "]":
+            is_map = c == "}"
+            if not containers or in_map != is_map:
+                raise error("Unexpected '{}'".format(c))
+            if state != FIRST and state != AFTER_VALUE:
+                raise error("Expecting value")
+            pos += 1
+            containers.pop()
+            state = AFTER_VALUE if containers else DONE
+            yield (END_MAP, None) if is_map else (END_ARRAY, None)
+            continue
+
+        if in_map and (state == FIRST or state == NEED_KEY):
+            if c != '"':
+                raise error("Expecting property name enclosed in double quotes")
+        elif state != NEED_VALUE and state != FIRST:
+            raise error("Expecting ',' delimiter")
+
+        if c == '"':
+            try:
+                string, end = scanstring(buf, pos + 1, strict)
+            except JSONDecodeError:
+                if eof:
+                    raise
+                # Unterminated string; grow the buffer geometrically, so
+                # very long strings are not rescanned too often.
+                data = infile.read(max(chunk_size, len(buf) - pos))
+                if not data:
+                    eof = True
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+
+            pos = end
+            if in_map and state != NEED_VALUE:
+                state = NEED_COLON
+                yield (MAP_KEY, string)
+            else:
+                state = AFTER_VALUE if containers else DONE
+                yield (VALUE, string)
+            continue
+
+        if c == "{" or c == "[":
+            pos += 1
+            is_map = c == "{"
+            containers.append(is_map)
+            state = FIRST
+            yield (START_MAP, None) if is_map else (START_ARRAY, None)
+            continue
+
+        m = NUMBER_RE.match(buf, pos)
+        if m:
+            if m.end() >= len(buf) and not eof:
+                # The number may continue in the next chunk.
+                data = infile.read(chunk_size)
+                if not data:
+                    eof = True
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            integer, frac, exp = m.groups()
+            if frac or exp:
+                value = float(integer + (frac or "") + (exp or ""))
+            else:
+                value = int(integer)
+            pos = m.end()
+        else:
+            for literal, value in LITERALS:
+                if buf.startswith(literal, pos):
+                    pos += len(literal)
+                    break
+            else:
+                raise error("Expecting value")
+
+        state = AFTER_VALUE if containers else DONE
+        yield (VALUE, value)
+
+
+def build_value(events, event, value):
+    """Assemble the complete value starting with (`event`, `value`) from
+    the remaining `events`."""
+
+    if event == VALUE:
+        return value
+
+    stack = [{} if event == START_MAP else []]
+    keys = [None]
+
+    for event, value in events:
+
+        if event == MAP_KEY:
+            keys[-1] = value
+            continue
+
+        if event == START_MAP or event == START_ARRAY:
+            stack.append({} if event == START_MAP else [])
+            keys.append(None)
+            continue
+
+        if event == END_MAP or event == END_ARRAY:
+            value = stack.pop()
+            keys.pop()
+            if not stack:
+                return value
+
+        parent = stack[-1]
+        if isinstance(parent, dict):
+            parent[keys[-1]] = value
+        else:
+            parent.append(value)
+
+    raise JSONDecodeError("Unterminated document", "", 0)
@@ -0,0 +1,255 @@
+"""A content-addressed store of cached assets.
+
+Many mods share assets, and backing each of them up into a self-contained
+Zip file stores the same bytes over and over again. In store mode, assets
+are written once into an AssetStore, keyed by the hash of their content,
+and a mod's backup only refers to them by hash. export_backup turns such
+a backup back into a self-contained one.
+"""
+
+from tts_tools.util import default_file_mode
+from tts_tools.util import ZipFile
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import zipfile
+
+
+# The member of a store backup which lists the assets in the store.
+MANIFEST_NAME = "STORE.json"
+
+HASH_NAME = "sha256"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class AssetStore:
+    """A directory of files named by the hash of their content.
+
+    Files are kept in `root`/objects/ab/cdef..., and an index in
+    `root`/index.sqlite remembers the hash of each source file by its
+    path, size and mtime, so unchanged files are not read again.
+
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.db = None
+
+    def open_index(self):
+        if self.db is None:
+            import sqlite3
+
+            os.makedirs(self.root, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(self.root, "index.sqlite"))
+            with self.db:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS sources ("
+                    "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+                    "digest TEXT)"
+                )
+        return self.db
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def path(self, digest):
+        """Return the path of the object with the given hash."""
+
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, filename):
+        """Add a file to the store (unless it is stored already), and
+        return its hash and size."""
+
+        abspath = os.path.abspath(filename)
+        stat = os.stat(abspath)
+        db = self.open_index()
+
+        row = db.execute(
+            "SELECT digest FROM sources WHERE path = ? AND size = ? AND mtime = ?",
+            (abspath, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None and self.has(row[0]):
+            return row[0], stat.st_size
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        hasher = hashlib.new(HASH_NAME)
+        with open(abspath, "rb") as infile, tempfile.NamedTemporaryFile(
+            dir=self.objects_dir, prefix=".tmp-", delete=False
+        ) as outfile:
+            try:
+                while True:
+                    data = infile.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    outfile.write(data)
+            except BaseException:
+                outfile.close()
+                os.remove(outfile.name)
+                raise
+
+        digest = hasher.hexdigest()
+        object_path = self.path(digest)
+        if os.path.isfile(object_path):
+            os.remove(outfile.name)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Temporary files are owner-only.
+            os.chmod(outfile.name, default_file_mode())
+            os.replace(outfile.name, object_path)
+
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                (abspath, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest, stat.st_size
+
+
+class StoreZipFile(ZipFile):
+    """A ZipFile which puts assets into an AssetStore.
+
+    Files written under their own name (the cached assets) are put into
+    the store, and only listed in the archive's STORE.json. Files written
+    under another name (the save itself and its thumbnail) are embedded
+    as usual.
+
+    """
+
+    def __init__(self, *args, store, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+        # Archive name → (hash, size, mtime)
+        self.references = {}
+
+    def write(self, filename, arcname=None, *args, **kwargs):
+
+        if arcname is not None or args or kwargs:
+            return super().write(filename, arcname, *args, **kwargs)
+
+        if filename in self.stored_files:
+            return None
+
+        self.stored_files.add(filename)
+
+        absname = os.path.join(os.getcwd(), filename)
+
+        if self.cache is not None:
+            is_file = self.cache.exists(filename)
+        else:
+            is_file = os.path.isfile(filename)
+
+        if not (is_file or self.ignore_missing):
+            raise FileNotFoundError("No such file: {}".format(filename))
+
+        if not is_file:
+            self.log_skipped(filename, absname)
+            return filename
+
+        if not self.dry_run:
+            try:
+                digest, size = self.store.put(filename)
+                mtime = os.path.getmtime(filename)
+            except FileNotFoundError:
+                if not self.ignore_missing:
+                    raise
+                self.log_skipped(filename, absname)
+                return filename
+            self.references[filename] = (digest, size, mtime)
+
+        self.log_written(absname)
+        return None
+
+    def __exit__(self, *args, **kwargs):
+
+        if not self.dry_run and args[0] is None:
+            manifest = dict(
+                store=self.store.root,
+                hash=HASH_NAME,
+                files=[
+                    dict(
+                        name=name.replace(os.sep, "/"),
+                        hash=digest,
+                        size=size,
+                        mtime=mtime,
+                    )
+                    for name, (digest, size, mtime) in self.references.items()
+                ],
+            )
+            self.writestr(MANIFEST_NAME, json.dumps(manifest, indent=1))
+
+        super().__exit__(*args, **kwargs)
+
+
+def read_manifest(infile):
+    """Return the STORE.json of a store backup (an open zipfile.ZipFile),
+    or None if it is a self-contained backup."""
+
+    try:
+        data = infile.read(MANIFEST_NAME)
+    except KeyError:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def export_backup(infile_name, outfile_name, store_dir=None, deflate=False):
+    """Write a self-contained copy of the store backup `infile_name` to
+    `outfile_name`, taking assets from the store recorded in the backup,
+    or from `store_dir`."""
+
+    if deflate:
+        compression = zipfile.ZIP_DEFLATED
+    else:
+        compression = zipfile.ZIP_STORED
+
+    with zipfile.ZipFile(infile_name) as infile:
+        manifest = read_manifest(infile)
+        if manifest is None:
+            raise ValueError(
+                "{} is not a store backup".format(infile_name)
+            )
+
+        store = AssetStore(store_dir or manifest["store"])
+
+        with zipfile.ZipFile(outfile_name, "w", compression) as outfile:
+            for entry in manifest["files"]:
+                object_path = store.path(entry["hash"])
+                if not os.path.isfile(object_path):
+                    raise FileNotFoundError(
+                        "{} ({}) is not in the store at {}".format(
+                            entry["name"], entry["hash"], store.root
+                        )
+                    )
+                # Keep the modification time of the cached file, rather
+                # than the one of the object.
+                info = zipfile.ZipInfo.from_file(object_path, entry["name"])
+                info.date_time = time.localtime(entry["mtime"])[:6]
+                # Nor its mode, which is owner-only in older stores.
+                info.external_attr = (stat.S_IFREG | default_file_mode()) << 16
+                info.compress_type = compression
+                with open(object_path, "rb") as src, outfile.open(
+                    info, "w"
+                ) as dest:
+                    shutil.copyfileobj(src, dest, CHUNK_SIZE)
+
+            for info in infile.infolist():
+                if info.filename == MANIFEST_NAME:
+                    continue
+                info.compress_type = compression
+                with infile.open(info) as src, outfile.open(info, "w") as dest:
+                    shutil.copyfileobj(src, dest, CHUNK_SIZE)
+
+            outfile.comment = infile.comment
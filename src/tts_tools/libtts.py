@@ -1,7 +1,17 @@
+from contextlib import suppress
+from enum import Enum
+from functools import cached_property
+from functools import lru_cache
+from tts_tools import libjson
+
+import collections
+import hashlib
+import itertools
 import json
 import os
 import platform
 import re
+import sys
 
 IMGPATH = os.path.join("Mods", "Images")
 OBJPATH = os.path.join("Mods", "Models")
@@ -40,108 +50,324 @@ gamedata_map = {
     "Darwin": "~/Library/Tabletop Simulator",  # MacOS
     "Linux": "~/.local/share/Tabletop Simulator",
 }
-try:
-    active_platform = platform.system()
-    GAMEDATA_DEFAULT = os.path.expanduser(gamedata_map[active_platform])
-except KeyError:
-    GAMEDATA_DEFAULT = os.path.expanduser(gamedata_map["Windows"])
-
-# If the mod location is somewhere other than the default location we can
-# provide the path to the new location through a simple one-line test file
-mod_link_path = os.path.join(GAMEDATA_DEFAULT, 'mod_location.txt')
-if not os.path.exists(os.path.join(GAMEDATA_DEFAULT, 'Mods')
-                or os.path.exists(mod_link_path)):
-    print(f"Reading default gamedata directory information from: {mod_link_path}")
-    if os.path.exists(mod_link_path):
-        with open(os.path.join(GAMEDATA_DEFAULT, 'mod_location.txt')) as f:
-            GAMEDATA_DEFAULT = f.readline().strip()
-        print(f"Default gamedata directory = {GAMEDATA_DEFAULT}")
-    else:
-        print(f"Warning: default gamedata directory not detected, must specify at command line!")
-        
+
+
+@lru_cache(maxsize=None)
+def get_gamedata_default():
+    """Return the default gamedata directory.
+
+    This is resolved on first use (not on import), and remembered.
+
+    """
+
+    try:
+        gamedata_default = os.path.expanduser(gamedata_map[platform.system()])
+    except KeyError:
+        gamedata_default = os.path.expanduser(gamedata_map["Windows"])
+
+    # If the mod location is somewhere other than the default location we can
+    # provide the path to the new location through a simple one-line test file
+    mod_link_path = os.path.join(gamedata_default, 'mod_location.txt')
+    if not os.path.exists(os.path.join(gamedata_default, 'Mods')):
+        if os.path.exists(mod_link_path):
+            with open(mod_link_path) as f:
+                gamedata_default = f.readline().strip()
+        else:
+            print(
+                "Warning: default gamedata directory not detected, must specify at command line!",
+                file=sys.stderr,
+            )
+
+    return gamedata_default
+
+
+def __getattr__(name):
+    # GAMEDATA_DEFAULT used to be computed on import.
+    if name == "GAMEDATA_DEFAULT":
+        return get_gamedata_default()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 class IllegalSavegameException(ValueError):
     def __init__(self):
         super().__init__("not a Tabletop Simulator savegame")
 
+    def __reduce__(self):
+        # Allow passing the exception between processes.
+        return (type(self), ())
+
+
+# Deck art URLs can contain metadata in curly braces (yikes).
+URL_METADATA_RE = re.compile(r"{.*}")
+
+# Sites which serve assets from URLs without a file extension.
+NO_EXT_SITES = [
+    'steamusercontent.com',
+    'pastebin.com',
+    'paste.ee',
+    'drive.google.com',
+    'steamuserimages-a.akamaihd.net',
+]
+
+LUA_URL_RE = re.compile(r'((?:http|https):\/\/(?:[\w\-_]+(?:(?:\.[\w\-_]+)+))(?:[\w\-\.,@?^=%&:/~\+#]*[\w\-\@?^=%&/~\+#])?)')
+
+# Key dispatch table for seekURL. The keys with a meaning of their own
+# are listed here; others are classified by _classify_key.
+KEY_OTHER = 0
+KEY_URL = 1
+KEY_PAGE_URL = 2
+KEY_AUDIO_LIBRARY = 3
+KEY_LUA_SCRIPT = 4
+
+_key_kinds = {
+    "AudioLibrary": KEY_AUDIO_LIBRARY,
+    "LuaScript": KEY_LUA_SCRIPT,
+    "PageURL": KEY_PAGE_URL,
+}
+
+
+# Bounded, as saves use data such as CustomDeck ids as keys, too.
+@lru_cache(maxsize=4096)
+def _classify_key(k):
+    return KEY_URL if k.lower().endswith("url") else KEY_OTHER
+
+
+def _trail_list(node):
+    """Turn a parent-pointer trail node into the list of keys leading to
+    it."""
+
+    trail = []
+    while node is not None:
+        node, k = node
+        trail.append(k)
+    trail.reverse()
+    return trail
+
+
+def _audio_library_urls(v, done):
+    for elem in v:
+        try:
+            # It appears that AudioLibrary items are mappings of form
+            # “Item1” → URL, “Item2” → audio title.
+            url = elem["Item1"]
+            if url in done:
+                continue
+            done.add(url)
+            yield url
+        except KeyError:
+            raise NotImplementedError(
+                "AudioLibrary has unexpected structure: {}".format(v)
+            )
+
+
+# Anything which makes a URL found in a script worth fetching: a site
+# which doesn't use extensions, or a known extension anywhere in the URL.
+SCRIPT_URL_HINT_RE = re.compile(
+    "|".join(re.escape(hint.lower()) for hint in NO_EXT_SITES + ALL_VALID_EXTS)
+)
+
+
+def scan_lua_script(script):
+    """Return the URLs in a LuaScript that point to fetchable assets."""
+
+    search = SCRIPT_URL_HINT_RE.search
+    return [url for url in LUA_URL_RE.findall(script) if search(url.lower())]
+
+
+def _lua_script_urls(v, done, scripts):
+    # The same script is often attached to hundreds of objects, so each
+    # distinct script is only scanned once, keyed by its content hash.
+    digest = hashlib.blake2b(
+        v.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+    try:
+        urls = scripts[digest]
+    except KeyError:
+        urls = scripts[digest] = scan_lua_script(v)
+
+    for url in urls:
+        if url in done:
+            continue
+        done.add(url)
+        yield url
+
 
 def seekURL(dic, trail=[], done=None):
-    """Recursively search through the save game structure and return URLs
-    and the paths to them.
+    """Search through the save game structure and return URLs and the
+    paths to them.
+
+    The structure is walked depth-first using an explicit stack. Trails
+    are kept as (parent, key) nodes shared between siblings, and only
+    turned into lists when a URL is actually yielded.
 
     """
 
     if done is None:
         done = set()
 
-    for k, v in dic.items():
+    root = None
+    for k in trail:
+        root = (root, k)
+
+    # Each entry holds an iterator over the items of a dict (or over
+    # the elements of a list), the trail node of that container, and
+    # whether it is a list.
+    stack = [(iter(dic.items()), root, False)]
+    push = stack.append
+    pop = stack.pop
+    key_kinds = _key_kinds
+    scripts = {}
+
+    while stack:
+        it, node, is_list = stack[-1]
+
+        if is_list:
+            # Only dicts within lists are searched.
+            for elem in it:
+                if isinstance(elem, dict):
+                    push((iter(elem.items()), node, False))
+                    break
+            else:
+                pop()
+            continue
+
+        for k, v in it:
+
+            kind = key_kinds.get(k)
+            if kind is None:
+                kind = _classify_key(k)
+
+            if kind == KEY_AUDIO_LIBRARY:
+                newtrail = None
+                for url in _audio_library_urls(v, done):
+                    if newtrail is None:
+                        newtrail = _trail_list((node, k))
+                    yield (newtrail, url)
 
-        newtrail = trail + [k]
+            elif isinstance(v, dict):
+                push((iter(v.items()), (node, k), False))
+                break
 
-        if k == "AudioLibrary":
-            for elem in v:
-                try:
-                    # It appears that AudioLibrary items are mappings of form
-                    # “Item1” → URL, “Item2” → audio title.
-                    url = elem["Item1"]
-                    if url in done:
-                        continue
-                    done.add(url)
-                    yield (newtrail, url)
-                except KeyError:
-                    raise NotImplementedError(
-                        "AudioLibrary has unexpected structure: {}".format(v)
-                    )
+            elif isinstance(v, list):
+                push((iter(v), (node, k), True))
+                break
 
-        elif isinstance(v, dict):
-            yield from seekURL(v, newtrail, done)
+            elif kind == KEY_URL:
+                # Some URL keys may be left empty.
+                if not v:
+                    continue
 
-        elif isinstance(v, list):
-            for elem in v:
-                if not isinstance(elem, dict):
+                v = URL_METADATA_RE.sub("", v)
+                if v in done:
                     continue
-                yield from seekURL(elem, newtrail, done)
+                done.add(v)
+                yield (_trail_list((node, k)), v)
+
+            elif kind == KEY_LUA_SCRIPT:
+                newtrail = None
+                for url in _lua_script_urls(v, done, scripts):
+                    if newtrail is None:
+                        newtrail = _trail_list((node, k))
+                    yield (newtrail, url)
+
+            # We don’t want tablet URLs (KEY_PAGE_URL).
+
+        else:
+            pop()
 
-        elif k.lower().endswith("url"):
-            # We don’t want tablet URLs.
-            if k == "PageURL":
-                continue
 
+def seekURL_events(events, done=None):
+    """Search through a stream of libjson parse events for URLs and the
+    paths to them.
+
+    This yields the same (trail, url) pairs as seekURL would for the
+    parsed document, without ever holding the whole document in memory.
+    Only AudioLibrary values are assembled, as they are small. (Unlike
+    json.load, a repeated key does not replace the earlier value, so both
+    are searched.)
+
+    """
+
+    if done is None:
+        done = set()
+
+    # One entry per open container: its trail node, whether it is a map,
+    # and whether its contents are searched at all (seekURL ignores
+    # anything within lists nested directly in lists).
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    key_kinds = _key_kinds
+    scripts = {}
+    k = None
+
+    for event, v in events:
+
+        if event == libjson.MAP_KEY:
+            k = v
+            continue
+
+        if event == libjson.END_MAP or event == libjson.END_ARRAY:
+            pop()
+            continue
+
+        if not stack:
+            # The document root.
+            if event != libjson.START_MAP:
+                raise IllegalSavegameException
+            push((None, True, True))
+            continue
+
+        node, in_map, searched = stack[-1]
+
+        if not searched:
+            if event == libjson.START_MAP or event == libjson.START_ARRAY:
+                push((None, False, False))
+            continue
+
+        if not in_map:
+            # Only dicts within lists are searched.
+            if event == libjson.START_MAP:
+                push((node, True, True))
+            elif event == libjson.START_ARRAY:
+                push((None, False, False))
+            continue
+
+        kind = key_kinds.get(k)
+        if kind is None:
+            kind = _classify_key(k)
+
+        if kind == KEY_AUDIO_LIBRARY:
+            v = libjson.build_value(events, event, v)
+            newtrail = None
+            for url in _audio_library_urls(v, done):
+                if newtrail is None:
+                    newtrail = _trail_list((node, k))
+                yield (newtrail, url)
+
+        elif event == libjson.START_MAP:
+            push(((node, k), True, True))
+
+        elif event == libjson.START_ARRAY:
+            push(((node, k), False, True))
+
+        elif kind == KEY_URL:
             # Some URL keys may be left empty.
             if not v:
                 continue
 
-            # Deck art URLs can contain metadata in curly braces
-            # (yikes).
-            v = re.sub(r"{.*}", "", v)
+            v = URL_METADATA_RE.sub("", v)
             if v in done:
                 continue
             done.add(v)
-            yield (newtrail, v)
-
-        elif k == "LuaScript":
-            NO_EXT_SITES = ['steamusercontent.com', 'pastebin.com', 'paste.ee', 'drive.google.com', 'steamuserimages-a.akamaihd.net',]
-            # Parse lauscript for potential URLs
-            url_matches = re.findall(r'((?:http|https):\/\/(?:[\w\-_]+(?:(?:\.[\w\-_]+)+))(?:[\w\-\.,@?^=%&:/~\+#]*[\w\-\@?^=%&/~\+#])?)', v)
-            for url in url_matches:
-                valid_url = False
-
-                # Detect if URL ends in a valid extension or is from a site which doesn't use extension
-                for site in NO_EXT_SITES:
-                    if url.lower().find(site) >= 0:
-                        valid_url = True
-                        break
-                else:
-                    for ext in ALL_VALID_EXTS:
-                        if url.lower().find(ext.lower()) >= 0:
-                            valid_url = True
-                            break
-
-                if valid_url:
-                    if url in done:
-                        continue
-                    done.add(url)
-                    yield (newtrail, url)
+            yield (_trail_list((node, k)), v)
+
+        elif kind == KEY_LUA_SCRIPT:
+            newtrail = None
+            for url in _lua_script_urls(v, done, scripts):
+                if newtrail is None:
+                    newtrail = _trail_list((node, k))
+                yield (newtrail, url)
 
 
 # We need checks for whether a URL points to a mesh or an image, so we
@@ -190,6 +416,157 @@ def is_custom_ui_asset(path, url):
     return 'CustomUIAssets' in path
 
 
+# MIME types we accept for assets found in scripts and custom UI, which
+# can be any kind of asset.
+ANY_ASSET_MIME_TYPES = (
+    "text/plain",
+    "application/pdf",
+    "application/binary",
+    "application/octet-stream",
+    "application/json",
+    "application/x-tgif",
+    "image/jpeg",
+    "image/jpg",
+    "image/png",
+    "video/mp4",
+)
+
+
+class AssetKind(Enum):
+    """The kinds of assets a save refers to.
+
+    Each kind knows its cache directory (None if the asset may be cached
+    in any of them), the extension to assume when nothing else tells us
+    (and whether cached files always carry it), the extensions cached
+    files may have, and which MIME types (or MIME type prefixes) are
+    expected when the asset is downloaded.
+
+    """
+
+    OBJ = (
+        "obj",
+        OBJPATH,
+        ".obj",
+        True,
+        tuple(OBJ_EXTS),
+        (),
+        # No exact MIME types; these are prefixes, so parameters and
+        # vendor variants are accepted.
+        (
+            "text/plain",
+            "application/binary",
+            "application/octet-stream",
+            "application/json",
+            "application/x-tgif",
+        ),
+    )
+    ASSETBUNDLE = (
+        "assetbundle",
+        BUNDLEPATH,
+        ".unity3d",
+        True,
+        tuple(BUNDLE_EXTS),
+        (),
+        # MIME type prefixes, as for OBJ.
+        ("application/binary", "application/octet-stream"),
+    )
+    AUDIO = (
+        "audio",
+        AUDIOPATH,
+        ".WAV",
+        False,
+        tuple(AUDIO_EXTS),
+        ("application/octet-stream", "application/binary"),
+        ("audio/",),
+    )
+    PDF = (
+        "pdf",
+        PDFPATH,
+        ".PDF",
+        True,
+        tuple(PDF_EXTS),
+        ("application/pdf", "application/binary", "application/octet-stream"),
+        (),
+    )
+    IMAGE = (
+        "image",
+        IMGPATH,
+        ".png",
+        False,
+        tuple(IMG_EXTS),
+        (
+            "image/jpeg",
+            "image/jpg",
+            "image/png",
+            "application/octet-stream",
+            "application/binary",
+            "video/mp4",
+        ),
+        (),
+    )
+    SCRIPT = (
+        "script",
+        None,
+        ".png",
+        False,
+        tuple(ALL_VALID_EXTS),
+        ANY_ASSET_MIME_TYPES,
+        (),
+    )
+    CUSTOM_UI = (
+        "custom_ui",
+        None,
+        ".png",
+        False,
+        tuple(ALL_VALID_EXTS),
+        ANY_ASSET_MIME_TYPES,
+        (),
+    )
+
+    def __init__(
+        self, label, directory, default_ext, fixed_ext, exts, mime_types,
+        mime_prefixes,
+    ):
+        self.label = label
+        self.directory = directory
+        self.default_ext = default_ext
+        self.fixed_ext = fixed_ext
+        self.exts = exts
+        self.mime_types = frozenset(mime_types)
+        self.mime_prefixes = mime_prefixes
+
+    def accepts(self, mime):
+        """Whether `mime` is a content type expected for this kind."""
+
+        return mime in self.mime_types or mime.startswith(self.mime_prefixes)
+
+
+KIND_BY_KEY = {
+    "MeshURL": AssetKind.OBJ,
+    "ColliderURL": AssetKind.OBJ,
+    "AssetbundleURL": AssetKind.ASSETBUNDLE,
+    "AssetbundleSecondaryURL": AssetKind.ASSETBUNDLE,
+    "CurrentAudioURL": AssetKind.AUDIO,
+    "AudioLibrary": AssetKind.AUDIO,
+    "PDFUrl": AssetKind.PDF,
+}
+
+
+def classify(path, url):
+    """Return the AssetKind of the URL found at `path`.
+
+    This agrees with the is_* predicates, but needs a single lookup.
+
+    """
+
+    key = path[-1]
+    if key == "LuaScript":
+        return AssetKind.SCRIPT
+    if "CustomUIAssets" in path:
+        return AssetKind.CUSTOM_UI
+    return KIND_BY_KEY.get(key, AssetKind.IMAGE)
+
+
 def recodeURL(url):
     """Recode the given URL in the way TTS does, which yields the
     file-system path to the cached file."""
@@ -197,8 +574,9 @@ def recodeURL(url):
     return re.sub(r"[\W_]", "", url)
 
 
-def get_fs_path_from_json_path(path, url, exts):
+def get_fs_path_from_json_path(path, url, exts, cache=None):
     recoded_name = recodeURL(url)
+    exists = os.path.exists if cache is None else cache.exists
 
     for ext in exts:
         # Search the url for a valid extension
@@ -211,7 +589,7 @@ def get_fs_path_from_json_path(path, url, exts):
             # been cached and use the extension from the cached filename
             filename = recoded_name + ext
             filename = os.path.join(path, filename)
-            if os.path.exists(filename):
+            if exists(filename):
                 break
     else:
         # This file has not been cached and extension is not included in url
@@ -221,9 +599,12 @@ def get_fs_path_from_json_path(path, url, exts):
     return filename
 
 
-def search_cached_files(url):
+def search_cached_files(url, cache=None):
     recoded_name = recodeURL(url)
 
+    if cache is not None:
+        return cache.find(recoded_name)
+
     for ttsexts, path in MOD_PATHS:
         for ttsext in ttsexts:
             filename = recoded_name + ttsext
@@ -246,53 +627,32 @@ def get_fs_path_from_extension(url, ext):
         return None
 
 
-def get_fs_path(path, url):
-    """Return a file-system path to the object in the cache."""
+def get_fs_path(path, url, cache=None, kind=None):
+    """Return a file-system path to the object in the cache.
 
-    recoded_name = recodeURL(url)
+    If a libcache.CacheIndex is given, existing files are looked up in it
+    instead of on the file system. `kind` may be given if the URL was
+    already classified.
 
-    if is_from_script(path, url):
-        # Can be different extensions and mod directories, so search the cache for
-        # any matches.  If none are found we'll determine the file path during the
-        # download process.
-        filename = search_cached_files(url)
-        return filename
+    """
 
-    elif is_custom_ui_asset(path, url):
+    if kind is None:
+        kind = classify(path, url)
+
+    if kind.directory is None:
         # Can be different extensions and mod directories, so search the cache for
         # any matches.  If none are found we'll determine the file path during the
         # download process.
-        filename = search_cached_files(url)
-        return filename
-
-    elif is_obj(path, url):
-        filename = recoded_name + ".obj"
-        return os.path.join(OBJPATH, filename)
-
-    elif is_assetbundle(path, url):
-        filename = recoded_name + ".unity3d"
-        return os.path.join(BUNDLEPATH, filename)
-
-    elif is_audiolibrary(path, url):
-        # We know the cache location of the file
-        # but the extension may be one of many.
-        return get_fs_path_from_json_path(AUDIOPATH, url, AUDIO_EXTS)
+        return search_cached_files(url, cache)
 
-    elif is_pdf(path, url):
-        filename = recoded_name + ".PDF"
-        return os.path.join(PDFPATH, filename)
+    elif kind.fixed_ext:
+        filename = recodeURL(url) + kind.default_ext
+        return os.path.join(kind.directory, filename)
 
-    elif is_image(path, url):
+    else:
         # We know the cache location of the file
         # but the extension may be one of many.
-        return get_fs_path_from_json_path(IMGPATH, url, IMG_EXTS)
-
-    else:
-        errstr = (
-            "Do not know how to generate path for "
-            "URL {url} at {path}.".format(url=url, path=path)
-        )
-        raise ValueError(errstr)
+        return get_fs_path_from_json_path(kind.directory, url, kind.exts, cache)
 
 
 def fix_ext_case(ext):
@@ -302,7 +662,38 @@ def fix_ext_case(ext):
         return ext.lower()
 
 
-def urls_from_save(filename):
+def _open_save_events(filename):
+    """Open a save for streaming, and return the file and its parse
+    events, checking that the save is a JSON object."""
+
+    infile = open(filename, "r", encoding="utf-8")
+    events = libjson.iter_events(infile, strict=False)
+    try:
+        first = next(events)
+    except UnicodeDecodeError:
+        infile.close()
+        raise IllegalSavegameException
+    except BaseException:
+        infile.close()
+        raise
+
+    if first[0] != libjson.START_MAP:
+        infile.close()
+        raise IllegalSavegameException
+
+    return infile, itertools.chain([first], events)
+
+
+def _stream_urls(infile, events):
+    with infile:
+        try:
+            yield from seekURL_events(events)
+        except UnicodeDecodeError:
+            raise IllegalSavegameException
+
+
+def load_save(filename):
+    """Parse a save file, and return its top-level object."""
 
     with open(filename, "r", encoding="utf-8") as infile:
         try:
@@ -313,11 +704,166 @@ def urls_from_save(filename):
     if not isinstance(save, dict):
         raise IllegalSavegameException
 
-    return seekURL(save)
+    return save
+
+
+def urls_from_save(filename, stream=False):
+    """Return an iterator over the (trail, url) pairs in a save.
+
+    With `stream`, the save is tokenized incrementally instead of being
+    loaded as a whole, which bounds memory use for huge saves.
+
+    """
+
+    if stream:
+        return _stream_urls(*_open_save_events(filename))
+
+    return seekURL(load_save(filename))
+
 
+def get_save_name(filename, stream=False):
 
-def get_save_name(filename):
+    if stream:
+        infile, events = _open_save_events(filename)
+        with infile:
+            depth = 0
+            for event, value in events:
+                if event == libjson.START_MAP or event == libjson.START_ARRAY:
+                    depth += 1
+                elif event == libjson.END_MAP or event == libjson.END_ARRAY:
+                    depth -= 1
+                elif depth == 1 and event == libjson.MAP_KEY and value == "SaveName":
+                    return libjson.build_value(events, *next(events))
+        raise KeyError("SaveName")
 
     with open(filename, "r", encoding="utf-8") as infile:
         save = json.load(infile)
     return save["SaveName"]
+
+
+class SaveDocument:
+    """A save game or mod file, which is read and parsed at most once, no
+    matter how many of its properties are used.
+
+    In `stream` mode the save is never loaded as a whole; each property
+    is read incrementally from the file instead.
+
+    """
+
+    # Set by plan().
+    url_list = None
+    error = None
+
+    def __init__(self, filename, stream=False):
+        self.filename = filename
+        self.stream = stream
+
+    @cached_property
+    def data(self):
+        """The parsed save."""
+
+        return load_save(self.filename)
+
+    @cached_property
+    def save_name(self):
+
+        if self.stream:
+            return get_save_name(self.filename, stream=True)
+        return self.data["SaveName"]
+
+    def urls(self):
+        """Return an iterator over the (trail, url) pairs in the save."""
+
+        if self.error is not None:
+            raise self.error
+        if self.url_list is not None:
+            return iter(self.url_list)
+        if self.stream:
+            return urls_from_save(self.filename, stream=True)
+        return seekURL(self.data)
+
+    def plan(self):
+        """Extract the save name and the URLs, and drop the parsed save.
+
+        A planned document is small, so it can be cheaply passed between
+        processes. An error raised while extracting URLs is raised again
+        by urls().
+
+        """
+
+        with suppress(Exception):
+            self.save_name
+        try:
+            self.url_list = list(self.urls())
+        except Exception as error:
+            self.error = error
+        self.__dict__.pop("data", None)
+        return self
+
+    @property
+    def thumbnail(self):
+        """The path to the thumbnail stored alongside the save, or None."""
+
+        thumbnail = os.path.splitext(self.filename)[0] + ".png"
+        if os.path.exists(thumbnail):
+            return thumbnail
+        return None
+
+    @cached_property
+    def stat(self):
+        return os.stat(self.filename)
+
+    @property
+    def mtime(self):
+        return self.stat.st_mtime
+
+    @property
+    def size(self):
+        return self.stat.st_size
+
+
+def _plan_save(filename, stream):
+    return SaveDocument(filename, stream).plan()
+
+
+def plan_saves(filenames, jobs=None, stream=False):
+    """Return an iterator over planned SaveDocuments for `filenames`, in
+    order.
+
+    Saves are parsed and searched for URLs in a pool of `jobs` processes
+    (one per CPU by default), a few saves ahead of the one being consumed.
+
+    """
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(filenames) <= 1:
+        return (_plan_save(filename, stream) for filename in filenames)
+
+    return _plan_saves_in_pool(filenames, jobs, stream)
+
+
+def _plan_saves_in_pool(filenames, jobs, stream):
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    executor = ProcessPoolExecutor(jobs)
+    pending = collections.deque()
+    filenames = iter(filenames)
+
+    try:
+        # Keep every worker busy, but don’t let results pile up.
+        for filename in itertools.islice(filenames, 2 * jobs):
+            pending.append(executor.submit(_plan_save, filename, stream))
+
+        while pending:
+            save = pending.popleft().result()
+            for filename in itertools.islice(filenames, 1):
+                pending.append(executor.submit(_plan_save, filename, stream))
+            yield save
+
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
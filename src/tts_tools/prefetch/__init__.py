@@ -1,34 +1,30 @@
 from contextlib import suppress
-from tts_tools.libtts import GAMEDATA_DEFAULT
+from tts_tools.libassets import AssetGraph
+from tts_tools.libcache import open_cache_index
+from tts_tools.libhttp import ConnectionPool
+from tts_tools.libhttp import open_validator_store
+from tts_tools.libjournal import open_journal
+from tts_tools.libtts import classify
 from tts_tools.libtts import get_fs_path
 from tts_tools.libtts import get_fs_path_from_extension
+from tts_tools.libtts import recodeURL
 from tts_tools.libtts import fix_ext_case
-from tts_tools.libtts import get_save_name
+from tts_tools.libtts import get_gamedata_default
 from tts_tools.libtts import IllegalSavegameException
-from tts_tools.libtts import is_assetbundle
-from tts_tools.libtts import is_audiolibrary
-from tts_tools.libtts import is_image
-from tts_tools.libtts import is_obj
-from tts_tools.libtts import is_pdf
-from tts_tools.libtts import is_from_script
-from tts_tools.libtts import is_custom_ui_asset
-from tts_tools.libtts import urls_from_save
+from tts_tools.libtts import plan_saves
+from tts_tools.libtts import SaveDocument
 from tts_tools.util import print_err
 from tts_tools.util import make_safe_filename
-from tts_tools.util import save_modification_time
 from tts_tools.util import get_mods_in_directory
 from tts_tools.util import PrintStatus
 
-import http.client
+import io
+import itertools
+import json
 import os
-import socket
 import sys
-import urllib.error
-import urllib.parse
-import urllib.request
-from tqdm.auto import trange, tqdm
+import threading
 
-from contextlib import nullcontext
 
 DEFAULT_EXT = {
     "text/plain":          ".obj",
@@ -41,6 +37,207 @@ DEFAULT_EXT = {
     "video/mp4":           ".mp4",
 }
 
+# Downloads are written to a file with this suffix, and renamed once
+# complete. Interrupted ones are kept, along with a STATE_SUFFIX file, if
+# the host can send the rest later.
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".json"
+
+
+def read_partial(part_name, url):
+    """Return what is known about an interrupted download of `url` into
+    `part_name`, or None if it cannot be resumed.
+
+    This is a dict with the `etag`, `last_modified` and `length` of the
+    file, and the `offset` up to which it was downloaded.
+
+    """
+
+    try:
+        with open(part_name + STATE_SUFFIX, "r", encoding="utf-8") as infile:
+            state = json.load(infile)
+        if state["url"] != url:
+            return None
+        state["offset"] = os.path.getsize(part_name)
+        if not 0 < state["offset"] < state["length"]:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return state
+
+
+def keep_partial(part_name, state):
+    """Record `state` of an interrupted download into `part_name`."""
+
+    tmp_filename = part_name + STATE_SUFFIX + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as outfile:
+        json.dump(state, outfile)
+    os.replace(tmp_filename, part_name + STATE_SUFFIX)
+
+
+def remove_partial(part_name):
+    for filename in (part_name, part_name + STATE_SUFFIX):
+        with suppress(FileNotFoundError):
+            os.remove(filename)
+
+
+def parse_content_range(value):
+    """Return the first byte and the total length from a Content-Range
+    header, or None."""
+
+    with suppress(ValueError, AttributeError):
+        unit, _, byte_range = value.strip().partition(" ")
+        first, _, total = byte_range.partition("/")
+        if unit == "bytes":
+            return int(first.partition("-")[0]), int(total)
+    return None
+
+
+def range_validator(etag, last_modified):
+    """Return the validator to send as If-Range, or None.
+
+    If-Range only works with strong ETags; hosts send all of the file in
+    response to a weak one.
+
+    """
+
+    if etag and not etag.startswith("W/"):
+        return etag
+    return last_modified
+
+
+# Files of at least SEGMENT_THRESHOLD bytes are downloaded in SEGMENTS
+# byte ranges at once, as some hosts throttle each connection.
+SEGMENTS = 4
+SEGMENT_THRESHOLD = 32 * 1024 * 1024
+
+
+class Segmenter:
+    """Downloads large files in several byte ranges at once, each over a
+    connection of its own, into a file which has its final size already.
+
+    A segment which is cut short by a timeout or a dropped connection is
+    requested again from where it stopped, up to `retries` times, like
+    fetch_with_retries does for whole files. Other errors end the whole
+    download with an IncompleteRead, so it is retried from the start.
+
+    """
+
+    def __init__(self, segments=SEGMENTS, threshold=SEGMENT_THRESHOLD, retries=10):
+        self.segments = segments
+        self.threshold = threshold
+        self.retries = retries
+
+    def applies(self, response, total):
+        """Return whether the file of `response` is downloaded in
+        segments."""
+
+        return (
+            self.segments > 1
+            and total is not None
+            and total >= max(self.threshold, self.segments)
+            and response.status == 200
+            and response.getheader("Accept-Ranges", "").strip().lower() == "bytes"
+        )
+
+    def ranges(self, total):
+        size = -(-total // self.segments)
+        return [[start, min(start + size, total)] for start in range(0, total, size)]
+
+    def download(self, response, request, filename, total, validator, progress):
+        """Download the `total` bytes of the file of `response` into
+        `filename`.
+
+        The first segment is read from `response`, and the others are
+        requested with `request`, which takes the headers to add and
+        returns a response, from threads of their own.
+
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        ranges = self.ranges(total)
+        # Set once a segment failed, so the others stop.
+        failed = threading.Event()
+
+        with ThreadPoolExecutor(len(ranges) - 1) as executor:
+            futures = [
+                executor.submit(
+                    self.fetch, request, filename, segment, validator, progress, failed
+                )
+                for segment in ranges[1:]
+            ]
+            self.fetch(
+                request, filename, ranges[0], validator, progress, failed, response
+            )
+            for future in futures:
+                future.result()
+
+    def fetch(
+        self, request, filename, segment, validator, progress, failed, response=None
+    ):
+        """Download the rest of `segment` into `filename`, reading from
+        `response` first, if given."""
+
+        import http.client
+        import socket
+        import urllib.error
+
+        headers = {}
+        if validator:
+            # If the file changed, the host sends all of it instead.
+            headers["If-Range"] = validator
+
+        try:
+            for _ in range(self.retries):
+                start, end = segment
+                if start >= end or failed.is_set():
+                    return
+                try:
+                    if response is None:
+                        headers["Range"] = "bytes={}-{}".format(start, end - 1)
+                        response = request(headers)
+                        content_range = parse_content_range(
+                            response.getheader("Content-Range")
+                        )
+                        if (
+                            response.status != 206
+                            or content_range is None
+                            or content_range[0] != start
+                        ):
+                            response.close()
+                            break
+                    with response:
+                        self.write(response, filename, segment, progress, failed)
+                except (socket.timeout, http.client.IncompleteRead):
+                    continue
+                except (urllib.error.URLError, http.client.HTTPException) as error:
+                    raise http.client.IncompleteRead(b"", end - start) from error
+                finally:
+                    response = None
+            start, end = segment
+            if start < end and not failed.is_set():
+                raise http.client.IncompleteRead(b"", end - start)
+        except BaseException:
+            failed.set()
+            raise
+
+    def write(self, response, filename, segment, progress, failed):
+        """Write the body of `response` into `filename` at the start of
+        `segment`, a list of the first byte still missing and the end,
+        advancing the start as it goes."""
+
+        with open(filename, "r+b") as outfile:
+            outfile.seek(segment[0])
+            while segment[0] < segment[1] and not failed.is_set():
+                data = response.read(min(1024*8, segment[1] - segment[0]))
+                if not data:
+                    break
+                outfile.write(data)
+                segment[0] += len(data)
+                progress.update(1)
+
+
 def download_file(
     url,
     fetch_url,
@@ -52,15 +249,61 @@ def download_file(
     default_ext_from_path,
     ps,
     retry_num,
-    verbose
+    verbose,
+    cache=None,
+    pool=None,
+    validators=None,
+    segmenter=None,
 ):
+    """Download `url` from `fetch_url` into the cache, and return None, or
+    the URL and why it is missing.
+
+    With a libhttp.ConnectionPool, its connections are reused. With a
+    libhttp.ValidatorStore, a file which is cached already is only
+    downloaded again if it changed. An interrupted download is resumed
+    where it stopped, if it is still the same file. With a Segmenter,
+    large files are downloaded in several parts at once.
+
+    """
+
+    import http.client
+    import urllib.error
+    import urllib.request
+
     missing = None
-    request = urllib.request.Request(url=fetch_url, headers=headers)
+    response = None
+    partial = None
+
+    if outfile_name is not None:
+        partial = read_partial(outfile_name + PART_SUFFIX, url)
+
+    if partial is not None:
+        # If the file changed since, the host sends all of it.
+        headers = dict(headers)
+        headers["Range"] = "bytes={}-".format(partial["offset"])
+        headers["If-Range"] = range_validator(
+            partial["etag"], partial["last_modified"]
+        )
+    elif validators is not None:
+        headers = dict(
+            headers, **validators.conditional_headers(url, outfile_name)
+        )
+
+    def request(extra_headers):
+        request_headers = dict(headers, **extra_headers)
+        if pool is not None:
+            return pool.request(fetch_url, request_headers, timeout)
+        request = urllib.request.Request(url=fetch_url, headers=request_headers)
+        return urllib.request.urlopen(request, timeout=timeout)
 
     try:
-        response = urllib.request.urlopen(request, timeout=timeout)
+        response = request({})
 
     except urllib.error.HTTPError as error:
+        if error.code == 304:
+            # urllib treats this as an error.
+            ps.print("Not modified")
+            return None
         ps.print(
             "Error {code} ({reason})".format(
                 code=error.code, reason=error.reason
@@ -76,17 +319,94 @@ def download_file(
         ps.print("HTTP error ({reason})".format(reason=error))
         missing = (url, f"HTTPException ({error})")
 
-    try:
-        if os.path.basename(response.url) == 'removed.png':
-            # Imgur sends bogus png when files are missing, ignore them
-            ps.print("Removed")
-            missing = (url, f"Removed")
-    except UnboundLocalError:
-        pass
+    if response is not None and os.path.basename(response.url) == 'removed.png':
+        # Imgur sends bogus png when files are missing, ignore them
+        ps.print("Removed")
+        missing = (url, "Removed")
 
     if missing is not None:
+        if response is not None:
+            response.close()
         return missing
 
+    if response.status == 304:
+        response.close()
+        ps.print("Not modified")
+        return None
+
+    with response:
+        return save_response(
+            response,
+            url,
+            outfile_name,
+            content_expected,
+            ignore_content_type,
+            default_ext_from_path,
+            ps,
+            retry_num,
+            verbose,
+            cache,
+            validators,
+            partial,
+            segmenter,
+            request,
+        )
+
+
+def save_response(
+    response,
+    url,
+    outfile_name,
+    content_expected,
+    ignore_content_type,
+    default_ext_from_path,
+    ps,
+    retry_num,
+    verbose,
+    cache=None,
+    validators=None,
+    partial=None,
+    segmenter=None,
+    request=None,
+):
+    """Write the body of a response into the cache, recording its
+    validators in `validators`, if given.
+
+    `partial` is what read_partial returned for the request; the body
+    of a partial response is appended to it. With a Segmenter, and a
+    function making further requests for the file, large files are
+    downloaded in several parts at once.
+
+    """
+
+    # Imported here, so importing the package stays cheap.
+    import http.client
+    from tqdm.auto import tqdm
+
+    etag = response.getheader("ETag")
+    last_modified = response.getheader("Last-Modified")
+
+    start = 0
+    total = None
+    if response.status == 206:
+        content_range = parse_content_range(response.getheader("Content-Range"))
+        if (
+            partial is None
+            or content_range is None
+            or content_range[0] != partial["offset"]
+            or (etag and partial["etag"] and etag != partial["etag"])
+        ):
+            # Not the rest of the file we have; start over.
+            if outfile_name is not None:
+                remove_partial(outfile_name + PART_SUFFIX)
+            raise http.client.IncompleteRead(b"")
+        start, total = content_range
+        etag = etag or partial["etag"]
+        last_modified = last_modified or partial["last_modified"]
+    else:
+        with suppress(TypeError, ValueError):
+            total = int(response.getheader("Content-Length"))
+
     # Only for informative purposes.
     length = response.getheader("Content-Length", 0)
     length_kb = "???"
@@ -135,6 +455,27 @@ def download_file(
     # TTS saves some file extensions as upper case
     filename_ext = fix_ext_case(filename_ext)
 
+    segmented = (
+        segmenter is not None
+        and request is not None
+        and start == 0
+        and segmenter.applies(response, total)
+    )
+
+    # Only downloads to a known path can be resumed, as the next attempt
+    # needs to find them before there is a response. Segmented ones have
+    # gaps, rather than stopping at one point.
+    resumable = (
+        not segmented
+        and outfile_name is not None
+        and total is not None
+        and bool(etag or last_modified)
+        and (
+            response.status == 206
+            or response.getheader("Accept-Ranges", "").strip().lower() == "bytes"
+        )
+    )
+
     if outfile_name is None:
         ext = filename_ext
         outfile_name = get_fs_path_from_extension(url, ext)
@@ -142,7 +483,10 @@ def download_file(
         if outfile_name is None:
             ps.print("Cannot detect filepath for filetype '{type}'.".format(type=ext))
             return (url, f"Cannot detect filepath ({ext})")
+        part_name = outfile_name + PART_SUFFIX
     else:
+        # Named like the next attempt will look for it.
+        part_name = outfile_name + PART_SUFFIX
         # Check if we know the extension of our filename.  If not, use
         # the data in the response to determine the appropriate extension.
         ext = os.path.splitext(outfile_name)[1]
@@ -160,38 +504,74 @@ def download_file(
         # We want to print progress bar status immediately...
         ps.print(f"{ext} -> {mod_dir} {size_msg}")
 
+    if start > 0:
+        ps.print(f"..resuming at {start} bytes.. ", end='', flush=True)
+    elif segmented:
+        ps.print(f"..in {segmenter.segments} segments.. ", end='', flush=True)
+
     try:
-        with open(outfile_name, "wb") as outfile:
-            num_segs = int(int(length)/(8*1024))
-            desc = f"{ext}->{mod_dir} {size_msg}"
-            if retry_num > 0:
-                desc = f"Retry {retry_num} - {desc}"
-            with tqdm(total=num_segs, leave=False, desc=desc) as pbar:
-                pbar.update(1)
-                data = response.read(1024*8)
-                while(data):
-                    outfile.write(data)
+        num_segs = int(int(length)/(8*1024))
+        desc = f"{ext}->{mod_dir} {size_msg}"
+        if retry_num > 0:
+            desc = f"Retry {retry_num} - {desc}"
+        with tqdm(total=num_segs, leave=False, desc=desc) as pbar:
+            pbar.update(1)
+            if segmented:
+                with open(part_name, "wb") as outfile:
+                    outfile.truncate(total)
+                segmenter.download(
+                    response,
+                    request,
+                    part_name,
+                    total,
+                    range_validator(etag, last_modified),
+                    pbar,
+                )
+                size = total
+            else:
+                with open(part_name, "ab" if start > 0 else "wb") as outfile:
                     data = response.read(1024*8)
-                    pbar.update(1)
+                    while(data):
+                        outfile.write(data)
+                        data = response.read(1024*8)
+                        pbar.update(1)
+                    size = outfile.tell()
+
+        # Reads come up short, rather than failing, when the connection
+        # is closed early.
+        if total is not None and size != total:
+            raise http.client.IncompleteRead(b"", total - size)
+        os.replace(part_name, outfile_name)
 
     except FileNotFoundError as error:
         print_err("Error writing object to disk: {}".format(error))
         raise
 
-    # Don’t leave files with partial content lying around.
-    except Exception:
-        with suppress(FileNotFoundError):
-            ps.print(f"..cleanup.. ", end='', flush=True)
-            os.remove(outfile_name)
-        raise
-
-    except SystemExit:
-        with suppress(FileNotFoundError):
-            ps.print(f"..cleanup.. ", end='', flush=True)
-            os.remove(outfile_name)
+    # Don’t leave files with partial content lying around, unless they
+    # can be resumed.
+    except (Exception, SystemExit):
+        with suppress(OSError):
+            if resumable and os.path.getsize(part_name) > 0:
+                ps.print("..keeping partial file.. ", end='', flush=True)
+                state = dict(
+                    url=url,
+                    etag=etag,
+                    last_modified=last_modified,
+                    length=total,
+                )
+                keep_partial(part_name, state)
+            else:
+                ps.print("..cleanup.. ", end='', flush=True)
+                remove_partial(part_name)
         raise
 
     else:
+        with suppress(FileNotFoundError):
+            os.remove(part_name + STATE_SUFFIX)
+        if cache is not None:
+            cache.add(outfile_name)
+        if validators is not None:
+            validators.record(url, outfile_name, response)
         if verbose:
             ps.print("ok")
 
@@ -204,20 +584,166 @@ def download_file(
 
     return None
 
+# Hosts which get their own limit of concurrent downloads, by domain.
+HOST_JOBS = {
+    "steamusercontent.com": 8,
+    "imgur.com": 4,
+    "dropbox.com": 4,
+    "dropboxusercontent.com": 4,
+    "pastebin.com": 2,
+}
+
+
+class HostLimiter:
+    """Limits how many downloads run at once per host.
+
+    Hosts within a domain in `host_jobs` share its limit; any other host
+    may have `default` downloads running at once.
+
+    """
+
+    def __init__(self, default=4, host_jobs=HOST_JOBS):
+        self.default = default
+        self.host_jobs = host_jobs
+        # Domain (or host) → semaphore
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def domain(self, host):
+        host = (host or "").lower()
+        for domain in self.host_jobs:
+            if host == domain or host.endswith("." + domain):
+                return domain
+        return host
+
+    def slot(self, host):
+        """Return a semaphore to hold while downloading from `host`."""
+
+        domain = self.domain(host)
+        with self.lock:
+            if domain not in self.slots:
+                limit = self.host_jobs.get(domain, self.default)
+                self.slots[domain] = threading.BoundedSemaphore(limit)
+            return self.slots[domain]
+
+
+class BufferedStatus(PrintStatus):
+    """A PrintStatus collecting the messages of one download, so they can
+    be printed at once, rather than interleaved with those of others."""
+
+    def __init__(self, verbose=True):
+        super().__init__(None, verbose=verbose)
+        self.output = io.StringIO()
+
+    def print(self, *args, **kwargs):
+        if self.verbose:
+            kwargs.pop("flush", None)
+            print(*args, file=self.output, **kwargs)
+
+
+def fetch_with_retries(
+    url,
+    fetch_url,
+    outfile_name,
+    kind,
+    ignore_content_type,
+    timeout,
+    timeout_retries,
+    user_agent,
+    ps,
+    verbose,
+    cache=None,
+    pool=None,
+    validators=None,
+    segmenter=None,
+):
+    """Download `url`, retrying on timeouts, and return None, or the URL
+    and why it is missing."""
+
+    import http.client
+    import socket
+
+    headers = {"User-Agent": user_agent}
+
+    for i in range(timeout_retries):
+        if i == 0:
+            retry_message = ""
+        else:
+            retry_message = f"Retry {i}: "
+        ps.print("{}{} ".format(retry_message,url), end="", flush=True)
+        try:
+            results = download_file(
+                url,
+                fetch_url,
+                outfile_name,
+                headers,
+                timeout,
+                kind.accepts,
+                ignore_content_type,
+                kind.default_ext,
+                ps,
+                i,
+                verbose,
+                cache,
+                pool,
+                validators,
+                segmenter,
+            )
+        except socket.timeout as error:
+            ps.print("Error ({reason}). Retrying...".format(reason=error))
+            continue
+        except http.client.IncompleteRead as error:
+            ps.print("Error ({reason}). Retrying...".format(reason=error))
+            continue
+        if results is not None:
+            # See if we have some trailing URL options and retry if so
+            offset = fetch_url.rfind("?")
+            if offset > 0:
+                ps.print("Error ({reason}). Retrying without URL params...".format(reason=results[1]))
+                fetch_url = fetch_url[0:fetch_url.rfind("?")]
+                continue
+        break
+    else:
+        print_err("All timeout retries exhausted.")
+        sys.exit(1)
+
+    return results
+
+
 def prefetch_file(
     filename,
     refetch=False,
     ignore_content_type=False,
     dry_run=False,
-    gamedata_dir=GAMEDATA_DEFAULT,
+    gamedata_dir=None,
     timeout=10,
     timeout_retries=10,
     semaphore=None,
     user_agent="TTS prefetch",
     verbose=False,
+    stream=False,
+    cache=None,
+    save=None,
+    graph=None,
+    jobs=1,
+    limiter=None,
+    pool=None,
+    validators=None,
+    segmenter=None,
+    assets=None,
 ):
+    from tqdm.auto import tqdm
+
+    import urllib.parse
+
+    if gamedata_dir is None:
+        gamedata_dir = get_gamedata_default()
+
+    if save is None:
+        save = SaveDocument(filename, stream=stream)
+
     try:
-        save_name = get_save_name(filename)
+        save_name = save.save_name
     except Exception:
         save_name = "???"
     
@@ -231,7 +757,7 @@ def prefetch_file(
         print(readable_filename)
 
     try:
-        urls = urls_from_save(filename)
+        urls = save.urls()
     except (FileNotFoundError, IllegalSavegameException) as error:
         print_err(
             "Error retrieving URLs from {filename}: {error}".format(
@@ -241,9 +767,43 @@ def prefetch_file(
         raise
 
     missing = []
-    skipped = False
     urls = list(urls) # Need for progress bar count
 
+    if jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        if limiter is None:
+            limiter = HostLimiter()
+        executor = ThreadPoolExecutor(jobs)
+        # Set once the prefetch is aborted, so queued downloads do not
+        # start anymore.
+        aborted = threading.Event()
+        # (future, asset), in the order of the URLs
+        downloads = []
+    else:
+        executor = None
+
+    def download(url, fetch_url, outfile_name, kind, ps):
+        with limiter.slot(urllib.parse.urlparse(fetch_url).hostname):
+            if aborted.is_set():
+                return None, ps
+            return fetch_with_retries(
+                url,
+                fetch_url,
+                outfile_name,
+                kind,
+                ignore_content_type,
+                timeout,
+                timeout_retries,
+                user_agent,
+                ps,
+                verbose,
+                cache,
+                pool,
+                validators,
+                segmenter,
+            ), ps
+
     #with alive_bar(len(urls), dual_line=True, title=readable_filename, unit=' files') if not verbose else nullcontext() as bar:
     with tqdm(total=len(urls), desc=save_name, miniters=1) as pbar:
         ps = PrintStatus(None, verbose=verbose)
@@ -251,12 +811,13 @@ def prefetch_file(
 
             if semaphore and semaphore.acquire(blocking=False):
                 ps.print("Aborted.")
+                if executor is not None:
+                    cancel_downloads(downloads, aborted)
+                    executor.shutdown()
                 return
 
             if not verbose:
                 pbar.update(1)
-                #bar(skipped=skipped)
-                skipped = False
             
             # Some mods contain malformed URLs missing a prefix. I’m not
             # sure how TTS deals with these. Let’s assume http for now.
@@ -267,103 +828,46 @@ def prefetch_file(
 
             try:
                 if urllib.parse.urlparse(fetch_url).hostname.find('localhost') >= 0:
-                    skipped = True
                     continue
             except:
                 # URL was so badly formatted that there is no hostname.
-                missing.append((url, f"Invalid hostname",''))
-                skipped = True
+                missing.append((url, "Invalid hostname",''))
                 continue
 
-            # type in the response.
-            if is_obj(path, url):
-
-                default_ext = '.obj'
-                def content_expected(mime):
-                    return any(
-                        map(
-                            mime.startswith,
-                            (
-                                "text/plain",
-                                "application/binary",
-                                "application/octet-stream",
-                                "application/json",
-                                "application/x-tgif",
-                            ),
-                        )
-                    )
-
-            elif is_assetbundle(path, url):
-
-                default_ext = '.unity3d'
-                def content_expected(mime):
-                    return any(
-                        map(
-                            mime.startswith,
-                            ("application/binary", "application/octet-stream"),
-                        )
-                    )
-
-            elif is_image(path, url):
-
-                default_ext = '.png'
-                def content_expected(mime):
-                    return mime in (
-                        "image/jpeg",
-                        "image/jpg",
-                        "image/png",
-                        "application/octet-stream",
-                        "application/binary",
-                        "video/mp4",
-                    )
-
-            elif is_audiolibrary(path, url):
-
-                default_ext = '.WAV'
-                def content_expected(mime):
-                    return mime in (
-                        "application/octet-stream",
-                        "application/binary",
-                    ) or mime.startswith("audio/")
-
-            elif is_pdf(path, url):
-
-                default_ext = '.PDF'
-                def content_expected(mime):
-                    return mime in (
-                        "application/pdf",
-                        "application/binary",
-                        "application/octet-stream",
-                    )
-            
-            elif is_from_script(path, url) or is_custom_ui_asset(path, url):
-
-                default_ext = '.png'
-                def content_expected(mime):
-                    return mime in (
-                        "text/plain",
-                        "application/pdf",
-                        "application/binary",
-                        "application/octet-stream",
-                        "application/json",
-                        "application/x-tgif",
-                        "image/jpeg",
-                        "image/jpg",
-                        "image/png",
-                        "video/mp4",
-                    )
+            # The kind of asset determines the default extension and the
+            # content types we expect in the response.
+            kind = classify(path, url)
 
+            asset = None
+            if graph is None:
+                outfile_name = get_fs_path(path, url, cache, kind)
             else:
-                errstr = "Do not know how to retrieve URL {url} at {path}.".format(
-                    url=url, path=path
-                )
-                raise ValueError(errstr)
+                # Shared assets are only resolved once per run.
+                asset = graph.add(filename, path, url, kind)
+                if not asset.resolved:
+                    asset.path = get_fs_path(path, url, cache, kind)
+                    asset.resolved = True
+                outfile_name = asset.path
+
+            if assets is not None:
+                assets.append(outfile_name or recodeURL(url))
+
+            if asset is not None:
+                if asset.fetched:
+                    # Another mod already brought this asset into the
+                    # cache during this run (or failed to).
+                    if asset.missing is not None:
+                        missing.append(asset.missing)
+                    continue
+                asset.fetched = True
 
-            outfile_name = get_fs_path(path, url)
             if outfile_name is not None:
                 # Check if the object is already cached.
-                if os.path.isfile(outfile_name) and not refetch:
-                    skipped = True
+                if cache is not None:
+                    is_cached = cache.exists(outfile_name)
+                else:
+                    is_cached = os.path.isfile(outfile_name)
+                if is_cached and not refetch:
                     continue
 
             if dry_run:
@@ -371,49 +875,52 @@ def prefetch_file(
                 ps.print("dry run")
                 continue
 
-            headers = {"User-Agent": user_agent}
+            if executor is not None:
+                future = executor.submit(
+                    download,
+                    url,
+                    fetch_url,
+                    outfile_name,
+                    kind,
+                    BufferedStatus(verbose=verbose),
+                )
+                downloads.append((future, outfile_name, asset))
+                continue
 
-            for i in range(timeout_retries):
-                if i == 0:
-                    retry_message = ""
-                else:
-                    retry_message = f"Retry {i}: "
-                ps.print("{}{} ".format(retry_message,url), end="", flush=True)
-                try:
-                    results = download_file(
-                        url,
-                        fetch_url,
-                        outfile_name,
-                        headers,
-                        timeout,
-                        content_expected,
-                        ignore_content_type,
-                        default_ext,
-                        ps,
-                        i,
-                        verbose
-                    )
-                except socket.timeout as error:
-                    ps.print("Error ({reason}). Retrying...".format(reason=error))
-                    continue
-                except http.client.IncompleteRead as error:
-                    ps.print("Error ({reason}). Retrying...".format(reason=error))
-                    continue
-                if results is not None:
-                    # See if we have some trailing URL options and retry if so
-                    offset = fetch_url.rfind("?")
-                    if offset > 0:
-                        ps.print("Error ({reason}). Retrying without URL params...".format(reason=results[1]))
-                        fetch_url = fetch_url[0:fetch_url.rfind("?")]
-                        continue
-                break
-            else:
-                print_err("All timeout retries exhausted.")
-                sys.exit(1)
+            results = fetch_with_retries(
+                url,
+                fetch_url,
+                outfile_name,
+                kind,
+                ignore_content_type,
+                timeout,
+                timeout_retries,
+                user_agent,
+                ps,
+                verbose,
+                cache,
+                pool,
+                validators,
+                segmenter,
+            )
 
             if results is not None:
-                skipped = True
                 missing.append((results[0], results[1], outfile_name))
+                if asset is not None:
+                    asset.missing = missing[-1]
+
+        if executor is not None:
+            with executor:
+                if not wait_for_downloads(downloads, semaphore, aborted):
+                    ps.print("Aborted.")
+                    return
+
+            for future, outfile_name, asset in downloads:
+                results, _ = future.result()
+                if results is not None:
+                    missing.append((results[0], results[1], outfile_name))
+                    if asset is not None:
+                        asset.missing = missing[-1]
     
     workshop_id = os.path.splitext(os.path.basename(filename))[0]
     dest = os.path.dirname(filename)
@@ -441,8 +948,62 @@ def prefetch_file(
         print(completion_msg.format(filename))
 
 
+def wait_for_downloads(downloads, semaphore, aborted):
+    """Wait for concurrent downloads to complete, printing their
+    messages as they do, and return whether they were not aborted."""
+
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import wait
+
+    pending = {future for future, _, _ in downloads}
+    while pending:
+        done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                _, ps = future.result()
+            except BaseException:
+                # Errors, like exhausted retries, abort the prefetch.
+                cancel_downloads(downloads, aborted)
+                raise
+            output = ps.output.getvalue()
+            if output:
+                print(output, end="", flush=True)
+
+        if semaphore and semaphore.acquire(blocking=False):
+            cancel_downloads(downloads, aborted)
+            return False
+    return True
+
+
+def cancel_downloads(downloads, aborted):
+    """Cancel the downloads which did not start yet."""
+
+    aborted.set()
+    for future, _, _ in downloads:
+        future.cancel()
+
+
 def prefetch_files(args, semaphore=None):
 
+    if args.gamedata_dir is None:
+        args.gamedata_dir = get_gamedata_default()
+
+    # Resolve cached files against a single listing of the cache.
+    cache = open_cache_index(
+        os.path.abspath(args.gamedata_dir),
+        args.cache_index,
+        persistent=not args.no_cache_index,
+    )
+
+    # Mods are recorded in the journal of their directory.
+    journals = {}
+
+    def journal_for(infile_dir):
+        infile_dir = os.path.abspath(infile_dir)
+        if infile_dir not in journals:
+            journals[infile_dir] = open_journal(infile_dir, 'prefetch')
+        return journals[infile_dir]
+
     if args.prefetch_all:
         infile_names = []
         for infile_dir in args.infile_names:
@@ -454,11 +1015,45 @@ def prefetch_files(args, semaphore=None):
 
             print(f"Prefetching assets in {infile_dir}:")
             
-            infile_names += get_mods_in_directory(infile_dir, os.path.join(infile_dir, 'prefetch_mtimes.pkl'))
+            infile_names += get_mods_in_directory(infile_dir, journal_for(infile_dir), cache)
     else:
         infile_names = args.infile_names
 
-    for infile_name in infile_names:
+    if args.prefetch_all:
+        # Parse the mods and extract their URLs in parallel, ahead of
+        # prefetching them one after another.
+        saves = plan_saves(infile_names, args.parse_jobs, stream=args.stream)
+    else:
+        saves = itertools.repeat(None)
+
+    # Downloads from the same host are limited across all mods.
+    limiter = HostLimiter(args.host_jobs)
+    segmenter = Segmenter(
+        args.segments, args.segment_threshold * 1024 * 1024, args.timeout_retries
+    )
+
+    # Connections are kept open for the next download from their host,
+    # unless they need to go through a proxy, which urllib takes care of.
+    import urllib.request
+
+    if urllib.request.getproxies():
+        pool = None
+    else:
+        pool = ConnectionPool()
+
+    # The validators of every download are recorded, so that --refetch
+    # only downloads files again if they changed.
+    validators = open_validator_store(
+        os.path.abspath(args.gamedata_dir), conditional=args.refetch
+    )
+
+    # Shared assets are only fetched once per run.
+    graph = AssetGraph()
+    if args.asset_graph:
+        # We change directories along the way.
+        graph_filename = os.path.abspath(args.asset_graph)
+
+    for infile_name, save in zip(infile_names, saves):
 
         if not os.path.exists(infile_name):
             new_infile_name = os.path.join(os.path.join(args.gamedata_dir, os.path.join('Mods', 'Workshop')), infile_name)
@@ -472,6 +1067,7 @@ def prefetch_files(args, semaphore=None):
 
             infile_name = new_infile_name
 
+        assets = []
         try:
             prefetch_file(
                 infile_name,
@@ -484,6 +1080,16 @@ def prefetch_files(args, semaphore=None):
                 semaphore=semaphore,
                 user_agent=args.user_agent,
                 verbose=args.verbose,
+                stream=args.stream,
+                cache=cache,
+                save=save,
+                graph=graph,
+                jobs=args.jobs,
+                limiter=limiter,
+                pool=pool,
+                validators=validators,
+                segmenter=segmenter,
+                assets=assets,
             )
 
         except (FileNotFoundError, IllegalSavegameException, SystemExit):
@@ -491,4 +1097,22 @@ def prefetch_files(args, semaphore=None):
             sys.exit(1)
 
         if not args.dry_run:
-            save_modification_time(infile_name, os.path.join(os.path.dirname(infile_name), 'prefetch_mtimes.pkl'))
\ No newline at end of file
+            # The cached files are recorded too, so that the mod is
+            # prefetched again once they change, e.g. when one which
+            # could not be downloaded has been cached since.
+            journal = journal_for(os.path.dirname(infile_name))
+            journal.record(infile_name, assets, cache)
+
+    for journal in journals.values():
+        journal.close()
+
+    if validators is not None:
+        validators.close()
+
+    if pool is not None:
+        if args.verbose:
+            print(f"Reused connections for {pool.hits} downloads, opened {pool.misses}.")
+        pool.close()
+
+    if args.asset_graph:
+        graph.export(graph_filename)
@@ -1,10 +1,9 @@
-from tts_tools.libtts import GAMEDATA_DEFAULT
 from tts_tools.prefetch import prefetch_files
+from tts_tools.util import VersionAction
 
 import argparse
 import signal
 import sys
-from importlib.metadata import version
 
 description = '''
 TTS-Prefetch
@@ -28,7 +27,7 @@ of the directory
 (e.g. D:\SteamLibrary\steamapps\common\Tabletop Simulator\Tabletop Simulator_Data)
 
 When a mod is prefetched, the mod file's modification time is stored in the
-'prefetch_mtimes.pkl' file contained in the same directory as the json file.
+'prefetch_journal.sqlite' file contained in the same directory as the json file.
 
 If any files are found to be missing during the prefetch operation a text
 file containing a list of the missing files will be created in the directory
@@ -43,7 +42,7 @@ This will prefetch Mods/Workshop/2495129405.json and Mods/Workshop/2491200259.js
 > tts-prefetch -a Workshop
 This will prefetch all json files found in the Mods/Workshop directory
 if their modification time is newer than what is found in the
-Mods/Workshop/prefetch_mtimes.pkl file.
+Mods/Workshop/prefetch_journal.sqlite file.
 
 Usage flags and arguments are as follows:
 '''
@@ -55,8 +54,7 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument(
     "--version",
-    action='version',
-    version=version("tts-backup")
+    action=VersionAction,
 )
 
 parser.add_argument(
@@ -79,7 +77,7 @@ parser.add_argument(
     "--gamedata",
     dest="gamedata_dir",
     metavar="PATH",
-    default=GAMEDATA_DEFAULT,
+    default=None,
     help="The path to the TTS game data directory.",
 )
 
@@ -98,7 +96,7 @@ parser.add_argument(
     dest="refetch",
     default=False,
     action="store_true",
-    help="Rewrite objects that already exist in the cache.",
+    help="Rewrite objects that already exist in the cache, if they changed.",
 )
 
 parser.add_argument(
@@ -135,6 +133,84 @@ parser.add_argument(
     help="HTTP user-agent string.",
 )
 
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    metavar="N",
+    default=1,
+    type=int,
+    help="Number of files which are downloaded at once (default: 1).",
+)
+
+parser.add_argument(
+    "--host-jobs",
+    dest="host_jobs",
+    metavar="N",
+    default=4,
+    type=int,
+    help="Number of files which are downloaded at once from the same host with --jobs, unless the host has a limit of its own (default: 4).",
+)
+
+parser.add_argument(
+    "--segments",
+    dest="segments",
+    metavar="N",
+    default=4,
+    type=int,
+    help="Number of connections over which large files are downloaded at once, if the host supports it (default: 4).",
+)
+
+parser.add_argument(
+    "--segment-threshold",
+    dest="segment_threshold",
+    metavar="MB",
+    default=32,
+    type=int,
+    help="Size from which files are downloaded over several connections (default: 32).",
+)
+
+parser.add_argument(
+    "--stream",
+    dest="stream",
+    default=False,
+    action="store_true",
+    help="Read saves incrementally instead of loading them whole (uses less memory, but is slower).",
+)
+
+parser.add_argument(
+    "--parse-jobs",
+    dest="parse_jobs",
+    metavar="N",
+    default=None,
+    type=int,
+    help="Number of processes which parse mods ahead of time with --prefetch_all (default: one per CPU).",
+)
+
+parser.add_argument(
+    "--cache-index",
+    dest="cache_index",
+    metavar="FILENAME",
+    default=None,
+    help="Where to keep the index of the TTS cache between runs (default: in the user cache directory).",
+)
+
+parser.add_argument(
+    "--no-cache-index",
+    dest="no_cache_index",
+    default=False,
+    action="store_true",
+    help="Do not keep an index of the TTS cache between runs.",
+)
+
+parser.add_argument(
+    "--asset-graph",
+    dest="asset_graph",
+    metavar="FILENAME",
+    default=None,
+    help="Write which mods use which assets to FILENAME (as JSON).",
+)
+
 parser.add_argument(
     "--verbose",
     "-v",
@@ -0,0 +1,301 @@
+"""Restore backups into the gamedata directory.
+
+Members of the backups are written in a thread pool. Members whose file
+in the gamedata directory is identical already, judging by its size and
+CRC-32, are skipped, so restoring a backup again only writes what
+changed. Files are written to a temporary file first, and renamed into
+place once complete.
+"""
+
+from tts_tools.libstore import AssetStore
+from tts_tools.libstore import HASH_NAME
+from tts_tools.libstore import MANIFEST_NAME
+from tts_tools.libstore import read_manifest
+from tts_tools.libtts import get_gamedata_default
+from tts_tools.util import default_file_mode
+from tts_tools.util import print_err
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from contextlib import nullcontext
+from contextlib import suppress
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Members which describe a backup, rather than being part of it.
+METADATA_MEMBERS = ["missing.txt", MANIFEST_NAME]
+
+
+def read_metadata(infile):
+    """Return the MANIFEST stored as the comment of a backup (an open
+    zipfile.ZipFile), and the files it lists as missing."""
+
+    try:
+        manifest = json.loads(infile.comment.decode("utf-8"))
+    except ValueError:
+        manifest = {}
+    if not isinstance(manifest, dict):
+        manifest = {}
+
+    try:
+        missing = infile.read("missing.txt").decode("utf-8").splitlines()
+    except KeyError:
+        missing = []
+
+    return manifest, [name for name in missing if name]
+
+
+def target_path(gamedata_dir, name):
+    """Return where the member `name` is restored to, refusing names which
+    point outside of the gamedata directory."""
+
+    parts = name.replace("\\", "/").split("/")
+    if name.startswith("/") or ".." in parts or ":" in parts[0]:
+        raise ValueError("Refusing to restore {}".format(name))
+    return os.path.join(gamedata_dir, *[part for part in parts if part])
+
+
+def file_crc(filename):
+    crc = 0
+    with open(filename, "rb") as infile:
+        while True:
+            data = infile.read(CHUNK_SIZE)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+
+
+def file_digest(filename):
+    hasher = hashlib.new(HASH_NAME)
+    with open(filename, "rb") as infile:
+        while True:
+            data = infile.read(CHUNK_SIZE)
+            if not data:
+                return hasher.hexdigest()
+            hasher.update(data)
+
+
+def is_identical(filename, size, crc=None, digest=None):
+    """Check whether `filename` has the given size, and CRC-32 or hash."""
+
+    try:
+        if os.path.getsize(filename) != size:
+            return False
+        if digest is not None:
+            return file_digest(filename) == digest
+        return file_crc(filename) == crc
+    except OSError:
+        return False
+
+
+def write_atomic(target, src, mtime):
+    """Copy the file object `src` to `target`, through a temporary file
+    which replaces `target` once complete.
+
+    The file keeps the mode of the `target` it replaces, or gets the one
+    of newly created files.
+
+    """
+
+    target_dir = os.path.dirname(target)
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=target_dir, prefix=".tmp-", delete=False
+    ) as outfile:
+        try:
+            shutil.copyfileobj(src, outfile, CHUNK_SIZE)
+        except BaseException:
+            outfile.close()
+            os.remove(outfile.name)
+            raise
+
+    try:
+        try:
+            mode = stat.S_IMODE(os.stat(target).st_mode)
+        except FileNotFoundError:
+            mode = default_file_mode()
+        os.chmod(outfile.name, mode)
+        os.utime(outfile.name, (mtime, mtime))
+        os.replace(outfile.name, target)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(outfile.name)
+        raise
+
+
+class Restore:
+    """Restores the members of several backups into `gamedata_dir`, with
+    `jobs` threads.
+
+    Each backup is opened once per thread, since a zipfile.ZipFile reads
+    its members through a single file object.
+
+    """
+
+    def __init__(self, gamedata_dir, jobs=None, dry_run=False):
+        self.gamedata_dir = gamedata_dir
+        self.jobs = jobs or os.cpu_count() or 1
+        self.dry_run = dry_run
+        self.local = threading.local()
+        # Target → backup it is restored from
+        self.claimed = {}
+        self.counts = dict(written=0, skipped=0)
+        self.lock = threading.Lock()
+        self.archives = []
+        # Read the umask before any threads write files.
+        default_file_mode()
+
+    def open_backup(self, infile_name):
+        archives = getattr(self.local, "archives", None)
+        if archives is None:
+            archives = self.local.archives = {}
+        if infile_name not in archives:
+            archives[infile_name] = zipfile.ZipFile(infile_name)
+            with self.lock:
+                self.archives.append(archives[infile_name])
+        return archives[infile_name]
+
+    def plan(self, infile_name):
+        """Return the tasks restoring the backup `infile_name`, its
+        MANIFEST and the files it lists as missing."""
+
+        with zipfile.ZipFile(infile_name) as infile:
+            manifest, missing = read_metadata(infile)
+            store_manifest = read_manifest(infile)
+            infos = infile.infolist()
+
+        tasks = []
+        for info in infos:
+            if info.is_dir() or info.filename in METADATA_MEMBERS:
+                continue
+            target = target_path(self.gamedata_dir, info.filename)
+            tasks.append((self.restore_member, infile_name, info, target))
+
+        if store_manifest is not None:
+            store = AssetStore(store_manifest["store"])
+            for entry in store_manifest["files"]:
+                target = target_path(self.gamedata_dir, entry["name"])
+                tasks.append((self.restore_object, store, entry, target))
+
+        # Several mods often contain the same asset; restore it once.
+        unclaimed = []
+        for task in tasks:
+            target = os.path.normcase(task[-1])
+            if target not in self.claimed:
+                self.claimed[target] = infile_name
+                unclaimed.append(task)
+
+        return unclaimed, manifest, missing
+
+    def count(self, written):
+        with self.lock:
+            self.counts["written" if written else "skipped"] += 1
+        return written
+
+    def restore_member(self, infile_name, info, target):
+        if is_identical(target, info.file_size, crc=info.CRC):
+            return self.count(False)
+        if not self.dry_run:
+            infile = self.open_backup(infile_name)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            with infile.open(info) as src:
+                write_atomic(target, src, mtime)
+        return self.count(True)
+
+    def restore_object(self, store, entry, target):
+        if is_identical(target, entry["size"], digest=entry["hash"]):
+            return self.count(False)
+        object_path = store.path(entry["hash"])
+        if not os.path.isfile(object_path):
+            raise FileNotFoundError(
+                "{} ({}) is not in the store at {}".format(
+                    entry["name"], entry["hash"], store.root
+                )
+            )
+        if not self.dry_run:
+            with open(object_path, "rb") as src:
+                write_atomic(target, src, entry["mtime"])
+        return self.count(True)
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+        self.archives = []
+
+
+def restore_files(args):
+
+    from concurrent.futures import as_completed
+    from concurrent.futures import ThreadPoolExecutor
+
+    if args.gamedata_dir is None:
+        args.gamedata_dir = get_gamedata_default()
+
+    if not os.path.isdir(args.gamedata_dir):
+        print_err(f"Cannot find gamedata directory {args.gamedata_dir}")
+        sys.exit(1)
+
+    restore = Restore(args.gamedata_dir, jobs=args.jobs, dry_run=args.dry_run)
+
+    tasks = []
+    for infile_name in args.infile_names:
+        try:
+            backup_tasks, manifest, missing = restore.plan(infile_name)
+        except (OSError, ValueError, zipfile.BadZipFile) as error:
+            print_err(f"Could not read {infile_name}: {error}")
+            sys.exit(1)
+
+        tasks += backup_tasks
+
+        if args.verbose:
+            date = manifest.get("export_date")
+            if date is not None:
+                date = time.strftime("%Y-%m-%d %H:%M", time.localtime(date))
+            print(f"{infile_name}: backed up {date or 'at an unknown date'} by revision {manifest.get('script_revision', '???')}")
+            if manifest.get("comment"):
+                print(f"  {manifest['comment']}")
+        if missing:
+            print(f"{infile_name}: {len(missing)} files were missing from the backup.")
+            if args.verbose:
+                for name in missing:
+                    print(f"  {name}")
+
+    if not args.verbose:
+        from alive_progress import alive_bar
+
+    with ThreadPoolExecutor(restore.jobs) as executor:
+        futures = {
+            executor.submit(*task): task[-1] for task in tasks
+        }
+        with alive_bar(len(futures), title="Restoring", unit=' files') if not args.verbose else nullcontext() as bar:
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    written = future.result()
+                except (OSError, ValueError, zipfile.BadZipFile) as error:
+                    for other in futures:
+                        other.cancel()
+                    print_err(f"Could not restore {target}: {error}", "Aborting.", sep="\n")
+                    sys.exit(1)
+
+                if args.verbose:
+                    print(f"{target} ({'written' if written else 'identical'})")
+                else:
+                    bar()
+
+    restore.close()
+
+    if args.dry_run:
+        print(f"Dry run: would write {restore.counts['written']} files, {restore.counts['skipped']} are identical already.")
+    else:
+        print(f"Wrote {restore.counts['written']} files, skipped {restore.counts['skipped']} identical ones.")
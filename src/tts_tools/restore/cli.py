@@ -0,0 +1,89 @@
+from tts_tools.restore import restore_files
+from tts_tools.util import VersionAction
+
+import argparse
+import signal
+import sys
+
+description = '''
+TTS-Restore
+===========
+TTS-Restore extracts backups made by ``tts-backup`` into the TTS game data
+directory, so their mods and assets are available to TTS again.
+
+Files which are present already with the same content (judging by their
+size and CRC-32) are not written again. Files are written to a temporary
+file first, so an interrupted restore does not leave partial files behind.
+Backups made with ``--store`` take their assets from the store.
+
+Examples
+--------
+
+> tts-restore "Clank- Legacy- Acquisitions Incorporated [2100953124].zip"
+This will restore the mod and its assets into the game data directory.
+
+Usage flags and arguments are as follows:
+'''
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=description
+)
+
+parser.add_argument(
+    "--version",
+    action=VersionAction,
+)
+
+parser.add_argument(
+    "infile_names",
+    metavar="FILENAME",
+    nargs="+",
+    help="The backups to restore.",
+)
+
+parser.add_argument(
+    "--gamedata",
+    dest="gamedata_dir",
+    metavar="PATH",
+    default=None,
+    help="The path to the TTS game data directory.",
+)
+
+parser.add_argument(
+    "--dry-run",
+    "-n",
+    dest="dry_run",
+    default=False,
+    action="store_true",
+    help="Only print how many files would be restored.",
+)
+
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    metavar="N",
+    default=None,
+    type=int,
+    help="Number of threads which restore files (default: one per CPU).",
+)
+
+parser.add_argument(
+    "--verbose",
+    "-v",
+    dest="verbose",
+    default=False,
+    action="store_true",
+    help="Verbose print output, disables progress bar.",
+)
+
+def sigint_handler(signum, frame):
+    sys.exit(1)
+
+def console_entry():
+
+    signal.signal(signal.SIGINT, sigint_handler)
+    signal.signal(signal.SIGTERM, sigint_handler)
+    args = parser.parse_args()
+    restore_files(args)
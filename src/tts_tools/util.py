@@ -1,12 +1,59 @@
+import argparse
+import collections
+import copy
 import io
 import json
 import os
+import struct
 import time
 import zipfile
-import pickle
-from importlib.metadata import version
+import zlib
+import shutil
+from contextlib import suppress
+from functools import lru_cache
 
-REVISION = version("tts-backup")
+
+@lru_cache(maxsize=None)
+def get_revision():
+    """Return the installed version of tts-backup.
+
+    Looking it up is comparatively slow, so it is only done when needed.
+
+    """
+
+    from importlib.metadata import version
+
+    return version("tts-backup")
+
+
+def __getattr__(name):
+    # REVISION used to be looked up on import.
+    if name == "REVISION":
+        return get_revision()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class VersionAction(argparse.Action):
+    """An argparse action printing the version of tts-backup, like the
+    "version" action, but only looking it up when asked for."""
+
+    def __init__(
+        self,
+        option_strings,
+        dest=argparse.SUPPRESS,
+        default=argparse.SUPPRESS,
+        help="show program's version number and exit",
+    ):
+        super().__init__(
+            option_strings=option_strings,
+            dest=dest,
+            default=default,
+            nargs=0,
+            help=help,
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message=get_revision() + "\n")
 
 
 class ShadowProxy:
@@ -28,6 +75,194 @@ class ShadowProxy:
         return getattr(self.__target, name)
 
 
+# Files are read and compressed in chunks of this size.
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# Files larger than this are compressed by the writer itself, so that the
+# compressed data held in memory stays bounded.
+COMPRESS_MAX_SIZE = 64 * 1024 * 1024
+
+
+def compress_file(
+    filename,
+    arcname=None,
+    compresslevel=None,
+    strict_timestamps=True,
+    compress_type=zipfile.ZIP_DEFLATED,
+):
+    """Read and compress `filename` (deflate it, unless `compress_type` is
+    ZIP_STORED), and return the ZipInfo and the chunks of compressed data
+    for ZipFile.write_compressed.
+
+    zlib releases the GIL, so this can run in a thread pool.
+
+    """
+
+    zinfo = zipfile.ZipInfo.from_file(
+        filename, arcname, strict_timestamps=strict_timestamps
+    )
+    zinfo.compress_type = compress_type
+
+    if compress_type == zipfile.ZIP_STORED:
+        compressor = None
+    else:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+
+    chunks = []
+    crc = 0
+    file_size = 0
+    with open(filename, "rb") as infile:
+        while True:
+            data = infile.read(COMPRESS_CHUNK_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            if compressor is None:
+                chunks.append(data)
+            else:
+                chunks.append(compressor.compress(data))
+    if compressor is not None:
+        chunks.append(compressor.flush())
+
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = sum(len(chunk) for chunk in chunks)
+    return zinfo, chunks
+
+
+# Formats which are compressed already, and gain nothing from deflating.
+STORED_EXTS = {
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".m4v",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".ogg",
+    ".ogv",
+    ".pdf",
+    ".png",
+    ".unity3d",
+    ".webm",
+}
+
+# Formats which deflate well.
+DEFLATED_EXTS = {
+    ".bmp",
+    ".json",
+    ".lua",
+    ".obj",
+    ".txt",
+    ".wav",
+    ".xml",
+}
+
+# How much of a file of another format is deflated to see whether it
+# compresses, and which ratio makes it worth it.
+PROBE_SIZE = 64 * 1024
+PROBE_RATIO = 0.9
+
+
+class CompressionPolicy:
+    """Choose whether to store or deflate each file, by its extension.
+
+    Files of other formats are deflated if a quick probe of their first
+    block shows they compress, unless `probe` is false, in which case
+    they are stored.
+
+    """
+
+    def __init__(self, compresslevel=None, probe=True):
+        self.compresslevel = compresslevel
+        self.probe = probe
+
+    def __call__(self, filename):
+        """Return the compression type and level for `filename`."""
+
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in STORED_EXTS:
+            deflate = False
+        elif ext in DEFLATED_EXTS:
+            deflate = True
+        elif self.probe:
+            deflate = self.compresses(filename)
+        else:
+            deflate = False
+
+        if deflate:
+            return zipfile.ZIP_DEFLATED, self.compresslevel
+        return zipfile.ZIP_STORED, None
+
+    def compresses(self, filename):
+        """Return whether the first block of `filename` deflates well."""
+
+        try:
+            with open(filename, "rb") as infile:
+                data = infile.read(PROBE_SIZE)
+        except OSError:
+            return False
+        if not data:
+            return False
+        return len(zlib.compress(data, 1)) < PROBE_RATIO * len(data)
+
+
+class CompressionStats:
+    """How many bytes compression saved, per kind of asset (i.e. cache
+    directory)."""
+
+    def __init__(self):
+        # Kind → [number of files, file size, compressed size]
+        self.kinds = {}
+
+    def add(self, zinfo):
+        parts = zinfo.filename.split("/")
+        kind = parts[-2] if len(parts) > 1 else "Other"
+        stats = self.kinds.setdefault(kind, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += zinfo.file_size
+        stats[2] += zinfo.compress_size
+
+    def update(self, kinds):
+        """Add the counts of another CompressionStats' `kinds`."""
+
+        for kind, counts in kinds.items():
+            stats = self.kinds.setdefault(kind, [0, 0, 0])
+            for i, count in enumerate(counts):
+                stats[i] += count
+
+    def summary(self):
+        """Return a line per kind of asset, describing the savings."""
+
+        lines = []
+        for kind, (count, file_size, compress_size) in sorted(self.kinds.items()):
+            saved = file_size - compress_size
+            if file_size:
+                percent = 100 * saved / file_size
+            else:
+                percent = 0
+            lines.append(
+                f"{kind}: {count} files, {format_size(file_size)} -> "
+                f"{format_size(compress_size)} "
+                f"(saved {format_size(saved)}, {percent:.1f}%)"
+            )
+        return lines
+
+
+def format_size(size):
+
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1000 or unit == "GB":
+            break
+        size /= 1000
+    if unit == "B":
+        return f"{size} {unit}"
+    return f"{size:.1f} {unit}"
+
+
 class ZipFile(zipfile.ZipFile):
     """A ZipFile that supports dry-runs.
 
@@ -35,14 +270,33 @@ class ZipFile(zipfile.ZipFile):
     once. ZipFile.filelist would have been useful for this, but on
     Windows, this doesn’t seem to reflect writes before syncing the
     file to disk.
+
+    If a libcache.CacheIndex is given, it is used to check whether files
+    exist.
+
+    If a CompressionPolicy is given, it decides how each file is
+    compressed, instead of `deflate`. If CompressionStats are given, the
+    files written are added to them.
+
+    With `deflate` (or a policy) and more than one of `jobs`, files are
+    read and compressed in a thread pool, and written to the archive in
+    the order they were passed to write(). Errors reading them surface in
+    a later call to write(), or in flush().
     """
 
-    def __init__(self, *args, dry_run=False, ignore_missing=False, deflate=False, ps=None, **kwargs):
+    def __init__(self, *args, dry_run=False, ignore_missing=False, deflate=False, ps=None, cache=None, jobs=1, policy=None, stats=None, **kwargs):
 
         self.dry_run = dry_run
+        self.cache = cache
         self.stored_files = set()
         self.ignore_missing = ignore_missing
         self.missing_files = ''
+        self.num_missing = 0
+        self.policy = policy
+        self.stats = stats
+        self.executor = None
+        # (filename, absname, future), in the order of writing
+        self.pending = collections.deque()
 
         if ps is None:
             self.ps = PrintStatus()
@@ -56,8 +310,20 @@ class ZipFile(zipfile.ZipFile):
                 compression = zipfile.ZIP_STORED
             super().__init__(*args, compression=compression, **kwargs)
 
+            compresses = deflate or policy is not None
+            if compresses and jobs is not None and jobs > 1:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.executor = ThreadPoolExecutor(jobs)
+                # How many files may be compressed ahead of writing.
+                self.window = 2 * jobs
+
     def __exit__(self, *args, **kwargs):
 
+        if args[0] is None:
+            self.flush()
+        self.shutdown()
+
         if self.missing_files != '':
             if self.dry_run:
                 print("Missing files:")
@@ -68,7 +334,15 @@ class ZipFile(zipfile.ZipFile):
         if not self.dry_run:
             super().__exit__(*args, **kwargs)
 
-    def write(self, filename, *args, **kwargs):
+    def log_skipped(self, filename, absname):
+        self.ps.print("{} (not found)".format(absname))
+        self.missing_files += f"{filename}\n"
+        self.num_missing += 1
+
+    def log_written(self, absname):
+        self.ps.print(absname)
+
+    def write(self, filename, arcname=None, *args, **kwargs):
 
         if filename in self.stored_files:
             return None
@@ -79,48 +353,808 @@ class ZipFile(zipfile.ZipFile):
         curdir = os.getcwd()
         absname = os.path.join(curdir, filename)
 
-        def log_skipped():
-            self.ps.print("{} (not found)".format(absname))
-            self.missing_files += f"{filename}\n"
-
-        def log_written():
-            self.ps.print(absname)
+        if self.cache is not None:
+            entry = self.cache.lookup(filename)
+            is_file = entry is not None
+        else:
+            entry = None
+            is_file = os.path.isfile(filename)
 
-        if not (os.path.isfile(filename) or self.ignore_missing):
+        if not (is_file or self.ignore_missing):
             raise FileNotFoundError("No such file: {}".format(filename))
 
-        if self.dry_run and os.path.isfile(filename):
-            log_written()
+        if self.dry_run and is_file:
+            self.log_written(absname)
 
         elif self.dry_run:
-            log_skipped()
+            self.log_skipped(filename, absname)
 
-        else:
-            try:
-                super().write(filename, *args, **kwargs)
-            except FileNotFoundError:
-                assert self.ignore_missing
-                log_skipped()
+        elif self.executor is not None and is_file and not (args or kwargs):
+            if entry is not None:
+                size = entry.size
             else:
-                log_written()
-                filename = None
+                size = os.path.getsize(filename)
+
+            if size > COMPRESS_MAX_SIZE:
+                self.flush()
+                compress_type, compresslevel = self.compression_for(filename)
+                return self.write_file(
+                    filename,
+                    arcname,
+                    absname,
+                    compress_type=compress_type,
+                    compresslevel=compresslevel,
+                )
+
+            compress_type, compresslevel = self.compression_for(filename)
+            future = self.executor.submit(
+                compress_file,
+                filename,
+                arcname,
+                compresslevel,
+                self._strict_timestamps,
+                compress_type,
+            )
+            self.pending.append((filename, absname, future))
+            self.drain(self.window)
+            filename = None
+
+        elif self.policy is not None and is_file and not (args or kwargs):
+            compress_type, compresslevel = self.compression_for(filename)
+            return self.write_file(
+                filename,
+                arcname,
+                absname,
+                compress_type=compress_type,
+                compresslevel=compresslevel,
+            )
+
+        else:
+            return self.write_file(filename, arcname, absname, *args, **kwargs)
 
         # If filename is not none then there was a problem writing it, so notify
         # the caller than this file was not stored...
         return filename
 
+    def compression_for(self, filename):
+        """Return the compression type and level to write `filename`
+        with."""
+
+        if self.policy is not None:
+            return self.policy(filename)
+        return self.compression, self.compresslevel
+
+    def write_file(self, filename, arcname, absname, *args, **kwargs):
+
+        try:
+            super().write(filename, arcname, *args, **kwargs)
+        except FileNotFoundError:
+            assert self.ignore_missing
+            self.log_skipped(filename, absname)
+            return filename
+        else:
+            if self.stats is not None:
+                self.stats.add(self.filelist[-1])
+            self.log_written(absname)
+            return None
+
+    def write_compressed(self, zinfo, chunks):
+        """Append a member whose data was already compressed (as done by
+        compress_file)."""
+
+        with self._lock:
+            if self._writing:
+                raise ValueError(
+                    "Can't write to the ZIP file while there is another "
+                    "write handle open on it."
+                )
+
+            # The sizes and CRC are known up front, so the local header is
+            # complete, and no data descriptor is needed.
+            zinfo.flag_bits = 0x00
+            if not zinfo.external_attr:
+                zinfo.external_attr = 0o600 << 16
+
+            zip64 = (
+                zinfo.file_size > zipfile.ZIP64_LIMIT
+                or zinfo.compress_size > zipfile.ZIP64_LIMIT
+            )
+            if zip64 and not self._allowZip64:
+                raise zipfile.LargeZipFile(
+                    "Filesize would require ZIP64 extensions"
+                )
+
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+
+            self._writecheck(zinfo)
+            self._didModify = True
+
+            self.fp.write(zinfo.FileHeader(zip64))
+            for chunk in chunks:
+                self.fp.write(chunk)
+
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+
+        if self.stats is not None:
+            self.stats.add(zinfo)
+
+    def drain(self, limit=0):
+        """Write compressed files to the archive, in order, until at most
+        `limit` are pending, and as long as the next one is ready."""
+
+        while self.pending and (
+            len(self.pending) > limit or self.pending[0][2].done()
+        ):
+            filename, absname, future = self.pending.popleft()
+            try:
+                zinfo, chunks = future.result()
+            except FileNotFoundError:
+                if not self.ignore_missing:
+                    raise
+                self.log_skipped(filename, absname)
+            else:
+                self.write_compressed(zinfo, chunks)
+                self.log_written(absname)
+
+    def flush(self):
+        """Write all pending files to the archive."""
+
+        self.drain()
+
+    def close(self):
+
+        self.flush()
+        self.shutdown()
+        super().close()
+
+    def shutdown(self):
+
+        if self.executor is not None:
+            for _, _, future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            self.executor.shutdown()
+            self.executor = None
+
+    def put_metadata(self, comment=None):
+        """Create a MANIFEST file and store it within the archive."""
+
+        self.comment = make_manifest(comment).encode("utf-8")
+
+
+def make_manifest(comment=None):
+    """Return the metadata stored with a backup, as JSON."""
+
+    manifest = dict(
+        script_revision=get_revision(), export_date=round(time.time())
+    )
+
+    if comment:
+        manifest["comment"] = comment
+
+    return json.dumps(manifest)
+
+
+class BackupArchive:
+    """The parts of the ZipFile interface backup_json uses, for backups in
+    other formats.
+
+    Subclasses store files with add_file() and add_data(), and finish the
+    backup with finish().
+
+    """
+
+    def __init__(self, dry_run=False, ignore_missing=False, ps=None, cache=None):
+
+        self.dry_run = dry_run
+        self.cache = cache
+        self.stored_files = set()
+        self.ignore_missing = ignore_missing
+        self.missing_files = ''
+        self.num_missing = 0
+        self.closed = False
+
+        if ps is None:
+            self.ps = PrintStatus()
+        else:
+            self.ps = ps
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+
+        if self.missing_files != '':
+            if self.dry_run:
+                print("Missing files:")
+                print(self.missing_files)
+            elif args[0] is None:
+                self.add_data("missing.txt", self.missing_files)
+
+        if args[0] is None:
+            self.close()
+        elif not self.closed and not self.dry_run:
+            self.closed = True
+            self.abort()
+
+    def close(self):
+        if not self.closed and not self.dry_run:
+            self.closed = True
+            self.finish()
+
+    log_skipped = ZipFile.log_skipped
+    log_written = ZipFile.log_written
+
+    def write(self, filename, arcname=None):
+
+        if filename in self.stored_files:
+            return None
+
+        self.stored_files.add(filename)
+
+        absname = os.path.join(os.getcwd(), filename)
+
+        if self.cache is not None:
+            is_file = self.cache.exists(filename)
+        else:
+            is_file = os.path.isfile(filename)
+
+        if not (is_file or self.ignore_missing):
+            raise FileNotFoundError("No such file: {}".format(filename))
+
+        if self.dry_run and is_file:
+            self.log_written(absname)
+            return filename
+
+        if not is_file:
+            self.log_skipped(filename, absname)
+            return filename
+
+        if arcname is None:
+            arcname = filename
+        arcname = arcname.replace(os.sep, "/")
+
+        try:
+            self.add_file(filename, arcname)
+        except FileNotFoundError:
+            if not self.ignore_missing:
+                raise
+            self.log_skipped(filename, absname)
+            return filename
+
+        self.log_written(absname)
+        return None
+
     def put_metadata(self, comment=None):
         """Create a MANIFEST file and store it within the archive."""
 
-        manifest = dict(
-            script_revision=REVISION, export_date=round(time.time())
+        if not self.dry_run:
+            self.add_data("MANIFEST", make_manifest(comment))
+
+    def add_file(self, filename, arcname):
+        raise NotImplementedError
+
+    def add_data(self, arcname, data):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def abort(self):
+        self.finish()
+
+
+class TarFile(BackupArchive):
+    """A tar archive for backups.
+
+    The archive is always written as a stream, so `file` may be a pipe,
+    like stdout, as well as a file name. With `deflate`, the whole stream
+    is gzipped. Since tar has no archive comment, the metadata goes into
+    a MANIFEST member.
+
+    """
+
+    def __init__(self, file, mode="w", dry_run=False, ignore_missing=False, deflate=False, ps=None, cache=None, **kwargs):
+
+        super().__init__(dry_run, ignore_missing, ps, cache)
+
+        if not self.dry_run:
+            import tarfile
+
+            if hasattr(file, "write"):
+                name, fileobj = None, file
+            else:
+                name, fileobj = file, None
+
+            self.tar = tarfile.open(
+                name=name,
+                mode="w|gz" if deflate else "w|",
+                fileobj=fileobj,
+                format=tarfile.PAX_FORMAT,
+            )
+
+    def add_file(self, filename, arcname):
+        with open(filename, "rb") as infile:
+            tarinfo = self.tar.gettarinfo(arcname=arcname, fileobj=infile)
+            self.tar.addfile(tarinfo, infile)
+
+    def add_data(self, arcname, data):
+        import tarfile
+
+        data = data.encode("utf-8")
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mtime = time.time()
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+
+    def finish(self):
+        self.tar.close()
+
+
+# ioctl request cloning a file on Linux (Btrfs, XFS and others).
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Make `dst` a copy-on-write clone of `src`, and return whether that
+    worked."""
+
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        try:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            cloned = True
+        except OSError:
+            cloned = False
+    if not cloned:
+        os.remove(dst)
+    return cloned
+
+
+class SnapshotDir(BackupArchive):
+    """A directory snapshot for backups, mirroring the gamedata layout.
+
+    Files are reflinked where the file system supports it, hard-linked
+    otherwise, and only copied if neither works (e.g. across file
+    systems). The snapshot is put together next to `file`, and replaces
+    an existing one once complete.
+
+    """
+
+    def __init__(self, file, mode="w", dry_run=False, ignore_missing=False, ps=None, cache=None, **kwargs):
+
+        super().__init__(dry_run, ignore_missing, ps, cache)
+
+        self.filename = file
+        self.tmp_dir = file + ".partial"
+        # How files were added: "reflink", "hardlink" or "copy" → count
+        self.counts = collections.Counter()
+        self.can_reflink = True
+        self.can_hardlink = True
+
+        if not self.dry_run:
+            if os.path.isdir(self.tmp_dir):
+                shutil.rmtree(self.tmp_dir)
+            os.makedirs(self.tmp_dir)
+
+    def target(self, arcname):
+        path = os.path.join(self.tmp_dir, *arcname.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def add_file(self, filename, arcname):
+
+        target = self.target(arcname)
+
+        if self.can_reflink:
+            if reflink(filename, target):
+                shutil.copystat(filename, target)
+                self.counts["reflink"] += 1
+                return
+            # Don't try again for every file.
+            self.can_reflink = False
+
+        if self.can_hardlink:
+            try:
+                os.link(filename, target)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                self.can_hardlink = False
+            else:
+                self.counts["hardlink"] += 1
+                return
+
+        shutil.copy2(filename, target)
+        self.counts["copy"] += 1
+
+    def add_data(self, arcname, data):
+        with open(self.target(arcname), "w", encoding="utf-8") as outfile:
+            outfile.write(data)
+
+    def finish(self):
+        if os.path.isdir(self.filename):
+            shutil.rmtree(self.filename)
+        os.replace(self.tmp_dir, self.filename)
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+# An updated archive is compacted once replaced and removed members take
+# up more than this share of it.
+COMPACT_RATIO = 0.25
+
+
+def dos_date_time(date_time):
+    """Return `date_time` as stored in a Zip file, i.e. to two seconds."""
+
+    return tuple(date_time[:5]) + (date_time[5] // 2 * 2,)
+
+
+def member_span(zinfo):
+    """Return (roughly) how many bytes a member takes up in its archive."""
+
+    return (
+        zipfile.sizeFileHeader
+        + len(zinfo.filename.encode("utf-8"))
+        + len(zinfo.extra)
+        + zinfo.compress_size
+    )
+
+
+def read_raw_member(infile, zinfo, chunk_size=COMPRESS_CHUNK_SIZE):
+    """Yield the (still compressed) data of a member of the open
+    zipfile.ZipFile `infile`."""
+
+    infile.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, infile.fp.read(zipfile.sizeFileHeader))
+    infile.fp.seek(
+        header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH],
+        os.SEEK_CUR,
+    )
+
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        data = infile.fp.read(min(chunk_size, remaining))
+        if not data:
+            raise zipfile.BadZipFile("Truncated member {}".format(zinfo.filename))
+        remaining -= len(data)
+        yield data
+
+
+def compact_zip(filename):
+    """Rewrite the Zip file `filename` without the space left by replaced
+    members, copying members without recompressing them."""
+
+    tmp_filename = filename + ".tmp"
+    try:
+        with zipfile.ZipFile(filename) as infile, ZipFile(tmp_filename, "w") as outfile:
+            for zinfo in infile.infolist():
+                new_zinfo = copy.copy(zinfo)
+                # The sizes go into the local header, not a ZIP64 extra.
+                new_zinfo.extra = zipfile._strip_extra(zinfo.extra, (1,))
+                outfile.write_compressed(new_zinfo, read_raw_member(infile, zinfo))
+            outfile.comment = infile.comment
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+
+
+class IncrementalZipFile(ZipFile):
+    """A ZipFile which updates an existing archive in place.
+
+    It is to be opened in append mode. Files which are already in the
+    archive with the same size, modification time and compression are
+    kept as they are; others are appended, replacing their old members,
+    and members which are not written again are dropped. If nothing
+    changed, the archive is not touched at all. Once dropped members take
+    up too much space, the archive is compacted.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.changed = False
+        self.kept = set()
+        self.dead_bytes = 0
+        if not self.dry_run:
+            self.existing = {zinfo.filename: zinfo for zinfo in self.filelist}
+            self.old_comment = self.comment
+        else:
+            self.existing = {}
+
+    def remove_member(self, zinfo):
+
+        self.filelist.remove(zinfo)
+        del self.NameToInfo[zinfo.filename]
+        self.dead_bytes += member_span(zinfo)
+        self._didModify = True
+
+    def write(self, filename, arcname=None, *args, **kwargs):
+
+        if self.dry_run or filename in self.stored_files or args or kwargs:
+            return super().write(filename, arcname, *args, **kwargs)
+
+        try:
+            zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+        except OSError:
+            # Let ZipFile deal with missing files.
+            return super().write(filename, arcname)
+
+        old = self.existing.get(zinfo.filename)
+        if (
+            old is not None
+            and self.NameToInfo.get(old.filename) is old
+            and old.file_size == zinfo.file_size
+            and old.date_time == dos_date_time(zinfo.date_time)
+            and old.compress_type == self.compression_for(filename)[0]
+        ):
+            self.stored_files.add(filename)
+            self.kept.add(old.filename)
+            self.log_written(os.path.join(os.getcwd(), filename))
+            return None
+
+        self.changed = True
+        if old is not None and self.NameToInfo.get(old.filename) is old:
+            self.remove_member(old)
+        return super().write(filename, arcname)
+
+    def __exit__(self, *args, **kwargs):
+
+        if self.dry_run or args[0] is not None:
+            return super().__exit__(*args, **kwargs)
+
+        self.flush()
+
+        old_missing = self.existing.pop("missing.txt", None)
+
+        # Members which are no longer part of the backup.
+        for name, zinfo in self.existing.items():
+            if name not in self.kept and self.NameToInfo.get(name) is zinfo:
+                self.remove_member(zinfo)
+                self.changed = True
+
+        if old_missing is not None:
+            if self.read(old_missing).decode("utf-8") == self.missing_files:
+                # Keep the list as it is.
+                self.missing_files = ''
+            else:
+                self.remove_member(old_missing)
+                self.changed = True
+        elif self.missing_files != '':
+            self.changed = True
+
+        if not self.changed:
+            # Leave the archive as it was, including its metadata.
+            self.comment = self.old_comment
+            self._didModify = False
+
+        super().__exit__(*args, **kwargs)
+
+        size = os.path.getsize(self.filename)
+        if self.changed and self.dead_bytes > COMPACT_RATIO * size:
+            compact_zip(self.filename)
+
+
+# A resumable archive is checkpointed whenever this many bytes were
+# written since the last checkpoint.
+CHECKPOINT_SIZE = 256 * 1024 * 1024
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def read_local_members(fp, end):
+    """Return the members of a Zip file whose central directory is yet to
+    be written, reading their local headers from the open file `fp` up to
+    the offset `end`.
+
+    This only works for members with complete local headers, as ZipFile
+    writes them to seekable files.
+
+    """
+
+    members = {}
+    pos = 0
+    while pos < end:
+        fp.seek(pos)
+        header = fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile("No member at offset {}".format(pos))
+        fields = struct.unpack(zipfile.structFileHeader, header)
+
+        flag_bits = fields[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS]
+        if flag_bits & 0x08:
+            raise zipfile.BadZipFile("Member at offset {} has a data descriptor".format(pos))
+
+        name = fp.read(fields[zipfile._FH_FILENAME_LENGTH])
+        extra = fp.read(fields[zipfile._FH_EXTRA_FIELD_LENGTH])
+        name = name.decode("utf-8" if flag_bits & 0x800 else "cp437")
+
+        d = fields[zipfile._FH_LAST_MOD_DATE]
+        t = fields[zipfile._FH_LAST_MOD_TIME]
+        zinfo = zipfile.ZipInfo(
+            name,
+            ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F, t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2),
         )
+        zinfo.flag_bits = flag_bits
+        zinfo.compress_type = fields[zipfile._FH_COMPRESSION_METHOD]
+        zinfo.CRC = fields[zipfile._FH_CRC]
+        zinfo.compress_size = fields[zipfile._FH_COMPRESSED_SIZE]
+        zinfo.file_size = fields[zipfile._FH_UNCOMPRESSED_SIZE]
+        zinfo.header_offset = pos
+        zinfo.external_attr = 0o600 << 16
+
+        if zinfo.compress_size == 0xFFFFFFFF or zinfo.file_size == 0xFFFFFFFF:
+            # The sizes are in the ZIP64 extra field.
+            offset = 0
+            while offset + 4 <= len(extra):
+                tp, ln = struct.unpack("<HH", extra[offset:offset + 4])
+                if tp == 1:
+                    zinfo.file_size, zinfo.compress_size = struct.unpack(
+                        "<QQ", extra[offset + 4:offset + 20]
+                    )
+                    break
+                offset += 4 + ln
+            else:
+                raise zipfile.BadZipFile("Member {} lacks its ZIP64 sizes".format(name))
+        # The central directory gets its own ZIP64 extra, if needed.
+        zinfo.extra = zipfile._strip_extra(extra, (1,))
+
+        # A member written again replaces the one before.
+        members.pop(name, None)
+        members[name] = zinfo
+        pos = fp.tell() + zinfo.compress_size
+
+    if pos != end:
+        raise zipfile.BadZipFile("Last member extends past offset {}".format(end))
+    return list(members.values())
+
+
+class ResumableZipFile(IncrementalZipFile):
+    """A ZipFile which can continue where an interrupted backup stopped.
+
+    While writing, it checkpoints the offset up to which members are
+    complete into `file`.checkpoint, once every CHECKPOINT_SIZE bytes and
+    when it is closed, even by an error. When opened again, members up to
+    that offset are recovered, and, as with an IncrementalZipFile, kept
+    if the files written again are unchanged. Once the archive was closed
+    without an error, the checkpoint is removed.
+
+    `file` is the name of the archive while it is written; it is up to
+    the caller to rename it when done. If it is a stream instead, like
+    stdout, the archive is written like a plain ZipFile, as there is no
+    way to resume it.
+
+    """
+
+    def __init__(self, file, mode="w", *, checkpoint_size=CHECKPOINT_SIZE, **kwargs):
+
+        self.resume_fp = None
+        if isinstance(file, (str, os.PathLike)):
+            self.checkpoint_filename = os.fspath(file) + CHECKPOINT_SUFFIX
+        else:
+            self.checkpoint_filename = None
+        self.checkpoint_size = checkpoint_size
+        recovered = []
+
+        if self.checkpoint_filename is not None and not kwargs.get("dry_run"):
+            recovered = self.recover(file)
+            self.resume_fp = open(file, "r+b" if recovered else "w+b")
+            self.resume_fp.seek(0, os.SEEK_END)
+            file = self.resume_fp
+
+        try:
+            super().__init__(file, "w", **kwargs)
+        except BaseException:
+            if self.resume_fp is not None:
+                self.resume_fp.close()
+            raise
+
+        for zinfo in recovered:
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+        self.existing = {zinfo.filename: zinfo for zinfo in recovered}
+        self.num_recovered = len(recovered)
+        # The archive is new, so it needs its metadata in any case.
+        self.changed = True
+        self.checkpointed = self.start_dir if not self.dry_run else 0
+
+    def recover(self, filename):
+        """Return the members which are complete in the partial archive
+        `filename`, cutting off anything after them."""
+
+        try:
+            with open(self.checkpoint_filename, "r", encoding="utf-8") as infile:
+                offset = json.load(infile)["offset"]
+            with open(filename, "r+b") as fp:
+                members = read_local_members(fp, offset)
+                fp.truncate(offset)
+        except (OSError, ValueError, KeyError, TypeError, struct.error, zipfile.BadZipFile):
+            return []
+        return members
+
+    def checkpoint(self):
+        """Record that the members written so far are complete."""
+
+        if self.checkpoint_filename is None:
+            return
+
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+        tmp_filename = self.checkpoint_filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as outfile:
+            json.dump(dict(offset=self.start_dir), outfile)
+        os.replace(tmp_filename, self.checkpoint_filename)
+        self.checkpointed = self.start_dir
+
+    def maybe_checkpoint(self):
+        if self.start_dir - self.checkpointed >= self.checkpoint_size:
+            self.checkpoint()
+
+    def write_file(self, *args, **kwargs):
+        result = super().write_file(*args, **kwargs)
+        self.maybe_checkpoint()
+        return result
 
-        if comment:
-            manifest["comment"] = comment
+    def write_compressed(self, *args, **kwargs):
+        super().write_compressed(*args, **kwargs)
+        self.maybe_checkpoint()
 
-        manifest = json.dumps(manifest)
-        self.comment = manifest.encode("utf-8")
+    def close(self):
+
+        if self.fp is not None and not self._writing:
+            try:
+                self.flush()
+            finally:
+                self.shutdown()
+                self.checkpoint()
+        try:
+            super().close()
+        finally:
+            if self.resume_fp is not None:
+                self.resume_fp.close()
+
+    def __exit__(self, *args, **kwargs):
+
+        if self.checkpoint_filename is None:
+            # A stream has nothing to update or compact.
+            return ZipFile.__exit__(self, *args, **kwargs)
+
+        result = super().__exit__(*args, **kwargs)
+
+        if args[0] is None and not self.dry_run:
+            with suppress(FileNotFoundError):
+                os.remove(self.checkpoint_filename)
+        return result
+
+
+@lru_cache(maxsize=None)
+def default_file_mode():
+    """Return the mode open() gives new files, under the umask of the
+    process.
+
+    Files written through tempfile are owner-only; they get this mode
+    before they are renamed into place. The umask can only be read by
+    setting it, so call this once before starting any threads.
+
+    """
+
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
 
 
 def print_err(*args, **kwargs):
@@ -147,41 +1181,16 @@ def make_safe_filename(filename):
     return "".join([c if c.isalpha() or c.isdigit() or c in ' ()[]-_{}.' else '-' for c in filename]).rstrip() 
 
 
-def get_mods_in_directory(dir_path, mtime_filename):
-
-    modified_times = {}
-    try:
-        with open(mtime_filename, 'rb') as f:
-            modified_times = pickle.load(f)
-    except FileNotFoundError:
-        pass
-    
-    def get_mtime(name, modified_times):
-        try:
-            return modified_times[name]
-        except:
-            return 0.0
+def get_mods_in_directory(dir_path, journal, cache=None):
+    """Return the mods in `dir_path` which the libjournal.ModJournal
+    `journal` selects, i.e. those which changed since they were last
+    processed."""
 
     infile_names = [os.path.join(dir_path, f) for f in os.listdir(dir_path)
                     if os.path.splitext(f)[1] == '.json' and
-                    os.path.getmtime(os.path.join(dir_path, f)) > get_mtime(f, modified_times) and
                     os.path.basename(f) != 'WorkshopFileInfos.json']
 
-    return infile_names
-
-
-def save_modification_time(infile_name, mtime_filename):
-    modified_times = {}
-    try:
-        with open(mtime_filename, 'rb') as f:
-            modified_times = pickle.load(f)
-    except FileNotFoundError:
-        pass
-
-    modified_times[os.path.basename(infile_name)] = os.path.getmtime(infile_name)
-
-    with open(mtime_filename, 'wb') as f:
-        pickle.dump(modified_times, f)
+    return journal.select(infile_names, cache)
 
 
 class PrintStatus():
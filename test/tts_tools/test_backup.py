@@ -0,0 +1,108 @@
+from tts_tools.backup import backup_files
+from tts_tools.backup.cli import parser
+from tts_tools.libtts import IMGPATH
+from tts_tools.libtts import recodeURL
+
+import io
+import json
+import os
+import pytest
+import subprocess
+import sys
+import zipfile
+
+
+@pytest.fixture
+def gamedata(tmp_path, monkeypatch):
+    gamedata = tmp_path / "gamedata"
+    (gamedata / IMGPATH).mkdir(parents=True)
+    (gamedata / "Mods" / "Workshop").mkdir()
+
+    table = "http://example.com/table.png"
+    (gamedata / IMGPATH / (recodeURL(table) + ".png")).write_bytes(b"table")
+    save = dict(
+        SaveName="Test Mod",
+        ObjectStates=[
+            {"CustomImage": {"ImageURL": table}},
+            {"CustomImage": {"ImageURL": "http://example.com/missing.png"}},
+        ],
+    )
+    (gamedata / "Mods" / "Workshop" / "123.json").write_text(json.dumps(save))
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    # Backups change into the gamedata directory.
+    monkeypatch.chdir(out_dir)
+    return gamedata, out_dir
+
+
+def backup(gamedata, outname, *options):
+    args = parser.parse_args(
+        [
+            "--gamedata",
+            str(gamedata),
+            "--no-cache-index",
+            "--ignore-missing",
+            "--verbose",
+            "-o",
+            str(outname),
+            *options,
+            "123.json",
+        ]
+    )
+    backup_files(args)
+
+
+# Backups in other formats are left alone when a snapshot replaces the
+# previous snapshot of a mod with missing files
+def test_snapshot_keeps_other_formats(gamedata):
+    gamedata, out_dir = gamedata
+
+    backup(gamedata, out_dir)
+    backup(gamedata, out_dir, "--format", "tar", "--deflate")
+    backup(gamedata, out_dir, "--format", "snapshot")
+    backup(gamedata, out_dir, "--format", "snapshot")
+
+    assert sorted(os.listdir(out_dir)) == [
+        "Test Mod [123] (-1)",
+        "Test Mod [123] (-1).tar.gz",
+        "Test Mod [123] (-1).zip",
+        "backup_journal.sqlite",
+    ]
+    assert os.path.isdir(out_dir / "Test Mod [123] (-1)")
+
+
+# With -o -, the backup is written to stdout, a pipe which cannot seek
+def test_backup_to_stdout(gamedata):
+    gamedata, out_dir = gamedata
+
+    script = "from tts_tools.backup.cli import console_entry; console_entry()"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            script,
+            "--gamedata",
+            str(gamedata),
+            "--no-cache-index",
+            "--ignore-missing",
+            "--verbose",
+            "-o",
+            "-",
+            "123.json",
+        ],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+
+    with zipfile.ZipFile(io.BytesIO(result.stdout)) as infile:
+        assert infile.testzip() is None
+        assert sorted(infile.namelist()) == [
+            "Mods/Images/httpexamplecomtablepng.png",
+            "Mods/Workshop/123.json",
+            "missing.txt",
+        ]
+    assert os.listdir(out_dir) == []
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+
+# Modules only needed once a backup or prefetch actually runs
+DEFERRED_MODULES = [
+    "alive_progress",
+    "concurrent.futures.process",
+    "http.client",
+    "importlib.metadata",
+    "sqlite3",
+    "ssl",
+    "tqdm",
+    "urllib.request",
+]
+
+IMPORT_SCRIPT = """
+import json
+import sys
+
+import tts_tools.backup.cli
+import tts_tools.prefetch.cli
+
+print(json.dumps(dict(
+    loaded=[name for name in {modules!r} if name in sys.modules],
+)), file=sys.stderr)
+"""
+
+
+def import_clis(home):
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=os.pathsep.join(sys.path))
+    return subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(modules=DEFERRED_MODULES)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+# Importing the CLIs prints nothing, even without a gamedata directory
+def test_import_is_silent(tmp_path):
+    result = import_clis(tmp_path)
+    assert result.stdout == ""
+    assert list(json.loads(result.stderr)) == ["loaded"]
+
+
+# Importing the CLIs leaves the heavy dependencies unloaded
+def test_import_defers_dependencies(tmp_path):
+    result = import_clis(tmp_path)
+    assert json.loads(result.stderr)["loaded"] == []
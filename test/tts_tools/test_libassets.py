@@ -0,0 +1,47 @@
+from tts_tools.libassets import AssetGraph
+from tts_tools.libtts import AssetKind
+
+
+# AssetGraph maps shared assets to the mods which refer to them
+def test_asset_graph_mods_using():
+    graph = AssetGraph()
+    graph.add("a.json", ["TableURL"], "http://example.com/table.png")
+    graph.add("a.json", ["ObjectStates", "MeshURL"], "http://example.com/x")
+    shared = graph.add("b.json", ["TableURL"], "http://example.com/table.png")
+
+    assert graph.mods_using("http://example.com/table.png") == [
+        "a.json",
+        "b.json",
+    ]
+    assert graph.shared_assets() == [shared]
+    assert [asset.kind for asset in graph.assets_of("a.json")] == [
+        "image",
+        "obj",
+    ]
+
+
+# The same URL used as different kinds of asset makes different assets
+def test_asset_graph_kinds():
+    graph = AssetGraph()
+    image = graph.add("a.json", ["ImageURL"], "http://example.com/x")
+    mesh = graph.add("a.json", ["MeshURL"], "http://example.com/x")
+
+    assert image is not mesh
+    assert graph.lookup("http://example.com/x", AssetKind.OBJ) == [mesh]
+
+
+# AssetGraph survives a round trip through its JSON export
+def test_asset_graph_export_load(tmp_path):
+    graph = AssetGraph()
+    graph.add("a.json", ["TableURL"], "http://example.com/table.png")
+    graph.add("b.json", ["SkyURL"], "http://example.com/table.png")
+
+    filename = str(tmp_path / "graph.json")
+    graph.export(filename)
+    loaded = AssetGraph.load(filename)
+
+    assert loaded.to_json() == graph.to_json()
+    assert loaded.mods_using("http://example.com/table.png") == [
+        "a.json",
+        "b.json",
+    ]
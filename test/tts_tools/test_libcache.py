@@ -0,0 +1,99 @@
+from tts_tools.libcache import CacheIndex
+from tts_tools.libcache import PersistentCacheIndex
+from tts_tools.libtts import get_fs_path
+from tts_tools.libtts import IMGPATH
+from tts_tools.libtts import TXTPATH
+
+import os
+import pytest
+
+
+@pytest.fixture
+def gamedata(tmp_path, monkeypatch):
+    for path, data in [
+        (os.path.join(IMGPATH, "httpexamplecomtable.jpg"), b"table"),
+        (os.path.join(TXTPATH, "httppastebincomabc.TXT"), b"script"),
+    ]:
+        filename = tmp_path / path
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        filename.write_bytes(data)
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
+
+
+# CacheIndex resolves paths like the file-system lookups do
+@pytest.mark.parametrize(
+    "path,url",
+    [
+        (["TableURL"], "http://example.com/table"),
+        (["TableURL"], "http://example.com/other"),
+        (["LuaScript"], "http://pastebin.com/abc"),
+        (["LuaScript"], "http://pastebin.com/missing"),
+        (["MeshURL"], "http://example.com/mesh.obj"),
+    ],
+)
+def test_cache_index_get_fs_path(gamedata, path, url):
+    cache = CacheIndex(gamedata)
+    assert get_fs_path(path, url, cache) == get_fs_path(path, url)
+
+
+# CacheIndex records sizes, and files added after the scan
+def test_cache_index_lookup_add(gamedata):
+    cache = CacheIndex(gamedata)
+    table = os.path.join(IMGPATH, "httpexamplecomtable.jpg")
+    assert cache.lookup(table).size == 5
+
+    new = os.path.join(IMGPATH, "httpexamplecomnew.png")
+    assert not cache.exists(new)
+    with open(new, "wb") as outfile:
+        outfile.write(b"new")
+    cache.add(new)
+    assert cache.lookup(new).size == 3
+    assert cache.find("httpexamplecomnew") == new
+
+
+# PersistentCacheIndex reuses its listing until a directory changes
+def test_persistent_cache_index_refresh(gamedata, tmp_path):
+    index_filename = str(tmp_path / "index.sqlite")
+    table = os.path.join(IMGPATH, "httpexamplecomtable.jpg")
+    new = os.path.join(IMGPATH, "httpexamplecomnew.png")
+
+    cache = PersistentCacheIndex(gamedata, index_filename)
+    assert cache.exists(table)
+    cache.close()
+
+    # Unchanged directories are not listed again.
+    cache = PersistentCacheIndex(gamedata, index_filename)
+    cache.scan_dir = None
+    assert cache.exists(table)
+    assert not cache.exists(new)
+    cache.close()
+
+    with open(new, "wb") as outfile:
+        outfile.write(b"new")
+    os.utime(IMGPATH, ns=(0, 0))
+
+    cache = PersistentCacheIndex(gamedata, index_filename)
+    assert cache.exists(new)
+    cache.close()
+
+
+# Files rewritten in place, which leaves their directory alone, are seen
+# with their new size
+def test_persistent_cache_index_rewrite(gamedata, tmp_path):
+    index_filename = str(tmp_path / "index.sqlite")
+    table = os.path.join(IMGPATH, "httpexamplecomtable.jpg")
+
+    cache = PersistentCacheIndex(gamedata, index_filename)
+    assert cache.lookup(table).size == 5
+    cache.close()
+
+    dir_mtime = os.stat(IMGPATH).st_mtime_ns
+    with open(table, "wb") as outfile:
+        outfile.write(b"a bigger table")
+    os.utime(IMGPATH, ns=(dir_mtime, dir_mtime))
+
+    for _ in range(2):
+        cache = PersistentCacheIndex(gamedata, index_filename)
+        assert cache.lookup(table).size == 14
+        cache.close()
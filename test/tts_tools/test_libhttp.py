@@ -0,0 +1,125 @@
+from tts_tools.libhttp import ConnectionPool
+from tts_tools.libhttp import ValidatorStore
+
+import http.server
+import pytest
+import threading
+import urllib.error
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # How many connections were accepted.
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def do_GET(self):
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", "/images/removed.png")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path.startswith("/drop"):
+            # Close the connection without saying so.
+            self.send_response(200)
+            self.send_header("Content-Length", "3")
+            self.end_headers()
+            self.wfile.write(b"png")
+            self.close_connection = True
+        elif self.path.startswith("/missing"):
+            self.send_error(404)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", "3")
+            self.end_headers()
+            self.wfile.write(b"png")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Handler.connections = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(pool, url):
+    with pool.request(url, {"User-Agent": "test"}, 5) as response:
+        return response.url, response.read()
+
+
+# Connections are set up once per host, rather than once per download
+def test_pool_reuse(server):
+    pool = ConnectionPool()
+    for i in range(10):
+        assert fetch(pool, "{}/image{}.png".format(server, i))[1] == b"png"
+    pool.close()
+
+    assert Handler.connections == 1
+    assert (pool.hits, pool.misses) == (9, 1)
+
+
+# Redirects are followed on the same connection, and the final URL is
+# reported, so removed images can be told apart
+def test_pool_redirect(server):
+    pool = ConnectionPool()
+    url, data = fetch(pool, server + "/redirect")
+    assert url == server + "/images/removed.png"
+    assert Handler.connections == 1
+
+
+# Error responses raise HTTPError, as with urllib
+def test_pool_error(server):
+    pool = ConnectionPool()
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(pool, server + "/missing.png")
+    assert error.value.code == 404
+    assert fetch(pool, server + "/image.png")[1] == b"png"
+
+
+# Connections closed by the server are replaced
+def test_pool_stale(server):
+    pool = ConnectionPool()
+    fetch(pool, server + "/drop")
+    assert fetch(pool, server + "/image.png")[1] == b"png"
+    assert Handler.connections == 2
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+# Requests are only made conditional while the file is unchanged
+def test_validator_store(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"png")
+    store = ValidatorStore(str(tmp_path / "validators.sqlite"))
+    url = "http://example.com/image.png"
+
+    store.record(url, str(path), FakeResponse({"ETag": '"v1"'}))
+    assert store.conditional_headers(url, str(path)) == {"If-None-Match": '"v1"'}
+    assert store.conditional_headers(url, str(tmp_path / "other.png")) == {}
+
+    path.write_bytes(b"truncated")
+    assert store.conditional_headers(url, str(path)) == {}
+
+    # Responses without validators forget earlier ones.
+    store.record(url, str(path), FakeResponse({}))
+    assert store.conditional_headers(url, str(path)) == {}
+    store.close()
@@ -0,0 +1,54 @@
+from tts_tools.libcache import CacheIndex
+from tts_tools.libjournal import ModJournal
+from tts_tools.libjournal import open_journal
+from tts_tools.libtts import IMGPATH
+
+import os
+import pickle
+import pytest
+
+
+@pytest.fixture
+def gamedata(tmp_path, monkeypatch):
+    (tmp_path / IMGPATH).mkdir(parents=True)
+    (tmp_path / IMGPATH / "httpexamplecomtable.jpg").write_bytes(b"table")
+    for name in ["a.json", "b.json"]:
+        (tmp_path / name).write_text("{}")
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
+
+
+# Mods are selected until recorded, and again once their file changes
+def test_journal_mtime(gamedata, tmp_path):
+    journal = ModJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.select(["a.json", "b.json"]) == ["a.json", "b.json"]
+
+    journal.record("a.json")
+    assert journal.select(["a.json", "b.json"]) == ["b.json"]
+
+    os.utime("a.json", (0, os.path.getmtime("a.json") + 10))
+    assert journal.select(["a.json", "b.json"]) == ["a.json", "b.json"]
+
+
+# Mods are selected again once a missing asset is cached
+def test_journal_assets(gamedata, tmp_path):
+    table = os.path.join(IMGPATH, "httpexamplecomtable.jpg")
+    missing = "httpexamplecomcard"
+    journal = ModJournal(str(tmp_path / "journal.sqlite"))
+    journal.record("a.json", [table, missing], CacheIndex(gamedata))
+    journal.close()
+
+    journal = ModJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.select(["a.json"], CacheIndex(gamedata)) == []
+
+    (tmp_path / IMGPATH / "httpexamplecomcard.png").write_bytes(b"card")
+    assert journal.select(["a.json"], CacheIndex(gamedata)) == ["a.json"]
+
+
+# Pickled mtimes are imported into a new journal
+def test_journal_legacy(gamedata, tmp_path):
+    with open("backup_mtimes.pkl", "wb") as outfile:
+        pickle.dump({"a.json": os.path.getmtime("a.json")}, outfile)
+
+    journal = open_journal(gamedata, "backup")
+    assert journal.select(["a.json", "b.json"]) == ["b.json"]
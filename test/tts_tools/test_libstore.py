@@ -0,0 +1,119 @@
+from tts_tools.libstore import AssetStore
+from tts_tools.libstore import export_backup
+from tts_tools.libstore import MANIFEST_NAME
+from tts_tools.libstore import StoreZipFile
+from tts_tools.util import default_file_mode
+from tts_tools.util import PrintStatus
+
+import json
+import os
+import pytest
+import stat
+import zipfile
+
+
+@pytest.fixture
+def gamedata(tmp_path, monkeypatch):
+    images = tmp_path / "gamedata" / "Mods" / "Images"
+    images.mkdir(parents=True)
+    (images / "table.jpg").write_bytes(b"table")
+    (images / "sky.jpg").write_bytes(b"sky")
+    (images / "copy.jpg").write_bytes(b"table")
+    (tmp_path / "gamedata" / "mod.json").write_text("{}")
+    monkeypatch.chdir(tmp_path / "gamedata")
+    return tmp_path
+
+
+def backup(filename, store, names):
+    ps = PrintStatus(verbose=False)
+    with StoreZipFile(
+        filename, "w", store=store, ignore_missing=True, ps=ps
+    ) as outfile:
+        for name in names:
+            outfile.write(name)
+        outfile.write("mod.json", os.path.join("Mods", "Workshop", "mod.json"))
+    return outfile
+
+
+# Assets with the same content are stored once
+def test_store_put(gamedata):
+    store = AssetStore(gamedata / "store")
+    digest, size = store.put(os.path.join("Mods", "Images", "table.jpg"))
+    assert size == 5
+    assert store.put(os.path.join("Mods", "Images", "copy.jpg")) == (digest, 5)
+    assert store.put(os.path.join("Mods", "Images", "table.jpg")) == (digest, 5)
+    with open(store.path(digest), "rb") as infile:
+        assert infile.read() == b"table"
+    assert len(os.listdir(store.objects_dir)) == 1
+    store.close()
+
+
+# Store backups refer to assets, and embed the save itself
+def test_store_backup(gamedata):
+    store = AssetStore(gamedata / "store")
+    names = [
+        os.path.join("Mods", "Images", "table.jpg"),
+        os.path.join("Mods", "Images", "missing.jpg"),
+        os.path.join("Mods", "Images", "sky.jpg"),
+    ]
+    outfile = backup(gamedata / "mod.zip", store, names)
+    store.close()
+
+    assert outfile.num_missing == 1
+    with zipfile.ZipFile(gamedata / "mod.zip") as infile:
+        assert infile.namelist() == [
+            "Mods/Workshop/mod.json",
+            MANIFEST_NAME,
+            "missing.txt",
+        ]
+        manifest = json.loads(infile.read(MANIFEST_NAME))
+    assert [entry["name"] for entry in manifest["files"]] == [
+        "Mods/Images/table.jpg",
+        "Mods/Images/sky.jpg",
+    ]
+
+
+# Exporting a store backup yields a self-contained backup
+def test_export_backup(gamedata):
+    store = AssetStore(gamedata / "store")
+    names = [
+        os.path.join("Mods", "Images", "table.jpg"),
+        os.path.join("Mods", "Images", "sky.jpg"),
+    ]
+    backup(gamedata / "mod.zip", store, names)
+    store.close()
+
+    export_backup(gamedata / "mod.zip", gamedata / "export.zip")
+    with zipfile.ZipFile(gamedata / "export.zip") as infile:
+        assert infile.namelist() == [
+            "Mods/Images/table.jpg",
+            "Mods/Images/sky.jpg",
+            "Mods/Workshop/mod.json",
+        ]
+        assert infile.read("Mods/Images/sky.jpg") == b"sky"
+        assert infile.read("Mods/Workshop/mod.json") == b"{}"
+
+
+# Stored objects, and the members exported from them, get the mode of
+# new files, like assets in regular backups, rather than owner-only
+def test_store_mode(gamedata):
+    umask = os.umask(0o022)
+    default_file_mode.cache_clear()
+    try:
+        store = AssetStore(gamedata / "store")
+        table = os.path.join("Mods", "Images", "table.jpg")
+        backup(gamedata / "mod.zip", store, [table])
+        digest, _ = store.put(table)
+        store.close()
+        assert stat.S_IMODE(os.stat(store.path(digest)).st_mode) == 0o644
+
+        # Objects from older stores were owner-only.
+        os.chmod(store.path(digest), 0o600)
+        export_backup(gamedata / "mod.zip", gamedata / "export.zip")
+    finally:
+        os.umask(umask)
+        default_file_mode.cache_clear()
+
+    with zipfile.ZipFile(gamedata / "export.zip") as infile:
+        info = infile.getinfo("Mods/Images/table.jpg")
+    assert info.external_attr >> 16 == stat.S_IFREG | 0o644
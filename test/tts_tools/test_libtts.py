@@ -1,40 +1,112 @@
+from tts_tools.libtts import AssetKind
+from tts_tools.libtts import classify
+from tts_tools.libtts import get_fs_path
+from tts_tools.libtts import get_save_name
+from tts_tools.libtts import IllegalSavegameException
+from tts_tools.libtts import is_image
+from tts_tools.libtts import plan_saves
+from tts_tools.libtts import SaveDocument
+from tts_tools.libtts import scan_lua_script
+from tts_tools.libtts import seekURL
+from tts_tools.libtts import urls_from_save
+
+import json
+import os
 import pytest
 
 
+@pytest.fixture
+def save():
+    return {
+        "SaveName": "Fixture",
+        "TableURL": "http://example.com/table.png",
+        "TabletState": {"PageURL": "http://example.com/page"},
+        "AudioLibrary": [
+            {"Item1": "http://example.com/song.mp3", "Item2": "Song"},
+        ],
+        "ObjectStates": [
+            {
+                "Name": "Tablet",
+                "PageURL": "http://example.com/tablet",
+                "CustomMesh": {
+                    "MeshURL": "http://example.com/mesh.obj",
+                    "NormalURL": "",
+                },
+                "CustomDeck": {
+                    "1": {"FaceURL": "http://example.com/face.jpg{Unique}"},
+                },
+                "ContainedObjects": [
+                    "not an object",
+                    [{"MeshURL": "http://example.com/skipped.obj"}],
+                    {"CustomImage": {"ImageURL": "http://example.com/table.png"}},
+                ],
+            },
+        ],
+    }
+
+
 # seekURL ignores page URLs from a fixture.
-@pytest.mark.skip
-def test_seekURL_ignore_page_url():
-    pass
+def test_seekURL_ignore_page_url(save):
+    urls = [url for _, url in seekURL(save)]
+    assert "http://example.com/page" not in urls
 
 
 # seekURL ignores tablet URLs from a fixture.
-@pytest.mark.skip
-def test_seekURL_ignore_tablet_url():
-    pass
+def test_seekURL_ignore_tablet_url(save):
+    urls = [url for _, url in seekURL(save)]
+    assert "http://example.com/tablet" not in urls
 
 
 # seekURL returns audio library items from a fixture.
-@pytest.mark.skip
-def test_seekURL_extract_audio_library_item():
-    pass
+def test_seekURL_extract_audio_library_item(save):
+    assert (["AudioLibrary"], "http://example.com/song.mp3") in seekURL(save)
 
 
 # seekURL ignores URL keys with no value from the fixture.
-@pytest.mark.skip
-def test_seekURL_ignore_empty_URL():
-    pass
+def test_seekURL_ignore_empty_URL(save):
+    assert all(url for _, url in seekURL(save))
 
 
 # seekURL strips in-band metadata (curly braces) from URLs.
-@pytest.mark.skip
-def test_seekURL_strip_url_inband_metadata():
-    pass
+def test_seekURL_strip_url_inband_metadata(save):
+    path = ["ObjectStates", "CustomDeck", "1", "FaceURL"]
+    assert (path, "http://example.com/face.jpg") in seekURL(save)
 
 
 # seekURL returns expected URLs for the fixture.
-@pytest.mark.skip
-def test_seekURL_return_common_url():
-    pass
+def test_seekURL_return_common_url(save):
+    assert list(seekURL(save)) == [
+        (["TableURL"], "http://example.com/table.png"),
+        (["AudioLibrary"], "http://example.com/song.mp3"),
+        (["ObjectStates", "CustomMesh", "MeshURL"], "http://example.com/mesh.obj"),
+        (
+            ["ObjectStates", "CustomDeck", "1", "FaceURL"],
+            "http://example.com/face.jpg",
+        ),
+    ]
+
+
+# seekURL prefixes the trail it is given.
+def test_seekURL_trail(save):
+    paths = [path for path, _ in seekURL(save, ["Root"])]
+    assert paths[0] == ["Root", "TableURL"]
+
+
+# Keys taken from the data, like CustomDeck ids, are not remembered
+# without bound.
+def test_seekURL_key_memo_bounded():
+    from tts_tools.libtts import _classify_key
+    from tts_tools.libtts import _key_kinds
+
+    known = dict(_key_kinds)
+    decks = {
+        str(i): {"FaceURL": "http://example.com/{}.png".format(i)}
+        for i in range(10000)
+    }
+    urls = [url for _, url in seekURL(dict(CustomDeck=decks))]
+    assert len(urls) == 10000
+    assert _key_kinds == known
+    assert _classify_key.cache_info().currsize <= _classify_key.cache_info().maxsize
 
 
 # is_obj selects expected mesh URLs from the fixture.
@@ -103,6 +175,22 @@ def test_is_pdf_non_pdf_keys():
     pass
 
 
+# Meshes and asset bundles accept their MIME types by prefix, including
+# ones carrying parameters
+@pytest.mark.parametrize(
+    "kind, mime",
+    [
+        (AssetKind.OBJ, "text/plain; charset=utf-8"),
+        (AssetKind.OBJ, "application/octet-stream;x-vendor=1"),
+        (AssetKind.ASSETBUNDLE, "application/octet-stream; charset=binary"),
+        (AssetKind.ASSETBUNDLE, "application/binary-unity"),
+    ],
+)
+def test_asset_kind_accepts_prefix(kind, mime):
+    assert kind.accepts(mime)
+    assert not kind.accepts("text/html; charset=utf-8")
+
+
 # recodeURL rewrites URLs as expected
 @pytest.mark.skip
 def test_recodeURL():
@@ -110,18 +198,123 @@ def test_recodeURL():
 
 
 # get_fs_path returns cache paths as expected
-@pytest.mark.skip
-def test_get_fs_path():
-    pass
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        (["MeshURL"], os.path.join("Mods", "Models", "httpexamplecomx.obj")),
+        (
+            ["AssetbundleURL"],
+            os.path.join("Mods", "Assetbundles", "httpexamplecomx.unity3d"),
+        ),
+        (["PDFUrl"], os.path.join("Mods", "PDF", "httpexamplecomx.PDF")),
+        (["ImageURL"], os.path.join("Mods", "Images", "httpexamplecomx")),
+    ],
+)
+def test_get_fs_path(tmp_path, monkeypatch, path, expected):
+    monkeypatch.chdir(tmp_path)
+    assert get_fs_path(path, "http://example.com/x") == expected
+
+
+# classify agrees with the is_* predicates
+@pytest.mark.parametrize(
+    "path,kind",
+    [
+        (["ObjectStates", "CustomMesh", "MeshURL"], AssetKind.OBJ),
+        (["ObjectStates", "CustomMesh", "ColliderURL"], AssetKind.OBJ),
+        (["CustomAssetbundle", "AssetbundleURL"], AssetKind.ASSETBUNDLE),
+        (["AudioLibrary"], AssetKind.AUDIO),
+        (["CurrentAudioURL"], AssetKind.AUDIO),
+        (["CustomPDF", "PDFUrl"], AssetKind.PDF),
+        (["ObjectStates", "LuaScript"], AssetKind.SCRIPT),
+        (["CustomUIAssets", "URL"], AssetKind.CUSTOM_UI),
+        (["CustomImage", "ImageURL"], AssetKind.IMAGE),
+        (["TableURL"], AssetKind.IMAGE),
+    ],
+)
+def test_classify(path, kind):
+    assert classify(path, "http://example.com/x") is kind
+    assert is_image(path, "") == (kind is AssetKind.IMAGE)
+
+
+# AssetKind accepts the MIME types expected for its kind
+def test_asset_kind_accepts():
+    assert AssetKind.AUDIO.accepts("audio/mpeg")
+    assert not AssetKind.AUDIO.accepts("text/html")
+    assert AssetKind.OBJ.accepts("text/plain")
+    assert not AssetKind.IMAGE.accepts("text/html")
+
+
+@pytest.fixture
+def save_file(save, tmp_path):
+    filename = tmp_path / "save.json"
+    filename.write_text(json.dumps(save), encoding="utf-8")
+    return str(filename)
 
 
 # urls_from_save returns expected URLs from a save file fixture
-@pytest.mark.skip
-def test_urls_from_save():
-    pass
+@pytest.mark.parametrize("stream", [False, True])
+def test_urls_from_save(save, save_file, stream):
+    assert list(urls_from_save(save_file, stream=stream)) == list(seekURL(save))
+
+
+# urls_from_save rejects saves which are not JSON objects
+@pytest.mark.parametrize("stream", [False, True])
+def test_urls_from_save_not_a_save(tmp_path, stream):
+    filename = tmp_path / "list.json"
+    filename.write_text("[]")
+    with pytest.raises(IllegalSavegameException):
+        urls_from_save(str(filename), stream=stream)
 
 
 # get_save_name extracts the save file name from a save file fixture
-@pytest.mark.skip
-def test_get_save_name():
-    pass
+@pytest.mark.parametrize("stream", [False, True])
+def test_get_save_name(save_file, stream):
+    assert get_save_name(save_file, stream=stream) == "Fixture"
+
+
+# SaveDocument parses the save only once
+def test_save_document_parses_once(save, save_file, monkeypatch):
+    calls = []
+    real_load = json.load
+
+    def counting_load(*args, **kwargs):
+        calls.append(1)
+        return real_load(*args, **kwargs)
+
+    monkeypatch.setattr(json, "load", counting_load)
+    doc = SaveDocument(save_file)
+    assert doc.save_name == "Fixture"
+    assert list(doc.urls()) == list(seekURL(save))
+    assert doc.thumbnail is None
+    assert len(calls) == 1
+
+
+# scan_lua_script keeps URLs with a known extension or extension-less site
+def test_scan_lua_script():
+    script = (
+        "local a = 'http://example.com/card.PNG?x=1'\n"
+        "local b = 'https://pastebin.com/raw/abc'\n"
+        "local c = 'https://example.com/page'\n"
+    )
+    assert scan_lua_script(script) == [
+        "http://example.com/card.PNG?x=1",
+        "https://pastebin.com/raw/abc",
+    ]
+
+
+# plan_saves extracts URLs in worker processes, keeping order and errors
+def test_plan_saves(save, save_file, tmp_path):
+    bad_file = tmp_path / "bad.json"
+    bad_file.write_text("[]")
+
+    planned = list(plan_saves([save_file, str(bad_file), save_file], jobs=2))
+
+    assert [doc.filename for doc in planned] == [
+        save_file,
+        str(bad_file),
+        save_file,
+    ]
+    assert planned[0].save_name == "Fixture"
+    assert list(planned[2].urls()) == list(seekURL(save))
+    with pytest.raises(IllegalSavegameException):
+        planned[1].urls()
@@ -0,0 +1,294 @@
+from tts_tools.libhttp import ConnectionPool
+from tts_tools.libtts import IMGPATH
+from tts_tools.libtts import recodeURL
+from tts_tools.prefetch import HostLimiter
+from tts_tools.prefetch import prefetch_file
+from tts_tools.prefetch import prefetch_files
+from tts_tools.prefetch import Segmenter
+from tts_tools.prefetch.cli import parser
+
+import http.server
+import json
+import os
+import pytest
+import threading
+import time
+
+
+# Served in two halves by /flaky, with a dropped connection in between.
+FLAKY = bytes(range(256)) * 256
+
+
+class AssetHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Requests being served right now, and the most at once.
+    active = 0
+    max_active = 0
+    # Responses which had a body.
+    bodies = 0
+    # The Range headers of requests for /flaky and /big.
+    ranges = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(0.05)
+            if self.path.startswith("/missing"):
+                self.send_error(404)
+                return
+            if self.path.startswith("/flaky"):
+                self.send_flaky()
+                return
+            if self.path.startswith("/big"):
+                self.send_big()
+                return
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", "3")
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(b"png")
+            with cls.lock:
+                cls.bodies += 1
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def send_flaky(self):
+        byte_range = self.headers.get("Range")
+        type(self).ranges.append(byte_range)
+        if byte_range and self.headers.get("If-Range") == '"big"':
+            start = int(byte_range[len("bytes="):-1])
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                "bytes {}-{}/{}".format(start, len(FLAKY) - 1, len(FLAKY)),
+            )
+            body = FLAKY[start:]
+            length = len(body)
+        else:
+            self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            # Promise all of it, but only send half.
+            body = FLAKY[: len(FLAKY) // 2]
+            length = len(FLAKY)
+            self.close_connection = True
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", '"big"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_big(self):
+        byte_range = self.headers.get("Range")
+        with type(self).lock:
+            type(self).ranges.append(byte_range)
+        if byte_range is None:
+            self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            body = FLAKY
+            length = len(body)
+        else:
+            first, last = byte_range[len("bytes="):].split("-")
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                "bytes {}-{}/{}".format(first, last, len(FLAKY)),
+            )
+            body = FLAKY[int(first):int(last) + 1]
+            length = len(body)
+            if int(first) == len(FLAKY) * 3 // 4:
+                # Cut the last segment short, the first time.
+                body = body[: len(body) // 2]
+                self.close_connection = True
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", '"big"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AssetHandler)
+    AssetHandler.max_active = 0
+    AssetHandler.bodies = 0
+    AssetHandler.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def write_mod(gamedata, urls):
+    save = dict(
+        SaveName="Concurrent",
+        ObjectStates=[{"CustomImage": {"ImageURL": url}} for url in urls],
+    )
+    filename = gamedata / "mod.json"
+    filename.write_text(json.dumps(save))
+    return str(filename)
+
+
+@pytest.fixture
+def gamedata(tmp_path, monkeypatch):
+    (tmp_path / IMGPATH).mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+# Hosts of a domain share its limit, and others get the default
+def test_host_limiter():
+    limiter = HostLimiter(default=3)
+    assert limiter.slot("i.imgur.com") is limiter.slot("imgur.com")
+    assert limiter.slot("example.com") is not limiter.slot("example.org")
+    assert limiter.slot("example.com")._initial_value == 3
+    assert limiter.slot("pastebin.com")._initial_value == 2
+
+
+# Files are downloaded concurrently, within the limit of their host, and
+# missing ones are listed as when downloading one at a time
+@pytest.mark.parametrize("jobs", [1, 8])
+def test_prefetch_jobs(server, gamedata, jobs):
+    pytest.importorskip("tqdm")
+
+    urls = ["{}/image{}.png".format(server, i) for i in range(12)]
+    urls.append("{}/missing.png".format(server))
+    filename = write_mod(gamedata, urls)
+
+    pool = ConnectionPool()
+    prefetch_file(
+        filename,
+        gamedata_dir=str(gamedata),
+        jobs=jobs,
+        limiter=HostLimiter(default=2),
+        pool=pool,
+    )
+    pool.close()
+
+    if jobs > 1:
+        assert 1 < AssetHandler.max_active <= 2
+    for url in urls[:-1]:
+        assert os.path.isfile(os.path.join(IMGPATH, recodeURL(url) + ".png"))
+    with open(gamedata / "mod [Concurrent] missing.txt") as infile:
+        assert infile.read().startswith(urls[-1])
+    # At most one connection per concurrent download is opened, and one
+    # more after the error, which closes its connection.
+    assert pool.misses <= min(jobs, 2) + 1
+
+
+# Validators are recorded on every download, so that refetching
+# unchanged files only costs their headers
+def test_prefetch_revalidate(server, gamedata, monkeypatch):
+    pytest.importorskip("tqdm")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(gamedata / "cache"))
+
+    urls = ["{}/image{}.png".format(server, i) for i in range(3)]
+    filename = write_mod(gamedata, urls)
+
+    for options in ([], ["--refetch"], ["--refetch"]):
+        args = parser.parse_args(
+            ["--gamedata", str(gamedata), "--no-cache-index", *options, filename]
+        )
+        prefetch_files(args)
+
+    assert AssetHandler.bodies == len(urls)
+    for url in urls:
+        path = os.path.join(IMGPATH, recodeURL(url) + ".png")
+        with open(path, "rb") as infile:
+            assert infile.read() == b"png"
+
+
+# With --prefetch_all, a mod which could not be prefetched completely is
+# selected again once its missing files have been cached, and not before
+def test_prefetch_all_missing(server, gamedata, capsys):
+    pytest.importorskip("tqdm")
+
+    urls = ["{}/image.png".format(server), "{}/missing.png".format(server)]
+    write_mod(gamedata, urls)
+
+    def prefetch_all():
+        args = parser.parse_args(
+            [
+                "--gamedata",
+                str(gamedata),
+                "--no-cache-index",
+                "--verbose",
+                "--prefetch_all",
+                str(gamedata),
+            ]
+        )
+        prefetch_files(args)
+        return "mod.json [Concurrent]" in capsys.readouterr().out
+
+    assert prefetch_all()
+    assert not prefetch_all()
+
+    path = os.path.join(IMGPATH, recodeURL(urls[1]) + ".png")
+    with open(path, "wb") as outfile:
+        outfile.write(b"png")
+    assert prefetch_all()
+    assert not prefetch_all()
+
+
+# Interrupted downloads are kept, and resumed where they stopped
+def test_prefetch_resume(server, gamedata):
+    pytest.importorskip("tqdm")
+
+    url = "{}/flaky.png".format(server)
+    filename = write_mod(gamedata, [url])
+    path = os.path.join(IMGPATH, recodeURL(url) + ".png")
+
+    with pytest.raises(SystemExit):
+        prefetch_file(filename, gamedata_dir=str(gamedata), timeout_retries=1)
+    assert not os.path.exists(path)
+    assert os.path.getsize(path + ".part") == len(FLAKY) // 2
+
+    prefetch_file(filename, gamedata_dir=str(gamedata))
+    assert AssetHandler.ranges == [None, "bytes={}-".format(len(FLAKY) // 2)]
+    with open(path, "rb") as infile:
+        assert infile.read() == FLAKY
+    assert os.listdir(IMGPATH) == [os.path.basename(path)]
+
+
+# Large files are downloaded in segments, which are retried from where
+# they were cut short
+def test_prefetch_segments(server, gamedata):
+    pytest.importorskip("tqdm")
+
+    url = "{}/big.png".format(server)
+    filename = write_mod(gamedata, [url])
+
+    prefetch_file(
+        filename,
+        gamedata_dir=str(gamedata),
+        pool=ConnectionPool(),
+        segmenter=Segmenter(segments=4, threshold=1024),
+    )
+
+    quarter = len(FLAKY) // 4
+    assert sorted(AssetHandler.ranges, key=str) == sorted(
+        [None]
+        + [
+            "bytes={}-{}".format(start, start + quarter - 1)
+            for start in range(quarter, len(FLAKY), quarter)
+        ]
+        + ["bytes={}-{}".format(quarter * 3 + quarter // 2, len(FLAKY) - 1)],
+        key=str,
+    )
+    with open(os.path.join(IMGPATH, recodeURL(url) + ".png"), "rb") as infile:
+        assert infile.read() == FLAKY
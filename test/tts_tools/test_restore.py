@@ -0,0 +1,100 @@
+from tts_tools.restore import read_metadata
+from tts_tools.restore import Restore
+from tts_tools.restore import target_path
+from tts_tools.util import default_file_mode
+
+import json
+import os
+import pytest
+import stat
+import zipfile
+
+
+@pytest.fixture
+def backup(tmp_path):
+    filename = tmp_path / "backup.zip"
+    with zipfile.ZipFile(filename, "w") as outfile:
+        outfile.writestr("Mods/Images/table.jpg", b"table")
+        outfile.writestr("Mods/Images/sky.jpg", b"sky")
+        outfile.writestr("Mods/Workshop/mod.json", b"{}")
+        outfile.writestr("missing.txt", "Mods/Images/card.png\n")
+        outfile.comment = json.dumps(dict(comment="test")).encode("utf-8")
+    gamedata = tmp_path / "gamedata"
+    gamedata.mkdir()
+    return str(filename), str(gamedata)
+
+
+def run(restore, infile_name):
+    tasks, manifest, missing = restore.plan(infile_name)
+    results = [task[0](*task[1:]) for task in tasks]
+    restore.close()
+    return results, manifest, missing
+
+
+# Backups are restored with their metadata, skipping identical files
+def test_restore(backup):
+    infile_name, gamedata = backup
+
+    results, manifest, missing = run(Restore(gamedata), infile_name)
+    assert results == [True, True, True]
+    assert manifest == dict(comment="test")
+    assert missing == ["Mods/Images/card.png"]
+    assert not os.path.exists(os.path.join(gamedata, "missing.txt"))
+    with open(os.path.join(gamedata, "Mods", "Images", "table.jpg"), "rb") as infile:
+        assert infile.read() == b"table"
+
+    with open(os.path.join(gamedata, "Mods", "Images", "sky.jpg"), "wb") as outfile:
+        outfile.write(b"SKY")
+    restore = Restore(gamedata)
+    results, _, _ = run(restore, infile_name)
+    assert results == [False, True, False]
+    assert restore.counts == dict(written=1, skipped=2)
+    # No temporary files are left behind.
+    images = os.path.join(gamedata, "Mods", "Images")
+    assert sorted(os.listdir(images)) == ["sky.jpg", "table.jpg"]
+
+
+# Restored files get the mode of new files, or keep the one of the file
+# they replace, rather than the owner-only mode of temporary files
+def test_restore_mode(backup):
+    infile_name, gamedata = backup
+    umask = os.umask(0o022)
+    default_file_mode.cache_clear()
+    try:
+        run(Restore(gamedata), infile_name)
+    finally:
+        os.umask(umask)
+        default_file_mode.cache_clear()
+
+    images = os.path.join(gamedata, "Mods", "Images")
+    assert stat.S_IMODE(os.stat(os.path.join(images, "table.jpg")).st_mode) == 0o644
+
+    sky = os.path.join(images, "sky.jpg")
+    with open(sky, "wb") as outfile:
+        outfile.write(b"SKY")
+    os.chmod(sky, 0o640)
+    run(Restore(gamedata), infile_name)
+    assert stat.S_IMODE(os.stat(sky).st_mode) == 0o640
+
+
+# Files in several backups are restored once
+def test_restore_shared(backup):
+    infile_name, gamedata = backup
+    restore = Restore(gamedata)
+    assert len(restore.plan(infile_name)[0]) == 3
+    assert restore.plan(infile_name)[0] == []
+
+
+# Members outside of the gamedata directory are refused
+@pytest.mark.parametrize("name", ["../evil", "/etc/evil", "Mods/../../evil"])
+def test_target_path(name):
+    with pytest.raises(ValueError):
+        target_path("gamedata", name)
+
+
+# Backups without a MANIFEST have no metadata
+def test_read_metadata(tmp_path):
+    with zipfile.ZipFile(tmp_path / "backup.zip", "w") as outfile:
+        outfile.writestr("Mods/Workshop/mod.json", b"{}")
+    with zipfile.ZipFile(tmp_path / "backup.zip") as infile:
+        assert read_metadata(infile) == ({}, [])
@@ -0,0 +1,269 @@
+from tts_tools.util import CompressionPolicy
+from tts_tools.util import CompressionStats
+from tts_tools.util import IncrementalZipFile
+from tts_tools.util import member_span
+from tts_tools.util import PrintStatus
+from tts_tools.util import ResumableZipFile
+from tts_tools.util import SnapshotDir
+from tts_tools.util import TarFile
+from tts_tools.util import ZipFile
+
+import io
+import json
+import os
+import pytest
+import tarfile
+import zipfile
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = []
+    for i in range(20):
+        name = "file{}.txt".format(i)
+        (tmp_path / name).write_bytes(os.urandom(100) + b"table " * 1000 * i)
+        names.append(name)
+    return names
+
+
+def write_zip(filename, names, **kwargs):
+    ps = PrintStatus(verbose=False)
+    with ZipFile(filename, "w", deflate=True, ps=ps, **kwargs) as outfile:
+        for name in names:
+            outfile.write(name)
+    return outfile
+
+
+# Compressing in a thread pool yields the same members, in the same order
+def test_parallel_deflate(files, tmp_path):
+    write_zip(tmp_path / "serial.zip", files + files[:3], jobs=1)
+    write_zip(tmp_path / "parallel.zip", files + files[:3], jobs=4)
+
+    with zipfile.ZipFile(tmp_path / "serial.zip") as serial, zipfile.ZipFile(
+        tmp_path / "parallel.zip"
+    ) as parallel:
+        assert parallel.testzip() is None
+        assert parallel.namelist() == serial.namelist() == files
+        for name in files:
+            info = parallel.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+            assert info.CRC == serial.getinfo(name).CRC
+            assert parallel.read(name) == serial.read(name)
+
+
+# Missing files are counted and listed, whether compressed in parallel or not
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_parallel_deflate_missing(files, tmp_path, jobs):
+    names = files[:5] + ["missing.png"] + files[5:]
+    outfile = write_zip(tmp_path / "out.zip", names, jobs=jobs, ignore_missing=True)
+
+    assert outfile.num_missing == 1
+    with zipfile.ZipFile(tmp_path / "out.zip") as infile:
+        assert infile.namelist() == files + ["missing.txt"]
+        assert infile.read("missing.txt") == b"missing.png\n"
+
+
+def update_zip(filename, names, **kwargs):
+    ps = PrintStatus(verbose=False)
+    with IncrementalZipFile(
+        filename, "a", deflate=True, ps=ps, ignore_missing=True, **kwargs
+    ) as outfile:
+        for name in names:
+            outfile.write(name)
+        outfile.put_metadata()
+    return outfile
+
+
+# An unchanged backup is left alone entirely
+def test_incremental_unchanged(files, tmp_path):
+    update_zip(tmp_path / "out.zip", files)
+    data = (tmp_path / "out.zip").read_bytes()
+
+    outfile = update_zip(tmp_path / "out.zip", files)
+    assert not outfile.changed
+    assert (tmp_path / "out.zip").read_bytes() == data
+
+
+# Changed files replace their members, and dropped files are removed
+def test_incremental_changed(files, tmp_path):
+    update_zip(tmp_path / "out.zip", files)
+    with zipfile.ZipFile(tmp_path / "out.zip") as infile:
+        offset = infile.getinfo(files[2]).header_offset
+
+    (tmp_path / files[1]).write_bytes(b"changed")
+    os.utime(tmp_path / files[1], (0, 1e9))
+    outfile = update_zip(tmp_path / "out.zip", files[:-1] + ["new.png"])
+
+    assert outfile.changed
+    with zipfile.ZipFile(tmp_path / "out.zip") as infile:
+        assert infile.testzip() is None
+        assert infile.getinfo(files[2]).header_offset == offset
+        assert sorted(infile.namelist()) == sorted(files[:-1] + ["missing.txt"])
+        assert infile.read(files[1]) == b"changed"
+        assert infile.read(files[2]) == (tmp_path / files[2]).read_bytes()
+        assert infile.read("missing.txt") == b"new.png\n"
+
+
+# Archives are compacted once replaced members take up too much space
+def test_incremental_compact(files, tmp_path):
+    update_zip(tmp_path / "out.zip", files)
+
+    for name in files[10:]:
+        (tmp_path / name).write_bytes(b"changed")
+    update_zip(tmp_path / "out.zip", files)
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as infile:
+        assert infile.testzip() is None
+        assert sorted(infile.namelist()) == sorted(files)
+        assert infile.read(files[15]) == b"changed"
+        total = sum(member_span(zinfo) for zinfo in infile.infolist())
+        assert infile.start_dir == total
+
+
+class Interrupted(Exception):
+    pass
+
+
+# An interrupted archive is continued from its checkpoint, keeping the
+# members written before which are unchanged
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_resumable(files, tmp_path, jobs):
+    filename = str(tmp_path / "out.zip.partial")
+    ps = PrintStatus(verbose=False)
+
+    with pytest.raises(Interrupted):
+        with ResumableZipFile(filename, deflate=True, jobs=jobs, ps=ps, checkpoint_size=1) as outfile:
+            for name in files[:10]:
+                outfile.write(name)
+            outfile.flush()
+            raise Interrupted
+    assert os.path.exists(filename + ".checkpoint")
+
+    (tmp_path / files[1]).write_bytes(b"changed")
+    os.utime(tmp_path / files[1], (0, 1e9))
+    with ResumableZipFile(filename, deflate=True, jobs=jobs, ps=ps) as outfile:
+        assert outfile.num_recovered == 10
+        for name in files:
+            outfile.write(name)
+    assert outfile.kept == set(files[:10]) - {files[1]}
+    assert not os.path.exists(filename + ".checkpoint")
+
+    with zipfile.ZipFile(filename) as infile:
+        assert infile.testzip() is None
+        assert sorted(infile.namelist()) == sorted(files)
+        assert infile.read(files[1]) == b"changed"
+
+
+# The policy stores compressed formats, and deflates the others if they
+# compress
+@pytest.mark.parametrize(
+    "name,data,compress_type",
+    [
+        ("image.PNG", b"a" * 1000, zipfile.ZIP_STORED),
+        ("model.obj", os.urandom(1000), zipfile.ZIP_DEFLATED),
+        ("other.bin", b"a" * 1000, zipfile.ZIP_DEFLATED),
+        ("other.bin", os.urandom(1000), zipfile.ZIP_STORED),
+    ],
+)
+def test_compression_policy(tmp_path, name, data, compress_type):
+    (tmp_path / name).write_bytes(data)
+    policy = CompressionPolicy()
+    assert policy(str(tmp_path / name))[0] == compress_type
+
+
+# Files are compressed according to the policy, and savings are counted
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_compression_policy_zip(tmp_path, monkeypatch, jobs):
+    monkeypatch.chdir(tmp_path)
+    for path in ["Images", "Models"]:
+        (tmp_path / path).mkdir()
+    (tmp_path / "Images" / "a.png").write_bytes(b"png" * 1000)
+    (tmp_path / "Models" / "a.obj").write_bytes(b"v 0 0 0\n" * 1000)
+
+    stats = CompressionStats()
+    with ZipFile(
+        tmp_path / "out.zip",
+        "w",
+        ps=PrintStatus(verbose=False),
+        policy=CompressionPolicy(),
+        stats=stats,
+        jobs=jobs,
+    ) as outfile:
+        outfile.write(os.path.join("Images", "a.png"))
+        outfile.write(os.path.join("Models", "a.obj"))
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as infile:
+        assert infile.testzip() is None
+        assert infile.getinfo("Images/a.png").compress_type == zipfile.ZIP_STORED
+        assert infile.getinfo("Models/a.obj").compress_type == zipfile.ZIP_DEFLATED
+        assert infile.read("Models/a.obj") == b"v 0 0 0\n" * 1000
+
+    assert stats.kinds["Images"] == [1, 3000, 3000]
+    assert stats.kinds["Models"][:2] == [1, 8000]
+    assert stats.kinds["Models"][2] < 8000
+
+
+class Pipe(io.RawIOBase):
+    """A sink which cannot seek, like stdout redirected to a pipe."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+# Archives can be written to sinks which cannot seek
+@pytest.mark.parametrize("archive_class", [ZipFile, ResumableZipFile, TarFile])
+def test_write_to_pipe(files, archive_class):
+    pipe = Pipe()
+    with archive_class(
+        pipe, "w", deflate=True, ps=PrintStatus(verbose=False), ignore_missing=True
+    ) as outfile:
+        for name in files[:3] + ["missing.png"]:
+            outfile.write(name)
+        outfile.put_metadata(comment="piped")
+
+    data = io.BytesIO(bytes(pipe.data))
+    if archive_class is not TarFile:
+        with zipfile.ZipFile(data) as infile:
+            assert infile.testzip() is None
+            names = infile.namelist()
+            assert json.loads(infile.comment)["comment"] == "piped"
+    else:
+        with tarfile.open(fileobj=data) as infile:
+            names = infile.getnames()
+            manifest = json.loads(infile.extractfile("MANIFEST").read())
+            assert manifest["comment"] == "piped"
+    assert files[:3] + ["missing.txt"] == [
+        name for name in names if name != "MANIFEST"
+    ]
+
+
+# Snapshots link the files into a directory, replacing older snapshots
+def test_snapshot(files, tmp_path):
+    for _ in range(2):
+        with SnapshotDir(
+            str(tmp_path / "snapshot"), ps=PrintStatus(verbose=False), ignore_missing=True
+        ) as outfile:
+            for name in files[:3] + ["missing.png"]:
+                outfile.write(name, "Mods/Images/" + name)
+            outfile.put_metadata()
+
+    assert sorted(os.listdir(tmp_path / "snapshot")) == [
+        "MANIFEST",
+        "Mods",
+        "missing.txt",
+    ]
+    assert sorted(os.listdir(tmp_path / "snapshot" / "Mods" / "Images")) == sorted(
+        files[:3]
+    )
+    assert not os.path.exists(tmp_path / "snapshot.partial")
+    assert sum(outfile.counts.values()) == 3
+    snapshot_file = tmp_path / "snapshot" / "Mods" / "Images" / files[1]
+    assert snapshot_file.read_bytes() == (tmp_path / files[1]).read_bytes()